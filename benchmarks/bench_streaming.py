@@ -0,0 +1,113 @@
+"""
+    Localhost throughput of the sample stream server. Raw chunks are
+    published as fast as possible to a number of reading subscribers and
+    one that never reads, which must be dropped (TCP) without slowing the
+    others or the publisher.
+
+        python -m benchmarks.bench_streaming --seconds 5 --clients 4 --chunk 32
+
+    Reports publish time per chunk (what acquisition pays), samples/s
+    delivered to each reading client, and whether the samples arrived
+    complete and in order.
+"""
+import json
+import time
+import socket
+import argparse
+import threading
+import numpy as np
+
+from helpers.my_streaming import StreamServer, StreamClient
+from benchmarks.run_benchmarks import summarize
+
+
+def read_client(port, transport, stats, stop):
+    client = StreamClient(port = port, transport = transport, timeout = 1)
+    expected = 0
+    samples = 0
+    holes = 0
+    try:
+        for source, channel, counter, timestamp, values in client.frames():
+            if counter != expected:
+                holes += 1
+            expected = counter + len(values)
+            samples += len(values)
+            stats['samples'] = samples
+            stats['holes'] = holes
+            if stop.is_set():
+                break
+    except (socket.timeout, OSError):
+        pass
+    finally:
+        client.close()
+
+def bench_streaming(seconds, clients, chunk, transport = 'tcp', stalled = True):
+    server = StreamServer(port = 0, transport = transport, max_buffer = 1 << 20)
+    server.start()
+    port = server.address[1]
+
+    stop = threading.Event()
+    stats = [{'samples': 0, 'holes': 0} for i in range(clients)]
+    threads = [threading.Thread(target = read_client, args = (port, transport, s, stop), daemon = True) for s in stats]
+    for t in threads:
+        t.start()
+    # connected but never reads
+    idle = socket.create_connection(server.address) if stalled and transport == 'tcp' else None
+    time.sleep(0.5)
+    subscribers = len(server.subscribers)
+
+    values = (np.arange(chunk) % 2000 - 1000).astype(np.int16)
+    times = []
+    start = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        t = time.perf_counter()
+        server.on_chunk(start, {'raw': values, 'received': time.monotonic()})
+        times.append(time.perf_counter() - t)
+        start += chunk
+        if transport == 'udp':
+            time.sleep(0) # let the readers keep up with datagrams
+
+    time.sleep(0.5)
+    remaining = len(server.subscribers)
+    stop.set()
+    server.stop()
+    if idle is not None:
+        idle.close()
+
+    publish = summarize(times, start)
+    return {
+        'transport': transport,
+        'chunk': chunk,
+        'published_samples': start,
+        'publish': publish,
+        'subscribers': subscribers,
+        'subscribers_left': remaining,
+        'clients': [{'samples_per_s': s['samples'] / seconds, 'complete': s['samples'] == start and s['holes'] == 0,
+                     'holes': s['holes']} for s in stats],
+        'mb_per_s': server.bytes / seconds / 1e6,
+    }
+
+def main():
+    argParser = argparse.ArgumentParser(description = 'Throughput of the local sample stream.')
+    argParser.add_argument('--seconds', type = float, default = 5)
+    argParser.add_argument('--clients', type = int, default = 4)
+    argParser.add_argument('--chunk', type = int, default = 32, help = 'raw samples per published chunk')
+    argParser.add_argument('--udp', action = 'store_true')
+    argParser.add_argument('--output', help = 'write the results as JSON')
+    args = argParser.parse_args()
+
+    result = bench_streaming(args.seconds, args.clients, args.chunk, 'udp' if args.udp else 'tcp')
+    p = result['publish']
+    print(f"[{result['transport']}] {result['published_samples']} samples in chunks of {result['chunk']}, "
+          f"publish p50 {p['ms_p50']:.3f} ms  p99 {p['ms_p99']:.3f} ms  max {p['ms_max']:.3f} ms")
+    print(f"  {result['mb_per_s']:.1f} MB/s sent, subscribers {result['subscribers']} -> {result['subscribers_left']}")
+    for i, c in enumerate(result['clients']):
+        print(f"  client {i}: {c['samples_per_s']:.0f} samples/s  complete {c['complete']}  holes {c['holes']}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent = 2)
+
+
+if __name__ == '__main__':
+    main()
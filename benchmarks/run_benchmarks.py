@@ -0,0 +1,199 @@
+"""
+    Benchmarks for the acquisition and live view pipeline on synthetic
+    ThinkGear streams, no headset or display needed.
+
+        python -m benchmarks.run_benchmarks --seconds 60 --output bench.json
+
+    Frame stages are timed per 40 ms frame, as DAGUI.update runs them, and
+    report ms per frame percentiles and throughput in samples/s. Results are
+    written as JSON so runs can be compared.
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+import datetime
+import tracemalloc
+import numpy as np
+import scipy
+
+from helpers.my_bluetooth import DataRecorder, DataParser
+from helpers.my_data_processing import StreamingFilter, WelchEstimator, filter_data, get_power, normalize
+from helpers.my_features import BandPowers
+from helpers.my_pipeline import FramePipeline
+from benchmarks.synthetic import synthetic_stream
+
+
+PROFILES = {'realistic': 1.0, 'stress': 10.0}
+FRAME_MS = 40
+SF = 512
+
+
+def summarize(times, samples):
+    """ times in seconds per frame, samples processed over all frames """
+    ms = np.asarray(times) * 1000
+    total = float(np.sum(times))
+    return {
+        'frames': len(ms),
+        'ms_p50': float(np.percentile(ms, 50)),
+        'ms_p95': float(np.percentile(ms, 95)),
+        'ms_p99': float(np.percentile(ms, 99)),
+        'ms_max': float(np.max(ms)),
+        'samples_per_s': samples / total if total > 0 else float('inf'),
+    }
+
+def frames_of(stream, rate, frame_ms = FRAME_MS):
+    """ splits a stream into the byte chunks that arrive during one frame """
+    size = int(SF*rate*8*frame_ms/1000)
+    return [stream[k:k+size] for k in range(0, len(stream), size)]
+
+def bench_parser(frames, reference):
+    recorder = DataRecorder()
+    parser = DataParser(recorder, reference = reference)
+    times = []
+    for chunk in frames:
+        t = time.perf_counter()
+        parser.feed(chunk)
+        times.append(time.perf_counter() - t)
+    return summarize(times, recorder.raw_count())
+
+def run_frames(frames, step):
+    """ feeds the frames into a recorder (untimed) and times step(recorder) after each """
+    recorder = DataRecorder()
+    parser = DataParser(recorder)
+    times = []
+    for chunk in frames:
+        parser.feed(chunk)
+        t = time.perf_counter()
+        step(recorder)
+        times.append(time.perf_counter() - t)
+    return summarize(times, recorder.raw_count())
+
+def legacy_band_powers(freqScale, power):
+    bands = [1, 4, 8, 13, 30, 45]
+    avgPow = []
+    for i in range(len(bands)-1):
+        argMinF = np.argmin(np.abs(freqScale-bands[i]))
+        argMaxF = np.argmin(np.abs(freqScale-bands[i+1]))
+        avgPow.append(np.sum(power[argMinF:argMaxF]) / (bands[i+1]-bands[i]))
+    return normalize(avgPow)
+
+def bench_stages(frames, rate):
+    results = {}
+    results['parser_bulk'] = bench_parser(frames, reference = False)
+    # the byte-at-a-time generator is slow, a few seconds are enough
+    results['parser_reference'] = bench_parser(frames[:int(10*1000/FRAME_MS)], reference = True)
+    # MultiplexedReader feeds the parser every feed_interval, half a frame
+    reads = frames_of(b''.join(frames), rate, frame_ms = FRAME_MS // 2)
+    results['parser_bulk_reads'] = bench_parser(reads, reference = False)
+    results['parser_reference_reads'] = bench_parser(reads[:int(10*1000*2/FRAME_MS)], reference = True)
+
+    results['recorder_windows'] = run_frames(frames, lambda r: (r.get_last_n_raw_second(20), r.get_last_n_raw_second(5)))
+
+    results['filter_legacy'] = run_frames(frames, lambda r: filter_data(r.get_last_n_raw_second(5)))
+    streamingFilter = StreamingFilter(SF)
+    results['filter_streaming'] = run_frames(frames, streamingFilter.update)
+
+    results['spectrum_legacy'] = run_frames(frames, lambda r: get_power(filter_data(r.get_last_n_raw_second(5)), SF))
+    specFilter, spectrum = StreamingFilter(SF), WelchEstimator(SF)
+    def welch_step(r):
+        spectrum.process(specFilter.update(r))
+        return spectrum.power()
+    results['spectrum_welch'] = run_frames(frames, welch_step)
+
+    freqScale, power = get_power(np.random.default_rng(0).normal(size=SF*5), SF)
+    bandPowers = BandPowers(freqScale)
+    results['bands_legacy'] = run_frames(frames, lambda r: legacy_band_powers(freqScale, power))
+    results['bands_matrix'] = run_frames(frames, lambda r: bandPowers.compute(power))
+    stack = np.tile(power, (10000, 1))
+    t = time.perf_counter()
+    bandPowers.compute(stack)
+    elapsed = time.perf_counter() - t
+    results['bands_batch'] = {'windows': len(stack), 'ms_total': elapsed*1000, 'windows_per_s': len(stack)/elapsed}
+
+    pipeline = FramePipeline(SF)
+    results['frame_compute'] = run_frames(frames, pipeline.compute)
+
+    # acquisition and computation together, what one tick costs end to end
+    recorder = DataRecorder()
+    parser = DataParser(recorder)
+    pipeline = FramePipeline(SF)
+    times = []
+    for chunk in frames:
+        t = time.perf_counter()
+        parser.feed(chunk)
+        pipeline.compute(recorder)
+        times.append(time.perf_counter() - t)
+    results['frame_full'] = summarize(times, recorder.raw_count())
+    return results
+
+def bench_memory(hours, rate, history_sec):
+    """ feeds simulated hours as fast as possible and tracks traced memory """
+    tracemalloc.start()
+    recorder = DataRecorder(history_sec = history_sec)
+    parser = DataParser(recorder)
+    pipeline = FramePipeline(SF)
+    base = tracemalloc.get_traced_memory()[0]
+
+    points = []
+    minutes = int(np.ceil(hours*60))
+    for m in range(minutes):
+        stream = synthetic_stream(60, SF, rate, start = m*60)
+        for chunk in frames_of(stream, rate, frame_ms = 1000):
+            parser.feed(chunk)
+        pipeline.compute(recorder)
+        del stream
+        if (m + 1) % 10 == 0 or m + 1 == minutes:
+            current = tracemalloc.get_traced_memory()[0]
+            points.append({'simulated_min': m + 1, 'mb': (current - base) / 2**20})
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'history_sec': history_sec, 'growth': points, 'peak_mb': (peak - base) / 2**20}
+
+def main(argv = None):
+    argParser = argparse.ArgumentParser(description = 'Benchmark the curvex pipeline on synthetic data.')
+    argParser.add_argument('--seconds', type = float, default = 60, help = 'simulated seconds per stage')
+    argParser.add_argument('--profile', choices = list(PROFILES) + ['all'], default = 'all')
+    argParser.add_argument('--hours', type = float, default = 0.5, help = 'simulated hours for the memory run, 0 to skip')
+    argParser.add_argument('--history', type = int, default = 3600, help = 'recorder history length in seconds')
+    argParser.add_argument('--output', help = 'write results to this JSON file')
+    args = argParser.parse_args(argv)
+
+    report = {
+        'meta': {
+            'date': datetime.datetime.now().isoformat(),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'platform': platform.platform(),
+            'seconds': args.seconds,
+            'frame_ms': FRAME_MS,
+        },
+        'profiles': {},
+    }
+
+    profiles = PROFILES if args.profile == 'all' else {args.profile: PROFILES[args.profile]}
+    for name, rate in profiles.items():
+        frames = frames_of(synthetic_stream(args.seconds, SF, rate), rate)
+        report['profiles'][name] = {'rate': rate, 'stages': bench_stages(frames, rate)}
+        print(f'[{name}] {SF*rate:.0f} samples/s')
+        for stage, r in report['profiles'][name]['stages'].items():
+            if 'ms_p50' in r:
+                print(f'  {stage:22s} p50 {r["ms_p50"]:8.3f} ms  p99 {r["ms_p99"]:8.3f} ms  {r["samples_per_s"]:12.0f} samples/s')
+            else:
+                print(f'  {stage:22s} {r["windows_per_s"]:12.0f} windows/s')
+
+    if args.hours > 0:
+        report['memory'] = bench_memory(args.hours, 1.0, args.history)
+        print(f'[memory] {args.hours}h simulated, peak {report["memory"]["peak_mb"]:.1f} MB, '
+              f'final {report["memory"]["growth"][-1]["mb"]:.1f} MB')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent = 2)
+    return report
+
+
+if __name__ == '__main__':
+    main()
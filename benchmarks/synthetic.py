@@ -0,0 +1,44 @@
+import numpy as np
+
+from helpers.my_sources import encode_packet, encode_raw_packets
+
+
+def synthetic_samples(n, sf = 512, seed = 0, offset = 0):
+    """ EEG-like raw values: alpha and theta rhythms, noise and rare spikes """
+    rng = np.random.default_rng(seed + offset)
+    t = (np.arange(n) + offset) / sf
+    sig = 300*np.sin(2*np.pi*10*t) + 150*np.sin(2*np.pi*6*t) + rng.normal(0, 120, n)
+    spikes = rng.random(n) < 0.001
+    sig[spikes] = rng.choice([-1, 1], spikes.sum()) * 5000
+    return np.clip(sig, -32768, 32767).astype(np.int16)
+
+def esense_packet(rng):
+    """ the once per second packet: poor signal, 0x83 band powers, attention, meditation """
+    bands = rng.integers(0, 1 << 24, 8)
+    payload = [0x02, int(rng.integers(0, 30)), 0x83, 24]
+    for b in bands:
+        payload += [int(b) >> 16 & 0xff, int(b) >> 8 & 0xff, int(b) & 0xff]
+    payload += [0x04, int(rng.integers(1, 101)), 0x05, int(rng.integers(1, 101))]
+    return encode_packet(payload)
+
+def synthetic_stream(seconds, sf = 512, rate = 1.0, seed = 0, start = 0):
+    """
+        Bytes of a ThinkGear stream as a CURV headset sends them: raw packets
+        at sf*rate per simulated second, one eSense packet per second and a
+        blink packet every few seconds. rate > 1 simulates stress load.
+        start is the simulated second to begin at, so long streams can be
+        generated in pieces.
+    """
+    rng = np.random.default_rng(seed + start)
+    perSecond = int(sf*rate)
+    parts = []
+    for s in range(start, start + int(np.ceil(seconds))):
+        n = perSecond if s + 1 <= start + seconds else int(perSecond*(start + seconds - s))
+        raw = encode_raw_packets(synthetic_samples(n, sf, seed, offset = s*perSecond))
+        half = (n//2) * 8
+        parts.append(raw[:half])
+        parts.append(esense_packet(rng))
+        if s % 4 == 0:
+            parts.append(encode_packet([0x16, int(rng.integers(30, 200))]))
+        parts.append(raw[half:])
+    return b''.join(parts)
@@ -1,36 +1,184 @@
 import os
-import json
-import numpy as np
-import select
+import sys
+import time
 import datetime
 from uuid import uuid4
 
+from helpers.my_startup import StartupProfile
+# set up before the imports below so they are profiled too
+startup = StartupProfile(enabled = '--profile-startup' in sys.argv)
+
+import numpy as np
 import pyqtgraph as pg
 from PyQt5 import QtGui, QtCore, QtWidgets
 
-from helpers.my_bluetooth import *
-from helpers.my_data_processing import *
+# pybluez and scipy are only imported when first used
+from helpers.my_bluetooth import DataRecorder, DataParser, start_headset, search_blueetooth_devices
+from helpers.my_acquisition import Device, MultiplexedReader, BackgroundTask, reconnect
+from helpers.my_features import DEFAULT_BANDS
+from helpers.my_pipeline import FramePipeline
+from helpers.my_compute import ComputeProcess
+from helpers.my_metrics import FrameMetrics
+from helpers.my_scheduler import RenderScheduler
+from helpers.my_recordings import RECORDING_EXT, RecordingWriter
+from helpers.my_timing import detect_gaps, estimate_rate
+from helpers.my_streaming import StreamServer
+from helpers.my_catalog import RecordingCatalog
+
+startup.mark('imports')
+
+class AcquisitionSignals(QtCore.QObject):
+    """ carries acquisition thread events to the GUI thread, tagged with the device id """
+    error = QtCore.pyqtSignal(str, str)
+    disconnected = QtCore.pyqtSignal(str)
+    # discovery and connection tasks
+    progress = QtCore.pyqtSignal(str)
+    found = QtCore.pyqtSignal(object)
+    connected = QtCore.pyqtSignal(str, object)
+    connectFailed = QtCore.pyqtSignal(str, str)
+    # the recordings catalog was updated in the background
+    catalogChanged = QtCore.pyqtSignal()
+
+
+class SpectrogramTiles:
+    """
+        Scrolling spectrogram drawn as a ring of ImageItems, `width` columns
+        each, inside one group whose position scrolls them. A hop only
+        re-renders the tile its column lands in, so its cost does not grow
+        with the span. Levels are pushed to every tile only when they drift
+        by more than `tolerance` dB.
+    """
+    def __init__(self, plot, span, width = 8, tolerance = 1.0):
+        self.plot = plot
+        self.span = span
+        self.width = width
+        self.tolerance = tolerance
+        self.lut = pg.colormap.get('viridis').getLookupTable(nPts = 256)
+        self.group = pg.ItemGroup()
+        plot.addItem(self.group)
+        self.items = []
+        self.shape = None
+        self.reset()
+
+    def reset(self):
+        """ forgets every column, the next update draws the whole image """
+        for item in self.items:
+            item.clear()
+        self.blocks = [None]*len(self.items)
+        self.count = 0
+        self.levels = None
+
+    def _build(self, ncols, nbins):
+        for item in self.items:
+            self.plot.removeItem(item)
+        self.shape = (ncols, nbins)
+        # one spare tile for the partly filled newest block
+        ntiles = -(-ncols // self.width) + 1
+        self.items = []
+        for i in range(ntiles):
+            item = pg.ImageItem()
+            item.setLookupTable(self.lut)
+            self.group.addItem(item)
+            self.items.append(item)
+        self.data = np.zeros((ntiles, self.width, nbins), dtype=np.float32)
+        self.reset()
+
+    def update(self, image, count, freqScale, levels):
+        """ image is the (ncols, nbins) view of the last ncols columns, count the number of columns ever added """
+        ncols, nbins = image.shape
+        if self.shape != (ncols, nbins):
+            self._build(ncols, nbins)
+        if count < self.count:
+            self.reset()
+        if self.levels is None or max(abs(a - b) for a, b in zip(levels, self.levels)) > self.tolerance:
+            self.levels = levels
+            for item, block in zip(self.items, self.blocks):
+                if block is not None:
+                    item.setLevels(levels)
+
+        dt = self.span / ncols
+        df = freqScale[1] - freqScale[0]
+        first = max(self.count, count - ncols)
+        for block in range(first // self.width, -(-count // self.width)):
+            i = block % len(self.items)
+            lo, hi = max(first, block*self.width), min(count, (block + 1)*self.width)
+            self.blocks[i] = block
+            self.data[i, lo - block*self.width:hi - block*self.width] = image[ncols - (count - lo):ncols - (count - hi)]
+            filled = hi - block*self.width
+            self.items[i].setImage(self.data[i, :filled], autoLevels = False, levels = self.levels)
+            self.items[i].setRect(QtCore.QRectF(block*self.width*dt, freqScale[0] - df/2, filled*dt, nbins*df))
+        self.count = count
+        # newest column ends at x = 0
+        self.group.setPos(-count*dt, 0)
 
 class DAGUI:
-    def __init__(self, parser) -> None:
+    def __init__(self, parser, source = None, capture = None, showMetrics = False, metricsLog = None, numSecLong = 20,
+                 maxFps = 25, startup = None, streamServer = None, computeProcess = False,
+                 deviceBands = False) -> None:
         self.address = ''
-        self.socket = None
+        # id of the device shown in the plots, self.parser and self.pipeline belong to it
+        self.addr = ''
+        self.devices = {}
+        self.pipelines = {}
+        self.capture = capture
         self.pause = False
+        # background connect/reconnect tasks by device id, the scan task
+        self.tasks = {}
+        self.searchTask = None
+        # headsets are reconnected when their link drops, lostAt holds when it did
+        self.reconnectable = set()
+        self.lostAt = {}
 
         self.folderName = None
         self.isRecording = False
-        self.recordingStartIndex = 0
+        self.recordingStartIndex = {}
         self.recordingStartTime = None
-        self.recordingEndIndex = 0
+        self.recordingEndIndex = {}
         self.recordingEndTime = None
-
-        self.numSecLong = 20
+        self.recordingId = None
+        self.recordingWriters = {}
+        # summaries of every recording in folderName, see openCatalog
+        self.catalog = None
+        self.catalogTask = None
+        self.catalogOrder = 'start_time'
+        self.catalogDescending = True
+        self.catalogLimit = 500
+        # title, catalog column and format of each column of the recordings table
+        self.catalogColumns = [('Start', 'start_time', lambda v: v[:19].replace('T', ' ')),
+                               ('Minutes', 'duration', lambda v: f'{v/60:.1f}'),
+                               ('Device', 'device', str),
+                               ('Artifacts %', 'artifact_ratio', lambda v: f'{100*v:.1f}'),
+                               ('Alpha %', 'alpha_relative', lambda v: f'{100*v:.0f}'),
+                               ('Theta/Beta', 'theta_beta', lambda v: f'{v:.2f}'),
+                               ('File', 'filename', str)]
+
+        self.numSecLong = numSecLong
         self.numSecShort = 5
 
         self.parser = parser
         self.update_speed_ms = 40
         self.sf = 512
+        self.minFrequency = 1
         self.maxFrequency = 45
+        self.filterOrder = 4
+        self.numSecSpectrogram = 60
+
+        self.scheduler = RenderScheduler(max_fps = maxFps)
+        self.metrics = FrameMetrics(self.update_speed_ms, self.sf)
+        self.showMetrics = showMetrics
+        self.metricsLog = metricsLog
+        self.metricsLogInterval = 10
+        self.lastOverlayUpdate = 0
+        self.lastMetricsExport = time.monotonic()
+        self.startup = startup if startup is not None else StartupProfile()
+
+        # built by loadProcessing once the window is up, creating it loads scipy
+        self.pipeline = None
+        # run each device's pipeline in a worker process fed over shared memory
+        self.computeProcess = computeProcess
+        # bar chart from the headset's own band powers, no host-side spectrum
+        self.deviceBands = deviceBands
+        self.source = source
 
         self.app = QtGui.QApplication([])
         self.mainWindow: QtGui.QWidget = QtGui.QWidget()
@@ -40,20 +188,75 @@ class DAGUI:
         self.message = QtWidgets.QLabel("Connect a device.")
         self.message.setStyleSheet("color : white")
 
+        self.metricsOverlay = QtWidgets.QLabel()
+        self.metricsOverlay.setStyleSheet("color : white; font-family : monospace")
+        self.metricsOverlay.setVisible(showMetrics)
+
         self.win1: pg.GraphicsLayoutWidget  = pg.GraphicsLayoutWidget()
         self.win2: pg.GraphicsLayoutWidget  = pg.GraphicsLayoutWidget()
         self.win3: pg.GraphicsLayoutWidget  = pg.GraphicsLayoutWidget()
 
+        self.acquisitionSignals = AcquisitionSignals()
+        self.acquisitionSignals.error.connect(self.onAcquisitionError)
+        self.acquisitionSignals.disconnected.connect(self.onAcquisitionDisconnected)
+        self.acquisitionSignals.progress.connect(self.setMessage)
+        self.acquisitionSignals.found.connect(self.onDevicesFound)
+        self.acquisitionSignals.connected.connect(self.onConnected)
+        self.acquisitionSignals.connectFailed.connect(self.onConnectFailed)
+        self.acquisitionSignals.catalogChanged.connect(self.refreshCatalog)
+        # a single thread reads all connected devices
+        self.reader = MultiplexedReader(on_error = self.acquisitionSignals.error.emit,
+                                        on_disconnect = self.acquisitionSignals.disconnected.emit)
+        self.reader.start()
+
+        # optional local network output, every device publishes under its own source number
+        self.streamServer = streamServer
+        self.streamSources = {}
+        self.streamListeners = {}
+
         self._init_styles()
         self._init_timeseries()
         self._init_layout()
-        
-        timer = QtCore.QTimer()
-        timer.timeout.connect(self.update)
-        timer.start(self.update_speed_ms)
+        self.app.processEvents()
+        self.startup.mark('window')
+
+        # single shot, re-armed by tick() with the interval the scheduler picks
+        self.timer = QtCore.QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.tick)
+        QtCore.QTimer.singleShot(0, self.loadProcessing)
 
         self.app.exec_()
+        for task in self.tasks.values():
+            task.cancel()
+        self.stopRecording()
+        self.reader.stop()
+        if self.streamServer is not None:
+            self.streamServer.stop()
+        for pipeline in {id(p): p for p in [self.pipeline, *self.pipelines.values()]}.values():
+            if isinstance(pipeline, ComputeProcess):
+                pipeline.close()
     
+    def newPipeline(self):
+        if self.computeProcess and not self.deviceBands:
+            return ComputeProcess(self.sf, self.numSecLong, self.numSecShort, self.minFrequency, self.maxFrequency,
+                                  self.filterOrder, metrics = self.metrics, numSecSpectrogram = self.numSecSpectrogram)
+        return FramePipeline(self.sf, self.numSecLong, self.numSecShort, self.minFrequency, self.maxFrequency,
+                             self.filterOrder, metrics = self.metrics, numSecSpectrogram = self.numSecSpectrogram,
+                             deviceBands = self.deviceBands)
+
+    def loadProcessing(self):
+        """ creates the DSP pipeline and starts drawing, deferred so the window shows first """
+        if self.pipeline is not None:
+            return
+        self.pipeline = self.newPipeline()
+        self.startup.mark('processing')
+
+        if self.source is not None:
+            # stand-in for a headset, e.g. a ReplaySource
+            self.addDevice('replay', self.source)
+        self.timer.start(self.update_speed_ms)
+
     def _init_styles(self):
         self.app.setStyle("Fusion")
         palette = QtGui.QPalette()
@@ -110,13 +313,15 @@ class DAGUI:
         curve = p.plot(name = 'Raw Data')
         self.plots.append(p)
         self.curves.append(curve)
+        # one dashed line per reconnect gap in view, see updateGaps
+        self.gapLines = []
         
         #----------
         # Short Plot
         # labels = [(i, f'{"       " if i==0 else ""}{round((-self.numSecShort*self.sf + i)/self.sf,2)}s{"        " if i==self.numSecShort*self.sf else ""}') 
         #           for i in range(0,self.numSecShort*self.sf+1, self.numSecShort*self.sf//8)]
         
-        p = self.win2.addPlot(row = 0, col = 0)
+        p = self.win2.addPlot(row = 0, col = 0, colspan = 2)
         
         p.setContentsMargins(0,16,0,16)
 
@@ -142,7 +347,7 @@ class DAGUI:
         labels = [(i, f'{"       " if i==0 else ""}{round((-self.numSecShort*self.sf + i)/self.sf,2)}s{"        " if i==self.numSecShort*self.sf else ""}') 
                   for i in range(0,self.numSecShort*self.sf+1, self.numSecShort*self.sf//8)]
 
-        p = self.win2.addPlot(row = 1, col = 0)
+        p = self.win2.addPlot(row = 1, col = 0, colspan = 2)
         
         p.setContentsMargins(0,0,0,12)
         
@@ -181,6 +386,10 @@ class DAGUI:
         self.plots.append(p)
         self.curves.append(curve)
         #-------
+        # Spectrogram, next to the power spectrum
+        self.spectrogramTiles, self.spectrogramPlot = self.addSpectrogramPlot()
+        self.spectrogramShown = None
+        #-------
         # Power Bands       
         self.powerBarItem, self.powerBarPlot = self.addPowerBarPlot()
         #-------
@@ -218,10 +427,23 @@ class DAGUI:
         b6.clicked.connect(lambda: self.onButtonClick(b6))
         b7.clicked.connect(lambda: self.onButtonClick(b7))
         
+        self.deviceSelector = QtWidgets.QComboBox()
+        self.deviceSelector.currentTextChanged.connect(self.selectDevice)
+
         self.recordingsWidget = QtWidgets.QListWidget() 
         self.recordingsWidget.clicked.connect(self.onListItemClick)
         self.recordingsWidget.doubleClicked.connect(self.onListItemDoubleClick)
         self.recordingsWidget.setSelectionMode(QtWidgets.QAbstractItemView.SelectionMode.NoSelection)
+
+        # every recording of the chosen folder, read from its catalog
+        self.catalogFilter = QtWidgets.QLineEdit()
+        self.catalogFilter.setPlaceholderText('Search recordings')
+        self.catalogFilter.textChanged.connect(self.refreshCatalog)
+        self.catalogTable = QtWidgets.QTableWidget(0, len(self.catalogColumns))
+        self.catalogTable.setHorizontalHeaderLabels([title for title, key, fmt in self.catalogColumns])
+        self.catalogTable.setEditTriggers(QtWidgets.QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.catalogTable.verticalHeader().setVisible(False)
+        self.catalogTable.horizontalHeader().sectionClicked.connect(self.sortCatalog)
         
         #Buttons
         cTopButtonsLayout.addWidget(b1, 0, 0)
@@ -239,8 +461,12 @@ class DAGUI:
         #Message + Buttons + List + Power Bands 
         self.message.setFixedHeight(30)
         controlLayout.addWidget(self.message)
+        controlLayout.addWidget(self.deviceSelector)
+        controlLayout.addWidget(self.metricsOverlay)
         controlLayout.addLayout(cTopButtonsLayout, stretch = 1)
         controlLayout.addLayout(cRecordingHistoryLayout, stretch = 1)
+        controlLayout.addWidget(self.catalogFilter)
+        controlLayout.addWidget(self.catalogTable, stretch = 1)
         controlLayout.addWidget(self.win3, stretch = 2)
         
         #Control Layout + All the bottom plots
@@ -256,20 +482,10 @@ class DAGUI:
         self.mainWindow.setLayout(mainLayout)
         self.mainWindow.showMaximized()
 
-    def getAverageOfPowerBands(self, freqScale, power):
-        bands = [1, 4, 8, 13, 30, 45]
-        avgPow = []
-
-        for i in range(len(bands)-1):
-            argMinF = np.argmin(np.abs(freqScale-bands[i]))
-            argMaxF = np.argmin(np.abs(freqScale-bands[i+1]))
-            avgPow.append(np.sum(power[argMinF:argMaxF]) / (bands[i+1]-bands[i]))
-
-        return avgPow
-
     def addPowerBarPlot(self):
-        x = [1, 2, 3, 4, 5]		
-        y = [0, 0, 0, 0, 0]
+        names = [name for name, lo, hi in DEFAULT_BANDS]
+        x = list(range(1, len(names)+1))
+        y = [0]*len(x)
         
         powerBarPlot = self.win3.addPlot()
         self.win3.ci.setContentsMargins(1,1,1,1)
@@ -279,9 +495,9 @@ class DAGUI:
         powerBarPlot.setContentsMargins(0,10,0,10)
         powerBarPlot.setMouseEnabled(False, False)
         powerBarPlot.showAxis('left',False)
-        powerBarPlot.setRange(xRange = (1,5),yRange = (0,1),padding = 0.15)
+        powerBarPlot.setRange(xRange = (1,len(x)),yRange = (0,1),padding = 0.15)
 
-        labels = [(1, 'delta'),(2, 'theta'),(3, 'alpha'),(4, 'beta'),(5, 'gamma')]
+        labels = list(zip(x, names))
         ax=powerBarPlot.getAxis('bottom')
         ax.setTicks([labels])
 
@@ -290,6 +506,51 @@ class DAGUI:
 
         return bargraph, powerBarPlot
 
+    def addSpectrogramPlot(self):
+        span = self.numSecSpectrogram
+        p = self.win2.addPlot(row = 2, col = 1)
+
+        p.setTitle(f'Spectrogram {span}s')
+        p.setContentsMargins(0,12,0,12)
+
+        p.disableAutoRange()
+        p.setMouseEnabled(False, False)
+        p.setMenuEnabled('left', False)
+        p.setMenuEnabled('bottom', False)
+
+        p.setXRange(-span, 0, padding = 0)
+        p.setYRange(self.minFrequency, self.maxFrequency, padding = 0)
+
+        # columns are drawn along x, frequency bins along y
+        return SpectrogramTiles(p, span), p
+
+    def updateSpectrogram(self, frame):
+        """ draws the columns added since the last frame, all of them when another device is shown or after a reset """
+        shown = (self.addr, frame['spectrogramCount'])
+        if shown == self.spectrogramShown:
+            return
+        if self.spectrogramShown is None or self.spectrogramShown[0] != self.addr:
+            self.spectrogramTiles.reset()
+        self.spectrogramShown = shown
+        levels = frame['spectrogramLevels'] or (0, 1)
+        self.spectrogramTiles.update(frame['spectrogram'], frame['spectrogramCount'], frame['freqScale'], levels)
+
+    def updateGaps(self):
+        """ marks the reconnect gaps still inside the long raw plot, labelled with their length """
+        offset = self.pipeline.count - self.numSecLong*self.sf
+        gaps = self.parser.recorder.gaps_since(offset)
+        while len(self.gapLines) < len(gaps):
+            line = pg.InfiniteLine(angle = 90, pen = pg.mkPen('r', style = QtCore.Qt.PenStyle.DashLine), label = '',
+                                   labelOpts = {'position': 0.9, 'color': 'r'})
+            self.plots[0].addItem(line)
+            self.gapLines.append(line)
+        for i, line in enumerate(self.gapLines):
+            line.setVisible(i < len(gaps))
+            if i < len(gaps):
+                index, seconds = gaps[i]
+                line.setPos(index - offset)
+                line.label.setFormat(f'{seconds:.1f}s')
+
     def addBluetoothDevice(self, addr, name, cl):
         QtWidgets.QListWidgetItem(f'{addr} | {name} | {cl}', self.recordingsWidget)
 
@@ -298,43 +559,91 @@ class DAGUI:
         QtWidgets.QListWidgetItem(f'R{lastPos+1} | {end-start} | {start} : {end} | {id}', self.recordingsWidget)
 
     def startRecording(self):
-        if self.isRecording is False and self.socket is not None and self.pause is False:
+        if self.isRecording is False and len(self.devices) > 0 and self.pause is False:
             if self.folderName is None:
                 self.chooseFile()
             else:
                 self.setMessage('Recording...')
-                self.recordingStartIndex = len(self.parser.recorder.raw)
                 self.recordingStartTime = datetime.datetime.now()
+                self.recordingId = self.recordingStartTime.strftime('%Y-%m%d-%H%M%S-') + str(uuid4())
+                # one file per device, all sharing the session id and start time
+                for id in self.devices:
+                    self.startDeviceRecording(id)
                 self.isRecording = True
 
+    def startDeviceRecording(self, id):
+        recorder = self.devices[id].parser.recorder
+        name = self.recordingId if len(self.devices) == 1 else f"{self.recordingId}-{id.replace(':', '')}"
+        file = os.path.join(self.folderName, f"{name}{RECORDING_EXT}")
+        # chunks are appended to the file from the acquisition thread as they arrive
+        writer = RecordingWriter(file, name, sf = self.sf, start_time = self.recordingStartTime,
+                                 device = id, session = self.recordingId)
+        recorder.add_listener(writer.on_chunk)
+        self.recordingWriters[id] = writer
+        self.recordingStartIndex[id] = recorder.raw_count()
+
+    def stopDeviceRecording(self, id):
+        writer = self.recordingWriters.pop(id, None)
+        if writer is None:
+            return
+        recorder = self.devices[id].parser.recorder
+        recorder.remove_listener(writer.on_chunk)
+        self.recordingEndIndex[id] = recorder.raw_count()
+        try:
+            writer.close(end_time = datetime.datetime.now(), start_index = self.recordingStartIndex[id])
+        except OSError as e:
+            self.setMessage(f'Failed to write recording: {e}')
+            return
+        if self.catalog is not None and os.path.dirname(writer.path) == self.catalog.folder:
+            self.updateCatalog(lambda task: self.catalog.add(writer.path))
+
     def stopRecording(self):
         if self.isRecording is True:
             self.setMessage('')
             
-            self.recordingEndIndex = len(self.parser.recorder.raw)
             self.recordingEndTime = datetime.datetime.now()
-
-            recId = self.recordingEndTime.strftime('%Y-%m%d-%H%M%S-') + str(uuid4())
-            rec = self.parser.recorder.raw[self.recordingStartIndex:self.recordingEndIndex]
-            
-            self.saveRecording(recId, rec)
-            self.addRecording(self.recordingStartTime, self.recordingEndTime, recId)
+            for id in list(self.recordingWriters):
+                self.stopDeviceRecording(id)
+            self.addRecording(self.recordingStartTime, self.recordingEndTime, self.recordingId)
             
             self.isRecording = False
 
-    def saveRecording(self, id, rec):
-        d = {}
-        d['id'] = id
-        d['sf'] = 512
-        d['data'] = rec
-        if self.folderName is not None:
-            file = os.path.join(self.folderName, f"{id}.json")
-            with open(file, 'w') as f:
-                json.dump(d, f)
-
     def chooseFile(self):
         folderName = str(QtWidgets.QFileDialog.getExistingDirectory(self.mainWindow, "Select Folder"))
         self.folderName = folderName
+        if folderName:
+            self.openCatalog(folderName)
+
+    def openCatalog(self, folder):
+        """ shows the folder's catalog, recordings it does not know yet are summarized in the background """
+        self.catalog = RecordingCatalog(folder)
+        self.refreshCatalog()
+        self.updateCatalog(lambda task: self.catalog.sync(progress = task.progress))
+
+    def updateCatalog(self, target):
+        """ runs a catalog update off the GUI thread, the table is refreshed when it is done """
+        self.catalogTask = BackgroundTask(target, on_done = lambda result: self.acquisitionSignals.catalogChanged.emit(),
+                                          on_error = lambda text: self.acquisitionSignals.progress.emit(f'Catalog: {text}'),
+                                          on_progress = self.acquisitionSignals.progress.emit)
+        self.catalogTask.start()
+
+    def sortCatalog(self, section):
+        key = self.catalogColumns[section][1]
+        self.catalogDescending = not self.catalogDescending if key == self.catalogOrder else True
+        self.catalogOrder = key
+        self.refreshCatalog()
+
+    def refreshCatalog(self):
+        """ fills the recordings table from the catalog, no recording is opened """
+        if self.catalog is None:
+            return
+        rows = self.catalog.query(self.catalogFilter.text() or None, order = self.catalogOrder,
+                                  descending = self.catalogDescending, limit = self.catalogLimit)
+        self.catalogTable.setRowCount(len(rows))
+        for i, row in enumerate(rows):
+            for j, (title, key, fmt) in enumerate(self.catalogColumns):
+                value = row[key]
+                self.catalogTable.setItem(i, j, QtWidgets.QTableWidgetItem('' if value is None else fmt(value)))
 
     def setMessage(self, text):
         self.message.setText(text)
@@ -344,20 +653,16 @@ class DAGUI:
         text = but.text()
         match text:
             case 'Connect Device':
-                if self.socket is None:
+                # more devices can be added while others are connected
+                if self.searchTask is None or not self.searchTask.is_alive():
                     self.setMessage("Searching for a device...")
-                    self.waitCursorOn(True)
                     self.recordingsWidget.clear()
-
-                    dev = search_blueetooth_devices()
-                    for addr, name, cl in dev:
-                        self.addBluetoothDevice(addr,name,cl)
-
-                    self.setMessage("")
-                    self.waitCursorOn(False)
+                    self.searchTask = BackgroundTask(lambda task: search_blueetooth_devices(),
+                                                     on_done = self.acquisitionSignals.found.emit,
+                                                     on_error = lambda text: self.acquisitionSignals.progress.emit(f'Search failed: {text}'))
+                    self.searchTask.start()
 
             case 'Disconnect Device':
-                self.stopRecording()
                 self.disconnectDevice()
 
             case 'Start Recording':
@@ -368,13 +673,17 @@ class DAGUI:
 
             case 'Play':
                 if self.pause is True:
-                    self.parser.recorder.cleanSlate()
-                    self.pause = False
+                    for id, device in self.devices.items():
+                        device.parser.recorder.cleanSlate()
+                        self.pipelines[id].reset()
+                    self.spectrogramShown = None
+                    self.scheduler.request()
+                    self.setPause(False)
                     self.setMessage('')
 
             case 'Pause':
-                if self.socket is not None:
-                    self.pause = True
+                if len(self.devices) > 0:
+                    self.setPause(True)
                     self.setMessage('Paused')
                     self.stopRecording()
             case 'S':
@@ -390,73 +699,260 @@ class DAGUI:
 
         if text[2] == ':':
             if text.find("CURV") != -1:
-                self.setMessage('Connecting...')
-                self.waitCursorOn(True)
-                
                 addr = text[:17]
-                self.socket = start_headset(addr)
-                if self.socket is not None:
-                    self.addr = addr
-                    self.pause = False
-                    self.recordingsWidget.clear()
-                    self.setMessage('')
-                else:
-                    self.setMessage('Failed to connect. Try again.')
-                
-                self.waitCursorOn(False)
+                if addr in self.devices:
+                    self.setMessage('Already connected.')
+                elif addr not in self.tasks:
+                    self.setMessage('Connecting...')
+                    self.startTask(addr, lambda task: start_headset(addr))
             else:
                 self.setMessage('Not a Curvex Device.')
 
-    def disconnectDevice(self):
-        if self.socket!= None:
-            self.socket.close()
-            self.socket = None
-            self.addr = ''
-            self.parser.recorder.cleanSlate()
-            self.setMessage('Connect a device.')
-
-    def waitCursorOn(self, wait):
-        if wait:
-            QtWidgets.QApplication.setOverrideCursor(QtCore.Qt.CursorShape.WaitCursor)
+    def onDevicesFound(self, devices):
+        for addr, name, cl in devices:
+            self.addBluetoothDevice(addr, name, cl)
+        self.setMessage("" if len(devices) > 0 else "No devices found.")
+
+    def startTask(self, id, target):
+        """ runs a blocking connect for a device id in the background, see onConnected """
+        task = BackgroundTask(target,
+                              on_done = lambda sock: self.acquisitionSignals.connected.emit(id, sock),
+                              on_error = lambda text: self.acquisitionSignals.connectFailed.emit(id, text),
+                              on_progress = self.acquisitionSignals.progress.emit)
+        self.tasks[id] = task
+        task.start()
+
+    def onConnected(self, id, sock):
+        if self.tasks.pop(id, None) is None:
+            # cancelled by disconnectDevice meanwhile
+            if sock is not None:
+                sock.close()
+            return
+        if sock is None:
+            self.setMessage('Failed to connect. Try again.')
+        elif id in self.lostAt:
+            self.resumeDevice(id, sock)
         else:
-            QtWidgets.QApplication.setOverrideCursor(QtCore.Qt.CursorShape.ArrowCursor)
-
-    def update(self):
-        try:
-            if self.socket is not None:
-                r, w, er = select.select([self.socket],[],[self.socket])
-                if len(r) > 0:
-                    byteData = r[0].recv(20000)
-                    if len(byteData) == 0:
-                        self.disconnectDevice()
-                    else:
-                        if self.pause is False:
-                            self.parser.feed(byteData)
-        except Exception as e:        
-            self.setMessage('An error occurred')
-
-        longPlotData = self.parser.recorder.get_last_n_raw_second(self.numSecLong)
-        shortPlotData = self.parser.recorder.get_last_n_raw_second(self.numSecShort)
-
-        filtShortData = filter_data(shortPlotData)
-
-        freqScale, power = get_power(filtShortData, self.sf)
+            self.reconnectable.add(id)
+            self.addDevice(id, sock)
+            self.recordingsWidget.clear()
+            self.setMessage('')
 
-        self.curves[0].setData(longPlotData)
-        self.curves[1].setData(shortPlotData)
-        self.curves[2].setData(filtShortData)
-        self.curves[3].setData(freqScale, power)
+    def onConnectFailed(self, id, text):
+        self.tasks.pop(id, None)
+        self.setMessage(f'{id}: failed to connect: {text}')
 
-        powBands = self.getAverageOfPowerBands(freqScale,power)
-        self.powerBarItem.setOpts(height = normalize(powBands))
+    def addDevice(self, id, sock):
+        """ starts reading a connected source, each device gets its own parser, recorder and pipeline """
+        self.loadProcessing()
+        if len(self.devices) == 0:
+            parser, pipeline = self.parser, self.pipeline
+        else:
+            parser = DataParser(DataRecorder(sf = self.sf))
+            pipeline = self.newPipeline()
+        device = Device(id, sock, parser, capture = self.capture if len(self.devices) == 0 else None)
+        device.paused = self.pause
+        self.devices[id] = device
+        self.pipelines[id] = pipeline
+        if isinstance(pipeline, ComputeProcess):
+            # the worker only sees raw samples through this listener
+            parser.recorder.add_listener(pipeline.on_chunk)
+        self.reader.add_device(device)
+        if self.isRecording:
+            self.startDeviceRecording(id)
+        if self.streamServer is not None:
+            source = self.streamSources.setdefault(id, len(self.streamSources))
+            self.streamListeners[id] = self.streamServer.listener(source)
+            parser.recorder.add_listener(self.streamListeners[id])
+        self.deviceSelector.addItem(id)
+        self.selectDevice(id)
+
+    def selectDevice(self, id):
+        """ shows the given device in the plots """
+        if id not in self.devices or id == self.addr:
+            return
+        self.addr = id
+        self.parser = self.devices[id].parser
+        self.pipeline = self.pipelines[id]
+        self.deviceSelector.setCurrentText(id)
+        self.scheduler.request()
+
+    def setPause(self, pause):
+        self.pause = pause
+        for device in self.devices.values():
+            device.paused = pause
+
+    def onAcquisitionError(self, id, text):
+        self.deviceLost(id, f'connection error: {text}')
+
+    def onAcquisitionDisconnected(self, id):
+        self.deviceLost(id, 'device disconnected')
+
+    def deviceLost(self, id, reason):
+        """
+            A headset whose link dropped keeps its recorder, pipeline and
+            recording while it is reconnected with backoff. Other sources,
+            like a finished replay, are disconnected.
+        """
+        if id not in self.devices:
+            return
+        if id not in self.reconnectable:
+            self.disconnectDevice(id)
+            self.setMessage(f'{id}: {reason}.')
+            return
+        self.lostAt[id] = time.monotonic()
+        self.setMessage(f'{id}: {reason}, reconnecting...')
+        self.startTask(id, lambda task: reconnect(task, id, start_headset))
+
+    def resumeDevice(self, id, sock):
+        """ continues a reconnected headset where it stopped, the gap is marked """
+        gap = time.monotonic() - self.lostAt.pop(id)
+        device = self.devices[id]
+        # a packet cut by the dropout must not be completed with new bytes
+        device.parser.decoder.reset()
+        device.parser.recorder.mark_gap(gap)
+        if id in self.recordingWriters:
+            self.recordingWriters[id].mark_gap(gap)
+        device.sock = sock
+        self.reader.add_device(device)
+        self.setMessage(f'{id}: reconnected after {gap:.1f}s.')
+
+    def disconnectDevice(self, id = None):
+        id = self.addr if id is None else id
+        task = self.tasks.pop(id, None)
+        if task is not None:
+            task.cancel()
+        self.lostAt.pop(id, None)
+        self.reconnectable.discard(id)
+        if id in self.devices:
+            self.stopDeviceRecording(id)
+            if len(self.recordingWriters) == 0:
+                self.stopRecording()
+            # the reader owns the socket and closes it
+            self.reader.remove_device(id)
+            device = self.devices.pop(id)
+            pipeline = self.pipelines.pop(id)
+            if id in self.streamListeners:
+                device.parser.recorder.remove_listener(self.streamListeners.pop(id))
+            if isinstance(pipeline, ComputeProcess):
+                device.parser.recorder.remove_listener(pipeline.on_chunk)
+            self.deviceSelector.removeItem(self.deviceSelector.findText(id))
+
+            if id == self.addr:
+                self.addr = ''
+                if len(self.devices) > 0:
+                    self.selectDevice(next(iter(self.devices)))
+                else:
+                    # keep the last parser and pipeline for the empty view
+                    self.parser, self.pipeline = device.parser, pipeline
+                    self.parser.recorder.cleanSlate()
+                    self.resetProcessing()
+                    self.setMessage('Connect a device.')
+            if pipeline is not self.pipeline and isinstance(pipeline, ComputeProcess):
+                pipeline.close()
+
+    def resetProcessing(self):
+        """ drops the streaming state after the recorder was cleared """
+        self.pipeline.reset()
+        self.spectrogramShown = None
+        self.scheduler.request()
+
+    def tick(self):
+        count = self.parser.recorder.raw_count()
+        if self.scheduler.should_render(count):
+            self.metrics.begin_frame(self.scheduler.interval_ms)
+            self.update()
+            # a compute process may still show an older frame, the tick stays pending until it catches up
+            interval = self.scheduler.rendered(self.pipeline.count, self.metrics.frameTimes.last(1)[0])
+            if not self.startup.reported:
+                self.startup.mark('first frame')
+                self.startup.report()
+        else:
+            self.metrics.idle()
+            interval = self.scheduler.skipped()
+        self.timer.start(int(interval))
 
-        self.app.processEvents()
+    def update(self):
+        # Socket reads happen on the MultiplexedReader thread, this only renders
+        self.pipeline.set_widths(self.parser.recorder, int(self.plots[0].vb.width()), int(self.plots[1].vb.width()))
+        drawnBefore = self.pipeline.count
+        frame = self.pipeline.compute(self.parser.recorder)
+
+        with self.metrics.stage('plot'):
+            self.curves[0].setData(*frame['long'])
+            self.curves[1].setData(*frame['short'])
+            self.curves[2].setData(*frame['filtered'])
+            self.curves[3].setData(frame['freqScale'], frame['power'])
+            self.updateSpectrogram(frame)
+            self.updateGaps()
+
+            self.powerBarItem.setOpts(height = frame['bands'])
+
+        with self.metrics.stage('events'):
+            self.app.processEvents()
+
+        # receive-to-render latency of the newest sample drawn
+        received = None
+        if self.pipeline.count > drawnBefore:
+            received = self.parser.recorder.receive_time(self.pipeline.count - 1)
+
+        device = self.devices.get(self.addr)
+        self.metrics.end_frame(bytes_total = device.bytes_received if device is not None else 0,
+                               samples_total = self.parser.recorder.raw_count(),
+                               backlog = len(self.parser.decoder.carry),
+                               received = received)
+        self.reportMetrics()
+
+    def updateLinkMetrics(self):
+        """ sampling rate, drift and sample loss of the shown device over the last minute """
+        index, times = self.parser.recorder.get_timestamps(60)
+        starts, seconds = detect_gaps(index, times, self.sf)
+        rate = estimate_rate(index, times, self.sf)
+        drift = (rate / self.sf - 1) * 1e6 if rate > 0 else 0.0
+        self.metrics.set_link(rate, drift, len(starts), seconds.sum())
+
+    def reportMetrics(self):
+        now = time.monotonic()
+        if self.showMetrics and now - self.lastOverlayUpdate >= 1:
+            self.updateLinkMetrics()
+            self.metricsOverlay.setText(self.metrics.overlay_text())
+            self.lastOverlayUpdate = now
+        if self.metricsLog is not None and now - self.lastMetricsExport >= self.metricsLogInterval:
+            self.updateLinkMetrics()
+            self.metrics.export(self.metricsLog)
+            self.lastMetricsExport = now
 
 
 if __name__ == '__main__':
+    import argparse
+    from helpers.my_sources import open_replay
+
+    argParser = argparse.ArgumentParser(description = 'Live view for CURV headsets.')
+    argParser.add_argument('--replay', help = 'play back a recording (.cvx, .json) or a byte capture instead of a headset')
+    argParser.add_argument('--speed', type = float, default = 1.0, help = 'replay speed, 0 for as fast as possible')
+    argParser.add_argument('--capture', help = 'write every received byte to this file')
+    argParser.add_argument('--long-seconds', type = int, default = 20, help = 'length of the long raw plot')
+    argParser.add_argument('--max-fps', type = float, default = 25, help = 'upper limit for the redraw rate')
+    argParser.add_argument('--stream-port', type = int, help = 'publish decoded samples to local subscribers on this port')
+    argParser.add_argument('--stream-udp', action = 'store_true', help = 'publish over UDP instead of TCP')
+    argParser.add_argument('--compute-process', action = 'store_true', help = 'filter and transform in a worker process fed over shared memory')
+    argParser.add_argument('--device-bands', action = 'store_true', help = "draw the band chart from the headset's own band powers, skipping the spectrum")
+    argParser.add_argument('--metrics', action = 'store_true', help = 'show frame timing metrics on screen')
+    argParser.add_argument('--metrics-log', help = 'export frame metrics every 10s to a .csv (appended) or .json file')
+    argParser.add_argument('--profile-startup', action = 'store_true', help = 'print import and initialization times once the first frame is drawn')
+    args = argParser.parse_args()
         
     recorder = DataRecorder()
     parser = DataParser(recorder)
 
-    DAGUI(parser)
+    source = open_replay(args.replay, args.speed or None) if args.replay else None
+    capture = open(args.capture, 'wb') if args.capture else None
+    streamServer = None
+    if args.stream_port is not None:
+        streamServer = StreamServer(port = args.stream_port, transport = 'udp' if args.stream_udp else 'tcp')
+        streamServer.start()
+
+    DAGUI(parser, source = source, capture = capture, showMetrics = args.metrics, metricsLog = args.metrics_log,
+          numSecLong = args.long_seconds, maxFps = args.max_fps, startup = startup, streamServer = streamServer,
+          computeProcess = args.compute_process, deviceBands = args.device_bands)
 
@@ -0,0 +1,227 @@
+"""
+    Headless acquisition: connects to one or more CURV headsets and streams
+    the decoded data straight to recording files, without Qt or any DSP.
+    Disconnected devices are reconnected and continue in a new file.
+
+        python headless.py --folder /data/recordings --device 00:11:22:33:44:55
+
+    Under systemd, run it as a simple service; SIGTERM finalizes all open
+    recordings before exiting. With --catalog, every saved file is also
+    summarized into the folder's recordings catalog, which loads scipy.
+"""
+import os
+import queue
+import signal
+import logging
+import threading
+import argparse
+import datetime
+import time
+from uuid import uuid4
+
+from helpers.my_bluetooth import DataRecorder, DataParser, start_headset
+from helpers.my_acquisition import Device, MultiplexedReader, BackgroundTask
+from helpers.my_recordings import RECORDING_EXT, RecordingWriter
+from helpers.my_streaming import StreamServer
+from helpers.my_catalog import RecordingCatalog
+
+log = logging.getLogger('curvex.headless')
+
+
+class HeadlessAcquisition:
+    def __init__(self, folder, addresses = (), replays = (), sf = 512, history_sec = 60, retry_sec = 5, segment_sec = None,
+                 streamServer = None, catalog = False):
+        self.folder = folder
+        self.addresses = list(addresses)
+        self.sf = sf
+        self.history_sec = history_sec
+        self.retry_sec = retry_sec
+        self.segment_sec = segment_sec
+        self.streamServer = streamServer
+        self.streamSources = {}
+        # opened by run() once the folder exists
+        self.useCatalog = catalog
+        self.catalog = None
+
+        self.devices = {}
+        self.writers = {}
+        # onChunk runs on the reader thread, writers are swapped and closed under this lock
+        self.writersLock = threading.Lock()
+        self.segmentStart = {}
+        self.nextAttempt = {addr: 0 for addr in self.addresses}
+        # connect tasks by address, start_headset blocks for seconds
+        self.connecting = {}
+        self.pendingReplays = list(replays)
+
+        # reader and connect callbacks run on their own threads, the main loop
+        # handles them as ('lost', id, reason), ('connected', id, sock or None) and ('failed', id, error)
+        self.events = queue.Queue()
+        self.reader = MultiplexedReader(on_error = lambda id, text: self.events.put(('lost', id, text)),
+                                        on_disconnect = lambda id: self.events.put(('lost', id, 'disconnected')))
+        self.running = False
+
+    def stop(self, *args):
+        self.running = False
+        self.events.put(None)
+
+    def addDevice(self, id, sock):
+        # the files hold everything, the recorder only needs a short history
+        device = Device(id, sock, DataParser(DataRecorder(self.history_sec, self.sf)))
+        # one listener per device, segments are swapped underneath it
+        device.parser.recorder.add_listener(lambda start, chunk: self.onChunk(id, start, chunk))
+        if self.streamServer is not None:
+            source = self.streamSources.setdefault(id, len(self.streamSources))
+            device.parser.recorder.add_listener(self.streamServer.listener(source))
+        self.devices[id] = device
+        writer = self.openRecording(id)
+        with self.writersLock:
+            self.writers[id] = writer
+        self.reader.add_device(device)
+        log.info('%s: acquiring', id)
+
+    def onChunk(self, id, start, chunk):
+        # held while writing, so a writer is never closed under a chunk that is being added to it
+        with self.writersLock:
+            writer = self.writers.get(id)
+            if writer is not None:
+                writer.on_chunk(start, chunk)
+
+    def swapWriter(self, id, writer = None):
+        """ replaces (or removes) the writer of a device, returns the old one, which no chunk is added to anymore """
+        with self.writersLock:
+            old = self.writers.pop(id, None)
+            if writer is not None:
+                self.writers[id] = writer
+        return old
+
+    def openRecording(self, id):
+        start = datetime.datetime.now()
+        name = start.strftime('%Y-%m%d-%H%M%S-') + str(uuid4())
+        file = os.path.join(self.folder, f"{name}{RECORDING_EXT}")
+        writer = RecordingWriter(file, name, sf = self.sf, start_time = start, device = id)
+        self.segmentStart[id] = time.monotonic()
+        log.info('%s: recording to %s', id, file)
+        return writer
+
+    def closeRecording(self, id, writer):
+        try:
+            header = writer.close(end_time = datetime.datetime.now())
+            log.info('%s: saved %d samples', id, header['samples'])
+        except OSError as e:
+            log.error('%s: failed to write %s: %s', id, writer.path, e)
+            return
+        if self.catalog is not None:
+            try:
+                self.catalog.add(writer.path)
+            except (OSError, ValueError) as e:
+                log.error('%s: failed to catalog %s: %s', id, writer.path, e)
+
+    def connectDue(self):
+        now = time.monotonic()
+        for addr in self.addresses:
+            if addr in self.devices or addr in self.connecting or now < self.nextAttempt[addr]:
+                continue
+            # connecting blocks, other devices keep being handled meanwhile
+            task = BackgroundTask(lambda task, addr = addr: start_headset(addr),
+                                  on_done = lambda sock, addr = addr: self.events.put(('connected', addr, sock)),
+                                  on_error = lambda text, addr = addr: self.events.put(('failed', addr, text)))
+            self.connecting[addr] = task
+            task.start()
+
+        while len(self.pendingReplays) > 0:
+            path, source = self.pendingReplays.pop(0)
+            self.addDevice(path, source)
+
+    def rotateSegments(self):
+        if self.segment_sec is None:
+            return
+        now = time.monotonic()
+        for id in list(self.writers):
+            if now - self.segmentStart[id] >= self.segment_sec:
+                self.closeRecording(id, self.swapWriter(id, self.openRecording(id)))
+
+    def handle(self, event):
+        kind, id, value = event
+        if kind in ('connected', 'failed'):
+            self.connecting.pop(id, None)
+            if kind == 'failed' or value is None:
+                # start_headset returns None when the headset does not answer, raises on missing pybluez or adapter errors
+                reason = value if kind == 'failed' else 'no answer from the headset'
+                log.warning('%s: connection failed (%s), retrying in %ss', id, reason, self.retry_sec)
+                self.nextAttempt[id] = time.monotonic() + self.retry_sec
+            else:
+                self.addDevice(id, value)
+            return
+
+        log.warning('%s: %s', id, value)
+        self.devices.pop(id, None)
+        writer = self.swapWriter(id)
+        if writer is not None:
+            self.closeRecording(id, writer)
+        if id in self.nextAttempt:
+            self.nextAttempt[id] = time.monotonic() + self.retry_sec
+
+    def run(self):
+        os.makedirs(self.folder, exist_ok = True)
+        if self.useCatalog:
+            self.catalog = RecordingCatalog(self.folder)
+        self.running = True
+        self.reader.start()
+        try:
+            while self.running:
+                self.connectDue()
+                self.rotateSegments()
+                if len(self.addresses) == 0 and len(self.devices) == 0:
+                    break # only replays, and all of them ended
+                try:
+                    event = self.events.get(timeout = 1)
+                except queue.Empty:
+                    continue
+                if event is not None:
+                    self.handle(event)
+        finally:
+            self.reader.stop()
+            # headsets that connected after the loop ended
+            while not self.events.empty():
+                event = self.events.get()
+                if event is not None and event[0] == 'connected' and event[2] is not None:
+                    event[2].close()
+            if self.streamServer is not None:
+                self.streamServer.stop()
+            for id in list(self.writers):
+                self.closeRecording(id, self.swapWriter(id))
+            if self.catalog is not None:
+                self.catalog.close()
+
+
+if __name__ == '__main__':
+    argParser = argparse.ArgumentParser(description = 'Record CURV headsets without a GUI.')
+    argParser.add_argument('--folder', required = True, help = 'where recordings are written')
+    argParser.add_argument('--device', action = 'append', default = [], help = 'headset address, can be repeated')
+    argParser.add_argument('--replay', action = 'append', default = [], help = 'replay a recording or capture instead, can be repeated')
+    argParser.add_argument('--speed', type = float, default = 1.0, help = 'replay speed, 0 for as fast as possible')
+    argParser.add_argument('--retry', type = float, default = 5, help = 'seconds between reconnect attempts')
+    argParser.add_argument('--segment-minutes', type = float, help = 'start a new file every N minutes')
+    argParser.add_argument('--stream-port', type = int, help = 'also publish decoded samples to local subscribers on this port')
+    argParser.add_argument('--stream-udp', action = 'store_true', help = 'publish over UDP instead of TCP')
+    argParser.add_argument('--catalog', action = 'store_true', help = "add every saved file to the folder's recordings catalog")
+    args = argParser.parse_args()
+
+    logging.basicConfig(level = logging.INFO, format = '%(asctime)s %(levelname)s %(message)s')
+
+    replays = []
+    if len(args.replay) > 0:
+        from helpers.my_sources import open_replay
+        replays = [(path, open_replay(path, args.speed or None)) for path in args.replay]
+
+    streamServer = None
+    if args.stream_port is not None:
+        streamServer = StreamServer(port = args.stream_port, transport = 'udp' if args.stream_udp else 'tcp')
+        streamServer.start()
+
+    daemon = HeadlessAcquisition(args.folder, args.device, replays, retry_sec = args.retry,
+                                 segment_sec = args.segment_minutes*60 if args.segment_minutes else None,
+                                 streamServer = streamServer, catalog = args.catalog)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    daemon.run()
@@ -0,0 +1,217 @@
+import time
+import socket
+import selectors
+import threading
+
+
+class Device:
+    """
+        One data source and the parser it feeds. sock can be anything with
+        fileno(), recv() and close(): the RFCOMM socket from start_headset
+        or a source from helpers.my_sources. If capture is an open binary
+        file, every received byte is also written to it for later replay.
+    """
+    def __init__(self, id, sock, parser, capture = None):
+        self.id = id
+        self.sock = sock
+        self.parser = parser
+        self.capture = capture
+
+        self.paused = False
+        self.bytes_received = 0
+        # reads not yet fed to the parser, see MultiplexedReader.feed_interval
+        self.pending = []
+        self.last_feed = 0.0
+        self.last_received = 0.0
+
+
+class MultiplexedReader(threading.Thread):
+    """
+        Background thread that owns the sockets of all connected devices.
+        One loop waits on every socket at once, feeds each received buffer
+        to that device's parser and reports errors and disconnects through
+        callbacks as on_error(id, text) and on_disconnect(id), so reads
+        never wait on the GUI. A device whose socket fails is dropped and
+        its socket closed.
+
+        Sockets return a few packets per read. Reads of a device are joined
+        and fed to its parser at most every feed_interval seconds, so the
+        parser decodes frame-sized buffers instead of a call per read.
+    """
+    def __init__(self, on_error = None, on_disconnect = None, timeout = 0.5, chunk_size = 20000, feed_interval = 0.02):
+        super().__init__(daemon = True)
+        self.on_error = on_error
+        self.on_disconnect = on_disconnect
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.feed_interval = feed_interval
+
+        self.devices = {}
+        self.selector = selectors.DefaultSelector()
+        # add/remove requests are applied by the reader thread itself
+        self._changes = []
+        self._lock = threading.Lock()
+        self._wakeup, self._wakeupSend = socket.socketpair()
+        self._wakeup.setblocking(False)
+        self.selector.register(self._wakeup, selectors.EVENT_READ, None)
+        self._stop_event = threading.Event()
+
+    def _request(self, change):
+        with self._lock:
+            self._changes.append(change)
+        self._wakeupSend.send(b'\0')
+
+    def add_device(self, device):
+        self._request(('add', device))
+        return device
+
+    def remove_device(self, id):
+        """ stops reading from a device and closes its socket """
+        self._request(('remove', id))
+
+    def stop(self):
+        """ stops the thread and closes all sockets, safe to call twice """
+        self._stop_event.set()
+        self._wakeupSend.send(b'\0')
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+    def _apply_changes(self):
+        with self._lock:
+            changes, self._changes = self._changes, []
+        for op, arg in changes:
+            if op == 'add':
+                if arg.id in self.devices:
+                    self._drop(self.devices[arg.id])
+                self.devices[arg.id] = arg
+                self.selector.register(arg.sock, selectors.EVENT_READ, arg)
+            elif arg in self.devices:
+                self._drop(self.devices[arg])
+
+    def _feed(self, device):
+        if len(device.pending) > 0:
+            data = b''.join(device.pending)
+            device.pending = []
+            device.parser.feed(data, device.last_received)
+        device.last_feed = time.monotonic()
+
+    def _drop(self, device):
+        # bytes read before the socket failed or closed still count
+        self._feed(device)
+        self.devices.pop(device.id, None)
+        try:
+            self.selector.unregister(device.sock)
+        except (KeyError, ValueError):
+            pass
+        device.sock.close()
+
+    def _read(self, device):
+        try:
+            data = device.sock.recv(self.chunk_size)
+        except OSError as e:
+            self._drop(device)
+            if self.on_error is not None:
+                self.on_error(device.id, str(e))
+            return
+
+        if len(data) == 0:
+            self._drop(device)
+            if self.on_disconnect is not None:
+                self.on_disconnect(device.id)
+            return
+
+        device.bytes_received += len(data)
+        if device.capture is not None:
+            device.capture.write(data)
+        if device.paused is False:
+            device.pending.append(data)
+            device.last_received = time.monotonic()
+            if device.last_received - device.last_feed >= self.feed_interval:
+                self._feed(device)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self._apply_changes()
+            timeout = self.timeout
+            waiting = [d for d in self.devices.values() if len(d.pending) > 0]
+            if len(waiting) > 0:
+                due = min(d.last_feed for d in waiting) + self.feed_interval
+                timeout = min(timeout, max(0.0, due - time.monotonic()))
+            for key, mask in self.selector.select(timeout):
+                if key.data is None:
+                    self._wakeup.recv(4096)
+                elif self.devices.get(key.data.id) is key.data:
+                    self._read(key.data)
+            now = time.monotonic()
+            for device in waiting:
+                if self.devices.get(device.id) is device and now - device.last_feed >= self.feed_interval:
+                    self._feed(device)
+
+        self._apply_changes()
+        for device in list(self.devices.values()):
+            self._drop(device)
+        self.selector.close()
+
+
+class BackgroundTask(threading.Thread):
+    """
+        Runs a blocking call, like a Bluetooth scan or connect, off the GUI
+        thread. target(task) gets the task itself to report progress and to
+        check cancelled(); its result or error comes back through
+        on_done(result) or on_error(text). Callbacks run on this thread.
+    """
+    def __init__(self, target, on_done = None, on_error = None, on_progress = None):
+        super().__init__(daemon = True)
+        self.target = target
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self._cancel = threading.Event()
+
+    def progress(self, text):
+        if self.on_progress is not None:
+            self.on_progress(text)
+
+    def cancel(self):
+        self._cancel.set()
+
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def wait(self, seconds):
+        """ sleeps, returns True early if the task was cancelled """
+        return self._cancel.wait(seconds)
+
+    def run(self):
+        try:
+            result = self.target(self)
+        except Exception as e:
+            if self.on_error is not None:
+                self.on_error(str(e))
+            return
+        if self.on_done is not None:
+            self.on_done(result)
+
+
+def reconnect(task, id, connect, initial_delay = 1, max_delay = 30, factor = 2):
+    """
+        Calls connect(id) until it returns a socket, waiting initial_delay
+        seconds after the first failure and factor times longer after each
+        next one, up to max_delay. Returns None once the task is cancelled.
+    """
+    delay = initial_delay
+    attempt = 0
+    while not task.cancelled():
+        attempt += 1
+        task.progress(f'{id}: reconnecting, attempt {attempt}...')
+        sock = connect(id)
+        if sock is not None:
+            if task.cancelled():
+                sock.close()
+                return None
+            return sock
+        task.progress(f'{id}: reconnect failed, next attempt in {delay:g}s')
+        if task.wait(delay):
+            break
+        delay = min(delay*factor, max_delay)
+    return None
@@ -0,0 +1,129 @@
+import os
+import sys
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from helpers.my_artifacts import ArtifactDetector, interpolate_masked
+from helpers.my_data_processing import StreamingFilter, WelchEstimator
+from helpers.my_features import BandPowers, DEFAULT_BANDS, DEFAULT_RATIOS
+from helpers.my_recordings import RECORDING_EXT, load_recording
+
+
+def feature_names(bands = DEFAULT_BANDS, ratios = DEFAULT_RATIOS):
+    """ names of the per-window feature columns, in table order, see BandPowers.compute for their units """
+    names = [name for name, lo, hi in bands]
+    return [f'{name}_density' for name in names] + [f'{name}_relative' for name in names] + [f'{a}_{b}' for a, b in ratios]
+
+def list_recordings(folder):
+    """ binary recordings, plus legacy JSON ones that were never converted """
+    paths = []
+    for name in sorted(os.listdir(folder)):
+        base, ext = os.path.splitext(name)
+        if ext == RECORDING_EXT or (ext == '.json' and not os.path.exists(os.path.join(folder, base + RECORDING_EXT))):
+            paths.append(os.path.join(folder, name))
+    return paths
+
+def analyze_recording(path, window_sec = 5, step_sec = 1, minF = 1, maxF = 45, filterOrder = 4):
+    """
+        Features of every window_sec window of a recording, stepped by
+        step_sec, computed like the live view: artifacts flagged by
+        ArtifactDetector are bridged, the signal goes through the
+        StreamingFilter design (forward and backward, as the whole file is
+        at hand) and each window's spectrum is the WelchEstimator average
+        of the clean segments inside it, reduced by BandPowers. Windows
+        without a clean segment get NaN features. Returns a dict of equal
+        length columns.
+    """
+    header, channels = load_recording(path)
+    sf = header['sf']
+    raw = np.asarray(channels['raw'])
+    n = int(window_sec*sf)
+    step = max(1, int(step_sec*sf))
+    starts = np.arange(0, len(raw) - n + 1, step)
+
+    streamingFilter = StreamingFilter(sf, minF, maxF, order = filterOrder, clip = None)
+    spectrum = WelchEstimator(sf, nperseg = sf, window_sec = window_sec, minF = minF, maxF = maxF)
+    bandPowers = BandPowers(spectrum.freqScale)
+
+    values = np.zeros((0, len(feature_names())))
+    if len(starts) > 0:
+        masked = ArtifactDetector(sf, history_sec = len(raw) // sf + 1).process(raw) != 0
+        clean = interpolate_masked(raw, masked)[0]
+        segStarts, powers, valid = spectrum.segment_powers(streamingFilter.zero_phase(clean), masked)
+
+        # segments that lie entirely inside each window, averaged through running sums
+        first = np.searchsorted(segStarts, starts)
+        end = np.searchsorted(segStarts, starts + n - spectrum.nperseg, side = 'right')
+        sums = np.zeros((len(segStarts) + 1, len(spectrum.freqScale)))
+        np.cumsum(powers * valid[:, None], axis = 0, out = sums[1:])
+        counts = np.concatenate([[0], np.cumsum(valid)])
+        nvalid = counts[end] - counts[first]
+        power = (sums[end] - sums[first]) / np.maximum(nvalid, 1)[:, None]
+
+        features = bandPowers.compute(power)
+        values = np.hstack([features['density'], features['relative'], features['ratios']])
+        values[nvalid == 0] = np.nan
+
+    table = {
+        'filename': np.full(len(starts), os.path.basename(path)),
+        'id': np.full(len(starts), str(header['id'])),
+        'start_index': starts,
+        'start_sec': starts / sf,
+    }
+    for j, name in enumerate(feature_names()):
+        table[name] = values[:, j]
+    return table
+
+def _analyze_safely(path, **kwargs):
+    try:
+        return path, analyze_recording(path, **kwargs), None
+    except (OSError, ValueError, KeyError) as e:
+        return path, None, str(e)
+
+def analyze_folder(folder, output = None, workers = None, window_sec = 5, step_sec = 1, minF = 1, maxF = 45):
+    """
+        Analyzes every recording in a folder on a pool of `workers`
+        processes (all cores by default, 1 runs in this process) and
+        returns one table with a row per window of every file. Files that
+        cannot be read are reported and skipped. With output, the table is
+        also saved as a columnar .npz file.
+    """
+    paths = list_recordings(folder)
+    job = partial(_analyze_safely, window_sec = window_sec, step_sec = step_sec, minF = minF, maxF = maxF)
+    if workers == 1:
+        results = list(map(job, paths))
+    else:
+        with ProcessPoolExecutor(max_workers = workers) as executor:
+            results = list(executor.map(job, paths, chunksize = max(1, len(paths) // (4*(workers or os.cpu_count() or 1)))))
+
+    tables = []
+    for path, table, error in results:
+        if error is not None:
+            print(f'Skipped {path}: {error}', file = sys.stderr)
+        else:
+            tables.append(table)
+
+    keys = ['filename', 'id', 'start_index', 'start_sec'] + feature_names()
+    if len(tables) == 0:
+        result = {key: np.zeros(0) for key in keys}
+    else:
+        result = {key: np.concatenate([t[key] for t in tables]) for key in keys}
+    if output is not None:
+        np.savez(output, **result)
+    return result
+
+
+if __name__ == '__main__':
+    # python -m helpers.my_analysis <folder> -o features.npz
+    argParser = argparse.ArgumentParser(description = 'Band power features over sliding windows of every recording in a folder.')
+    argParser.add_argument('folder')
+    argParser.add_argument('-o', '--output', default = 'features.npz', help = 'columnar .npz output')
+    argParser.add_argument('--workers', type = int, help = 'worker processes, 0 or unset for all cores')
+    argParser.add_argument('--window', type = float, default = 5, help = 'window length in seconds')
+    argParser.add_argument('--step', type = float, default = 1, help = 'step between windows in seconds')
+    args = argParser.parse_args()
+
+    table = analyze_folder(args.folder, args.output, args.workers or None, args.window, args.step)
+    print(f"{len(table['start_index'])} windows from {len(np.unique(table['filename']))} recordings written to {args.output}")
@@ -0,0 +1,165 @@
+import numpy as np
+
+from helpers.my_buffers import RingBuffer
+
+
+# one bit per reason in the artifact mask, any non-zero sample is masked
+SATURATION = 1
+STEP = 2
+FLATLINE = 4
+BLINK = 8
+POOR_SIGNAL = 16
+ARTIFACT_FLAGS = {'saturation': SATURATION, 'step': STEP, 'flatline': FLATLINE, 'blink': BLINK, 'poor_signal': POOR_SIGNAL}
+
+
+def count_artifacts(flags):
+    """ number of flagged samples per reason, and under 'any' """
+    flags = np.asarray(flags, dtype=np.uint8)
+    counts = {name: int(np.count_nonzero(flags & bit)) for name, bit in ARTIFACT_FLAGS.items()}
+    counts['any'] = int(np.count_nonzero(flags))
+    return counts
+
+def count_late_artifacts(late, start = 0, end = None):
+    """ counts like count_artifacts of ArtifactDetector.late, only for absolute indices start..end-1 """
+    counts = {}
+    for name, bit in list(ARTIFACT_FLAGS.items()) + [('any', 0)]:
+        index = late.get(bit, np.zeros(0, dtype=np.int64))
+        counts[name] = int(np.count_nonzero((index >= start) & (index < (end if end is not None else np.inf))))
+    return counts
+
+def artifact_percentages(counts, samples):
+    """ counts from count_artifacts (or summed over chunks) as percentages of samples """
+    if samples == 0:
+        return {name: 0.0 for name in counts}
+    return {name: round(100*n/samples, 2) for name, n in counts.items()}
+
+def interpolate_masked(sig, masked, last = 0.0):
+    """
+        Replaces masked samples by a straight line between the clean samples
+        around them. last is the clean value before sig; masked samples at
+        the end are held at the last clean value, as the next one is not
+        known yet. Returns the repaired copy and the new last clean value.
+    """
+    sig = np.array(sig, dtype=np.float64)
+    if len(sig) == 0 or not np.any(masked):
+        return sig, (sig[-1] if len(sig) > 0 else last)
+    clean = np.flatnonzero(~masked)
+    x = np.concatenate([[-1], clean])
+    y = np.concatenate([[last], sig[clean]])
+    bad = np.flatnonzero(masked)
+    sig[bad] = np.interp(bad, x, y)
+    return sig, y[-1]
+
+
+class ArtifactDetector:
+    """
+        Flags artifacts in the raw stream once per chunk, into a uint8 mask
+        ring parallel to the raw ring (one bit per reason, see
+        ARTIFACT_FLAGS):
+
+        saturation   |x| at or above `saturation`
+        step         a jump of more than `step` between neighbours
+        flatline     `flat_sec` or more of identical values
+        blink        `blink_sec` before each device blink (0x16) of at least `blink_strength`
+        poor_signal  samples while the device's poor signal (0x02) is above `poor_signal`
+
+        Blinks are reported after the fact and flatlines are only known once
+        they last long enough, so these also flag samples of earlier chunks
+        in the ring; process() only returns the flags of the new samples,
+        and leaves the earlier samples it flagged in `late`.
+    """
+    def __init__(self, sf = 512, history_sec = 3600, saturation = 2500, step = 1000, flat_sec = 0.1, blink_strength = 80,
+                 blink_sec = 0.5, poor_signal = 50):
+        self.sf = sf
+        self.saturation = saturation
+        self.step = step
+        self.flat = max(2, int(flat_sec*sf))
+        self.blink_strength = blink_strength
+        self.blink = int(blink_sec*sf)
+        self.poor_signal = poor_signal
+        self.flags = RingBuffer(history_sec*sf, dtype = np.uint8)
+        self.reset()
+
+    def reset(self):
+        self.flags.clear()
+        # previous raw sample, where its run of equal values started, last poor signal value
+        self.last = None
+        self.runStart = 0
+        self.poor = 0
+        self.late = {}
+
+    def _mark(self, start, end, flag, before):
+        """ sets flag on samples start..end-1 already in the ring, noting in late those before index `before` """
+        start = max(start, self.flags.first_index())
+        if start >= end:
+            return
+        cap = self.flags.capacity
+        index = np.arange(start, end)
+        idx = index % cap
+        old = self.flags.data[idx]
+        self.flags.data[idx] |= flag
+        self.flags.data[idx + cap] |= flag
+        earlier = index < before
+        for bit, gained in ((flag, (old & flag) == 0), (0, old == 0)):
+            gained = index[gained & earlier]
+            if len(gained) > 0:
+                self.late[bit] = np.concatenate([self.late.get(bit, np.zeros(0, dtype=np.int64)), gained])
+
+    def process(self, raw, blink = (), poor_signal = (), blink_index = None):
+        """
+            flags new raw samples and returns their flags, blink and
+            poor_signal are the device values of the same chunk.
+            blink_index is the absolute raw sample count each blink arrived
+            at (DataRecorder's 'blink_index'), the end of the chunk if None.
+            Samples of earlier chunks that gained a flag are left in late,
+            as absolute indices by flag bit, and under 0 those that had none
+            before.
+        """
+        raw = np.asarray(raw, dtype=np.int32)
+        m = len(raw)
+        start = self.flags.count
+        flags = np.zeros(m, dtype=np.uint8)
+        self.late = {}
+
+        poor = self.poor
+        if len(poor_signal) > 0:
+            poor = max(poor, int(np.max(poor_signal)))
+            self.poor = int(poor_signal[-1])
+
+        if m > 0:
+            flags[np.abs(raw) >= self.saturation] |= SATURATION
+            previous = np.concatenate([[raw[0] if self.last is None else self.last], raw])
+            steps = np.diff(previous)
+            flags[np.abs(steps) > self.step] |= STEP
+
+            # runs of equal values: where each one started and how long it is so far
+            changed = steps != 0
+            if self.last is None:
+                changed[0] = True
+            idx = np.arange(m)
+            runStart = np.maximum.accumulate(np.where(changed, start + idx, self.runStart))
+            ends = np.minimum.accumulate(np.where(changed, idx, m)[::-1])[::-1]
+            runEnd = start + np.append(ends[1:], m)
+            flat = runEnd - runStart >= self.flat
+            flags[flat] |= FLATLINE
+            if flat[0] and not changed[0] and start - self.runStart < self.flat:
+                # the run only became long enough now, flag its beginning too
+                self._mark(self.runStart, start, FLATLINE, start)
+            self.last = raw[-1]
+            self.runStart = runStart[-1]
+
+            if poor > self.poor_signal:
+                flags |= POOR_SIGNAL
+            self.flags.extend(flags)
+
+        if len(blink) > 0:
+            at = np.full(len(blink), self.flags.count) if blink_index is None else np.asarray(blink_index)
+            for end in np.unique(at[np.asarray(blink) >= self.blink_strength]):
+                end = int(min(end, self.flags.count))
+                self._mark(end - self.blink, end, BLINK, start)
+                flags[max(0, end - self.blink - start):max(0, end - start)] |= BLINK
+        return flags
+
+    def get_range(self, start, end):
+        """ copy of the flags of absolute samples start..end-1 """
+        return self.flags.get_range(start, end)
@@ -1,90 +1,182 @@
 import time
 import struct
+import threading
 import numpy as np
 
-import bluetooth
-from bluetooth.btcommon import BluetoothError
+from helpers.my_buffers import RingBuffer, IndexedSeries
+from helpers.my_timing import TimestampTrack
+from helpers.my_artifacts import ArtifactDetector
+from helpers.my_features import DEVICE_BANDS
 
 
 class DataRecorder:
-    def __init__(self):
-        self.meditation = []
-        self.attention = []
-        self.raw = []
-        self.blink = []
-        self.poor_signal = []
+    def __init__(self, history_sec = 3600, sf = 512):
+        self.sf = sf
+        self.history_sec = history_sec
+
+        # raw is sampled at sf, the eSense values and band powers arrive once per second and
+        # are stored with the raw sample count they arrived at, blink and poor signal only when detected
+        self.raw = RingBuffer(history_sec*sf, dtype = np.int16)
+        self.meditation = IndexedSeries(history_sec, ('meditation',), dtype = np.uint8)
+        self.attention = IndexedSeries(history_sec, ('attention',), dtype = np.uint8)
+        self.blink = IndexedSeries(history_sec, ('blink',), dtype = np.uint8)
+        self.poor_signal = IndexedSeries(history_sec, ('poor_signal',), dtype = np.uint8)
+        self.bands = IndexedSeries(history_sec, [name for name, lo, hi in DEVICE_BANDS], dtype = np.uint32)
+        # receive time of every chunk, one entry per sf/64 samples at most, so the reader's 50 feeds
+        # per second are kept as they are and faster feeding still covers the whole history
+        self.timestamps = TimestampTrack(history_sec*64 + 2, sf, spacing = sf // 64)
+        # artifact flags of every raw sample, see ArtifactDetector
+        self.artifacts = ArtifactDetector(sf, history_sec)
 
+        # raw_queue holds samples, the other queues (raw offset, values) pairs where the
+        # offset counts the queued raw samples the values arrived after
         self.attention_queue = []
         self.meditation_queue = []
         self.poor_signal_queue = []
         self.blink_queue = []
+        self.bands_queue = []
         self.raw_queue = []
+        self.raw_queued = 0
 
-    def get_last_n_raw_second(self, n):
-        ar = np.zeros(512*n)
+        # reusable output buffers, one per window length
+        self.windows = {}
+
+        # finish_chunk runs on the acquisition thread, readers hold this lock
+        self.lock = threading.Lock()
+        self.listeners = []
+        # (raw sample index, seconds) of every connection gap, see mark_gap
+        self.gaps = []
+
+    def raw_count(self):
+        """ absolute number of raw samples received, never wraps """
+        return self.raw.count
+
+    def get_last_n_raw_view(self, n):
+        """ zero-copy view of the last n seconds, valid until the next chunk """
+        return self.raw.last(self.sf*n)
+
+    def get_raw_range(self, start, end):
+        """ copy of raw samples by absolute index, clipped to what is still held """
+        with self.lock:
+            start = max(start, self.raw.first_index())
+            return self.raw.get_range(start, end)
+
+    def get_raw_since(self, start, limit = None):
+        """
+            raw samples from absolute index start up to now, and the new end
+            index. limit caps how far back a consumer that fell behind reads.
+        """
+        with self.lock:
+            end = self.raw.count
+            start = min(max(start, self.raw.first_index()), end)
+            if limit is not None:
+                start = max(start, end - limit)
+            return self.raw.get_range(start, end), end
 
-        num = 0
-        if len(self.raw) < 512*n:
-            num = len(self.raw)
-            ar[len(ar)-num:] = self.raw
-        else: 
-            num = len(self.raw)-512*n
-            ar = self.raw[num:]
+    def get_artifact_range(self, start, end):
+        """ artifact flags of raw samples by absolute index, like get_raw_range """
+        with self.lock:
+            start = max(start, self.artifacts.flags.first_index())
+            return self.artifacts.get_range(start, end)
 
-        ar = np.array(ar)
+    def get_last_n_raw_second(self, n):
+        ar = self.windows.get(n)
+        if ar is None:
+            ar = np.zeros(self.sf*n)
+            self.windows[n] = ar
+
+        with self.lock:
+            ar[:] = self.raw.last(self.sf*n)
         ar[np.abs(ar) > 4000] = 0
         return ar
-        # if len(self.raw)>= 512*n:
-        #     return self.raw[len(self.raw)-512*n:] 
-        # else:
-        #     return self.raw
     
     def get_last_n_poor_signal(self, n):
-        if len(self.poor_signal)>= 512*n:
-            return self.poor_signal[len(self.poor_signal)-512*n:] 
-        else:
-            return self.poor_signal
+        """ poor signal values reported during the last n seconds of raw samples """
+        return self.get_series('poor_signal', self.raw.count - self.sf*n)[1]
     
     def get_last_n_blink(self, n):
-        if len(self.blink)>= 512*n:
-            return self.blink[len(self.blink)-512*n:] 
-        else:
-            return self.blink
+        """ blink strengths reported during the last n seconds of raw samples """
+        return self.get_series('blink', self.raw.count - self.sf*n)[1]
+
+    def get_series(self, key, start = None, end = None):
+        """
+            (raw sample index, values) copies of a low-rate channel, 'attention',
+            'meditation', 'blink', 'poor_signal' or 'bands' (one column per
+            DEVICE_BANDS entry), for values that arrived at raw index start..end-1
+        """
+        with self.lock:
+            return getattr(self, key).range(start, end)
+
+    def latest_bands(self):
+        """ (raw sample index, band powers) of the headset's last 0x83 report, None before the first """
+        with self.lock:
+            return self.bands.latest()
+
+    def get_timestamps(self, seconds = None):
+        """ copies of the timestamp track (sample counts, receive times), of the last `seconds` if given """
+        with self.lock:
+            index, times = self.timestamps.last(seconds)
+            return index.copy(), times.copy()
+
+    def receive_time(self, sample):
+        """ monotonic time the chunk holding an absolute sample index arrived, None if unknown """
+        with self.lock:
+            return self.timestamps.time_of(sample)
+
+    def mark_gap(self, seconds):
+        """ notes that no data arrived for `seconds` before the next raw sample """
+        with self.lock:
+            self.gaps.append((self.raw.count, seconds))
+
+    def gaps_since(self, start):
+        """ (raw sample index, seconds) of the gaps marked at or after an absolute sample index """
+        with self.lock:
+            return [gap for gap in self.gaps if gap[0] >= start]
 
     def cleanSlate(self):
-        self.meditation = []
-        self.attention = []
-        self.raw = []
-        self.blink = []
-        self.poor_signal = []
+        with self.lock:
+            self.gaps = []
+            self.timestamps.clear()
+            self.artifacts.reset()
+            self.meditation.clear()
+            self.attention.clear()
+            self.raw.clear()
+            self.blink.clear()
+            self.poor_signal.clear()
+            self.bands.clear()
 
-        self.attention_queue = []
-        self.meditation_queue = []
-        self.poor_signal_queue = []
-        self.blink_queue = []
-        self.raw_queue = []
+            self.attention_queue = []
+            self.meditation_queue = []
+            self.poor_signal_queue = []
+            self.blink_queue = []
+            self.bands_queue = []
+            self.raw_queue = []
+            self.raw_queued = 0
 
     def dispatch_data(self, key, value):
         if key == "attention":
-            self.attention_queue.append(value)
-            # Blink and "poor signal" is only sent when a blink or poor signal is detected
-            # So fake continuous signal as zeros.
-            
-            
+            self.attention_queue.append(([self.raw_queued], [value]))
         elif key == "meditation":
-            self.meditation_queue.append(value)
+            self.meditation_queue.append(([self.raw_queued], [value]))
         elif key == "raw":
-            # self.blink_queue.append(0)
-            # self.poor_signal_queue.append(0)
             self.raw_queue.append(value)
+            self.raw_queued += 1
         elif key == "blink":
-            # self.blink_queue.append(value)
-            if len(self.blink_queue)>0:
-                self.blink_queue[-1] = value
- 
+            self.blink_queue.append(([self.raw_queued], [value]))
         elif key == "poor_signal":
-            if len(self.poor_signal_queue)>0:
-                self.poor_signal_queue[-1] = value
+            self.poor_signal_queue.append(([self.raw_queued], [value]))
+        elif key == "bands" and len(value) == len(DEVICE_BANDS):
+            self.bands_queue.append(([self.raw_queued], [value]))
+
+    def dispatch_chunk(self, chunk):
+        """ bulk counterpart of dispatch_data for PacketDecoder output """
+        for key, queue in (("attention", self.attention_queue), ("meditation", self.meditation_queue),
+                           ("blink", self.blink_queue), ("poor_signal", self.poor_signal_queue),
+                           ("bands", self.bands_queue)):
+            if len(chunk[key]) > 0:
+                queue.append((self.raw_queued + chunk[key + "_at"], chunk[key]))
+        self.raw_queue.append(chunk["raw"])
+        self.raw_queued += len(chunk["raw"])
      
     def record_meditation(self, attention):
         self.meditation_queue.append()
@@ -92,30 +184,314 @@ class DataRecorder:
     def record_blink(self, attention):
         self.blink_queue.append()
     
-    def finish_chunk(self):
-        """ called periodically to update the timeseries """
-        self.meditation += self.meditation_queue
-        self.attention += self.attention_queue
-        self.blink += self.blink_queue
-        self.raw += self.raw_queue
-        self.poor_signal += self.poor_signal_queue
+    def add_listener(self, listener):
+        """
+            listener(start, chunk) is called after every finished chunk, on
+            the thread that feeds the parser. start is the absolute index of
+            the first raw sample in chunk, chunk maps channel names to the
+            new values and 'received' to the chunk's monotonic receive time.
+            'artifacts_late' holds the earlier samples the chunk flagged, see
+            ArtifactDetector.late.
+        """
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def finish_chunk(self, received = None):
+        """ called periodically to update the timeseries, received is the monotonic time the bytes arrived """
+        received = time.monotonic() if received is None else received
+        # raw_queue holds single values (dispatch_data) and arrays (dispatch_chunk)
+        chunk = {}
+        with self.lock:
+            start = self.raw.count
+            for key, series, queue in (("meditation", self.meditation, self.meditation_queue),
+                                       ("attention", self.attention, self.attention_queue),
+                                       ("blink", self.blink, self.blink_queue),
+                                       ("poor_signal", self.poor_signal, self.poor_signal_queue),
+                                       ("bands", self.bands, self.bands_queue)):
+                if len(queue) > 0:
+                    index = start + np.concatenate([at for at, values in queue])
+                    chunk[key] = np.concatenate([values for at, values in queue]).astype(series.dtype)
+                    # the raw sample index each value arrived at
+                    chunk[key + "_index"] = index
+                    series.extend(index, chunk[key])
+            if len(self.raw_queue) > 0:
+                chunk["raw"] = np.hstack(self.raw_queue).astype(self.raw.dtype)
+                self.raw.extend(chunk["raw"])
+
+            self.attention_queue = []
+            self.meditation_queue = []
+            self.poor_signal_queue = []
+            self.blink_queue = []
+            self.bands_queue = []
+            self.raw_queue = []
+            self.raw_queued = 0
+            if "raw" in chunk and len(chunk["raw"]) > 0:
+                self.timestamps.append(self.raw.count, received)
+            if len(chunk) > 0:
+                flags = self.artifacts.process(chunk.get("raw", ()), chunk.get("blink", ()), chunk.get("poor_signal", ()),
+                                              chunk.get("blink_index"))
+                if "raw" in chunk:
+                    chunk["artifacts"] = flags
+                if len(self.artifacts.late) > 0:
+                    # samples of earlier chunks flagged now, e.g. before a blink
+                    chunk["artifacts_late"] = self.artifacts.late
+
+        if len(chunk) > 0:
+            chunk["received"] = received
+            for listener in list(self.listeners):
+                listener(start, chunk)
+
+class PacketDecoder(object):
+    """
+        Bulk ThinkGear decoder. Finds the 0xaa 0xaa sync points of a whole
+        buffer at once, verifies checksums and decodes the 0x80 raw packets
+        in a single vectorized step. Buffers of a few packets, as the reader
+        delivers them between frames, are cheaper to walk packet by packet
+        and take a plain Python path with the same output. Incomplete
+        packets at the end of a buffer are carried over to the next call.
+        Every other channel comes with '<channel>_at', the number of raw
+        samples of the buffer that preceded each value.
+    """
+    MAX_PAYLOAD = 169
+    # below this many bytes the fixed cost of the numpy calls outweighs the per packet loop
+    SHORT_BUFFER = 512
+    EMPTY = None
+
+    def __init__(self):
+        self.state = None
+        self.carry = b''
+
+    def reset(self):
+        self.carry = b''
+
+    SLOW_CHANNELS = ("poor_signal", "attention", "meditation", "blink", "bands")
+
+    @classmethod
+    def empty_chunk(cls):
+        chunk = {
+            "raw": np.zeros(0, dtype=np.int16),
+            "poor_signal": np.zeros(0, dtype=np.uint8),
+            "attention": np.zeros(0, dtype=np.uint8),
+            "meditation": np.zeros(0, dtype=np.uint8),
+            "blink": np.zeros(0, dtype=np.uint8),
+            "bands": np.zeros((0, 8), dtype=np.uint32),
+        }
+        for key in cls.SLOW_CHANNELS:
+            chunk[key + "_at"] = np.zeros(0, dtype=np.int64)
+        return chunk
+
+    def decode(self, data):
+        """ decodes a buffer into columnar arrays, one per channel """
+        data = self.carry + bytes(data)
+        n = len(data)
+        if n < 4:
+            self.carry = data
+            return self.empty_chunk()
+        if n < self.SHORT_BUFFER:
+            return self.decode_short(data)
+        buf = np.frombuffer(data, dtype=np.uint8)
+
+        # Candidate packets: aa aa followed by a valid length byte
+        cand = np.flatnonzero((buf[:-2] == 0xaa) & (buf[1:-1] == 0xaa) & (buf[2:] <= self.MAX_PAYLOAD))
+        ends = cand + 4 + buf[cand + 2].astype(np.int64)
+        complete = ends <= n
+
+        # Checksum is the inverted low byte of the payload sum
+        csum = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(buf, out=csum[1:])
+        starts, ends_ok = cand[complete], ends[complete]
+        payload_sum = csum[ends_ok - 1] - csum[starts + 3]
+        valid = (~payload_sum & 0xff) == buf[ends_ok - 1]
+        starts, ends_ok = starts[valid], ends_ok[valid]
+
+        # A sync pattern inside a payload can pass the checksum by chance,
+        # keep only packets that do not overlap an earlier one
+        if len(starts) > 1 and np.any(starts[1:] < ends_ok[:-1]):
+            keep = np.zeros(len(starts), dtype=bool)
+            last = 0
+            for k in range(len(starts)):
+                if starts[k] >= last:
+                    keep[k] = True
+                    last = ends_ok[k]
+            starts, ends_ok = starts[keep], ends_ok[keep]
+
+        consumed = ends_ok[-1] if len(starts) > 0 else 0
+        pending = cand[~complete & (cand >= consumed)]
+        if len(pending) > 0:
+            self.carry = data[pending[0]:]
+        else:
+            # the tail may still hold the beginning of a sync
+            self.carry = data[max(consumed, n - 2):]
+
+        # Fast path: the 512Hz raw packets aa aa 04 80 02 hi lo chk
+        is_raw = (buf[starts + 2] == 4) & (buf[starts + 3] == 0x80) & (buf[starts + 4] == 0x02)
+        raw_starts = starts[is_raw]
+        hi = buf[raw_starts + 5].astype(np.uint16)
+        lo = buf[raw_starts + 6].astype(np.uint16)
+        raw = ((hi << 8) | lo).view(np.int16)
+
+        # Everything else (eSense, blink, bands...) is rare, decode row by row
+        other = {"raw": [], "poor_signal": [], "attention": [], "meditation": [], "blink": [], "bands": []}
+        # number of raw samples decoded before each value
+        other_at = {key: [] for key in self.SLOW_CHANNELS}
+        extra_raw_pos = []
+        for start in starts[~is_raw]:
+            payload = buf[start + 3:start + 3 + buf[start + 2]]
+            raw_before = int(np.searchsorted(raw_starts, start))
+            for code, value in self.parse_rows(payload):
+                row = self.dispatch_row(code, value)
+                if row is None:
+                    continue
+                other[row[0]].append(row[1])
+                if row[0] == "raw":
+                    extra_raw_pos.append(start)
+                else:
+                    other_at[row[0]].append(raw_before + len(extra_raw_pos))
+
+        if len(extra_raw_pos) > 0:
+            pos = np.concatenate([raw_starts, np.array(extra_raw_pos, dtype=raw_starts.dtype)])
+            raw = np.concatenate([raw, np.array(other["raw"], dtype=np.int16)])
+            raw = raw[np.argsort(pos, kind="stable")]
+        return self.make_chunk(raw, other, other_at)
+
+    def decode_short(self, data):
+        """ decode() for a few packets, walks them one by one and accepts the same packets """
+        n = len(data)
+        raw = []
+        other = {key: [] for key in self.SLOW_CHANNELS}
+        # number of raw samples decoded before each value
+        other_at = {key: [] for key in self.SLOW_CHANNELS}
+        consumed = 0
+        pending = None
+        find = data.find
+        i = find(b"\xaa\xaa")
+        while 0 <= i < n - 2:
+            length = data[i + 2]
+            end = i + 4 + length
+            if length == 4 and end <= n and data[i + 3] == 0x80 and data[i + 4] == 0x02:
+                # the 512Hz raw packets aa aa 04 80 02 hi lo chk
+                hi, lo = data[i + 5], data[i + 6]
+                if (~(0x82 + hi + lo) & 0xff) == data[i + 7]:
+                    raw.append(hi << 8 | lo)
+                    consumed = end
+                    pending = None
+                    i = find(b"\xaa\xaa", end)
+                else:
+                    i = find(b"\xaa\xaa", i + 1)
+                continue
+            if length > self.MAX_PAYLOAD:
+                i = find(b"\xaa\xaa", i + 1)
+                continue
+            if end > n:
+                # may be completed by the next buffer, unless a later packet is accepted
+                if pending is None:
+                    pending = i
+                i = find(b"\xaa\xaa", i + 1)
+                continue
+            payload = data[i + 3:end - 1]
+            if (~sum(payload) & 0xff) != data[end - 1]:
+                i = find(b"\xaa\xaa", i + 1)
+                continue
+            for code, value in self.parse_rows(np.frombuffer(payload, dtype=np.uint8)):
+                row = self.dispatch_row(code, value)
+                if row is None:
+                    continue
+                if row[0] == "raw":
+                    raw.append(row[1] & 0xffff)
+                else:
+                    other[row[0]].append(row[1])
+                    other_at[row[0]].append(len(raw))
+            consumed = end
+            pending = None
+            i = find(b"\xaa\xaa", end)
+
+        if pending is not None:
+            self.carry = data[pending:]
+        else:
+            self.carry = data[max(consumed, n - 2):]
+        return self.make_chunk(np.array(raw, dtype=np.uint16).view(np.int16), other, other_at)
+
+    def make_chunk(self, raw, other, other_at):
+        # channels without values share read-only empty arrays
+        if self.EMPTY is None:
+            PacketDecoder.EMPTY = self.empty_chunk()
+            for array in self.EMPTY.values():
+                array.setflags(write = False)
+        chunk = dict(self.EMPTY)
+        chunk["raw"] = raw
+        for key in self.SLOW_CHANNELS:
+            if len(other[key]) > 0:
+                chunk[key] = np.array(other[key], dtype = np.uint32 if key == "bands" else np.uint8)
+                chunk[key + "_at"] = np.asarray(other_at[key], dtype=np.int64)
+        return chunk
+
+    @staticmethod
+    def parse_rows(payload):
+        """ splits a packet payload into (code, value bytes) rows """
+        i = 0
+        while i < len(payload):
+            while i < len(payload) and payload[i] == 0x55: # extended code level
+                i += 1
+            if i >= len(payload):
+                break
+            code = int(payload[i])
+            if code >= 0x80:
+                if i + 1 >= len(payload):
+                    break
+                vlength = int(payload[i+1])
+                value = payload[i+2:i+2+vlength]
+                i += 2 + vlength
+            else:
+                value = payload[i+1:i+2]
+                i += 2
+            yield code, value
+
+    def dispatch_row(self, code, value):
+        if code == 0xd4:
+            self.state = "standby"
+        elif code == 0xd0:
+            self.state = "connected"
+        elif code == 0xd2:
+            self.state = "disconnected"
+        elif len(value) == 0:
+            return None
+        elif code == 0x80 and len(value) == 2: # raw value
+            return "raw", struct.unpack(">h", bytes(value))[0]
+        elif code == 0x02: # Poor signal
+            return "poor_signal", int(value[0])
+        elif code == 0x04 and 0 < value[0] <= 100: # Attention (eSense)
+            return "attention", int(value[0])
+        elif code == 0x05 and 0 < value[0] <= 100: # Meditation (eSense)
+            return "meditation", int(value[0])
+        elif code == 0x16: # Blink Strength
+            return "blink", int(value[0])
+        elif code == 0x83 and len(value) == 24: # 8 bands, 3-byte big-endian
+            v = value.reshape(8, 3).astype(np.uint32)
+            return "bands", ((v[:, 0] << 16) | (v[:, 1] << 8) | v[:, 2]).tolist()
+        return None
 
-        self.attention_queue = []
-        self.meditation_queue = []
-        self.poor_signal_queue = []
-        self.blink_queue = []
-        self.raw_queue = []
 
 class DataParser(object):
-    def __init__(self, recorder):
+    def __init__(self, recorder, reference = False):
         self.recorder = recorder
+        # reference = True feeds the original byte-at-a-time generator
+        self.reference = reference
+        self.decoder = PacketDecoder()
         self.parser = self.parse()
         self.parser.__next__()
 
-    def feed(self, data):
-        for c in data:
-            self.parser.send(ord(chr(c)))
-        self.recorder.finish_chunk()
+    def feed(self, data, received = None):
+        """ decodes received bytes into the recorder, received is the monotonic time the last of them arrived """
+        received = time.monotonic() if received is None else received
+        if self.reference:
+            for c in data:
+                self.parser.send(ord(chr(c)))
+        else:
+            self.recorder.dispatch_chunk(self.decoder.decode(data))
+        self.recorder.finish_chunk(received)
     
     def dispatch_data(self, key, value):
         self.recorder.dispatch_data(key, value)
@@ -146,15 +522,16 @@ class DataParser(object):
                         self.dongle_state = "disconnected"
                     else:
                         self.sending_data = True
-                        left = packet_length - 2
-                        while left>0:
+                        # payload bytes after the current row's code, a packet can hold several rows
+                        left = packet_length - 1
+                        while left>=0:
                             if packet_code ==0x80: # raw value
                                 row_length = yield
                                 a = yield
                                 b = yield
                                 value = struct.unpack("<h",bytes([b, a]))[0]
                                 self.dispatch_data("raw", value)
-                                left -= 2
+                                left -= 3
                             elif packet_code == 0x02: # Poor signal
                                 a = yield
                                 self.dispatch_data("poor_signal", a)
@@ -186,52 +563,67 @@ class DataParser(object):
                                     a = yield
                                     b = yield
                                     c = yield
-                                    value = a*255*255+b*255+c
-                                left -= vlength
+                                    # 3-byte big-endian unsigned
+                                    value = (a << 16) | (b << 8) | c
+                                    self.current_vector.append(value)
+                                left -= vlength + 1
                                 self.dispatch_data("bands", self.current_vector)
+                            elif packet_code >= 0x80: # unknown row with a length byte
+                                vlength = yield
+                                for k in range(vlength):
+                                    yield
+                                left -= vlength + 1
+                            else: # unknown single byte row
+                                yield
+                                left -= 1
+                            if left <= 0:
+                                break
                             packet_code = yield
+                            left -= 1
+                        if packet_length > 0:
+                            checksum = yield
                 else:
                     pass # sync failed
             else:
                 pass # sync failed
 
-def connect_bluetooth_addr(addr):
-    for i in range(5):
+# pybluez is only imported once a device is searched or connected
+
+def connect_bluetooth_addr(addr, attempts = 5, delay = 1):
+    import bluetooth
+    for i in range(attempts):
         if i > 0:
-            time.sleep(1)
+            time.sleep(delay)
         sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
         try:
             sock.connect((addr, 1))
             sock.setblocking(False)
             return sock, addr
-        except:
-            print("ERROR!")
-            return None, None
+        except (bluetooth.BluetoothError, OSError) as e:
+            print(f"Connecting to {addr} failed: {e}")
+            sock.close()
     return None, None
 
-def start_headset(addr):
-    socket, socketAddress = connect_bluetooth_addr(addr)
-    failed = False
-    
+def start_headset(addr, attempts = 5):
+    """ blocks for up to a few seconds per attempt, call it off the GUI thread """
+    from bluetooth.btcommon import BluetoothError
+    socket, socketAddress = connect_bluetooth_addr(addr, attempts)
     if socket is None:
-        failed = True
+        print('Failed')
+        return None
 
-    for i in range(5):
+    # the link only counts once the headset streams, the socket is non-blocking
+    for i in range(attempts):
+        if i > 0:
+            print("Retrying...")
+            time.sleep(1)
         try:
-            if i>0:
-                print("Retrying...")
-                time.sleep(1)
-            len(socket.recv(10))
+            socket.recv(10)
             break
-        except BluetoothError:
-            failed = True
-        except:
-            print('...')
-        
-        if i == 5:
-            failed = True
-
-    if failed:
+        except (BluetoothError, OSError):
+            pass
+    else:
+        socket.close()
         print('Failed')
         return None
 
@@ -239,5 +631,6 @@ def start_headset(addr):
     return socket
 
 def search_blueetooth_devices():
+    import bluetooth
     devices = bluetooth.discover_devices(lookup_names=True,lookup_class=True, duration = 1)
     return devices
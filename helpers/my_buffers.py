@@ -0,0 +1,173 @@
+import numpy as np
+from multiprocessing import shared_memory
+
+
+class RingBuffer:
+    """
+        Fixed capacity ring buffer backed by a numpy array.
+
+        Every sample is written twice, at its position and one capacity
+        further, so that any window of up to `capacity` samples is a single
+        contiguous slice. `count` is the absolute number of samples ever
+        written and never wraps.
+    """
+    def __init__(self, capacity, dtype = np.float64):
+        self.capacity = int(capacity)
+        self.dtype = np.dtype(dtype)
+        self.data = np.zeros(2*self.capacity, dtype = self.dtype)
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def first_index(self):
+        """ absolute index of the oldest sample still held """
+        return max(0, self.count - self.capacity)
+
+    def clear(self):
+        self.data[:] = 0
+        self.count = 0
+
+    def extend(self, values):
+        values = np.asarray(values, dtype = self.dtype).ravel()
+        m = len(values)
+        if m == 0:
+            return
+        if m > self.capacity:
+            self.count += m - self.capacity
+            values = values[m-self.capacity:]
+            m = self.capacity
+
+        cap = self.capacity
+        p = self.count % cap
+        k = min(m, cap - p)
+        self.data[p:p+k] = values[:k]
+        self.data[p+cap:p+cap+k] = values[:k]
+        if k < m:
+            self.data[:m-k] = values[k:]
+            self.data[cap:cap+m-k] = values[k:]
+        self.count += m
+
+    def append(self, value):
+        self.extend([value])
+
+    def replace_last(self, value):
+        """ overwrites the newest sample """
+        p = (self.count - 1) % self.capacity
+        self.data[p] = value
+        self.data[p + self.capacity] = value
+
+    def set_bits(self, index, bits):
+        """ ORs bits into the samples at absolute indices, those no longer held are ignored """
+        index = np.asarray(index, dtype = np.int64)
+        index = index[(index >= self.first_index()) & (index < self.count)] % self.capacity
+        self.data[index] |= bits
+        self.data[index + self.capacity] |= bits
+
+    def last(self, n):
+        """
+            Zero-copy view of the last n samples, zero padded at the front
+            while fewer than n samples have been written. The view is only
+            valid until the next write.
+        """
+        n = int(n)
+        if n > self.capacity:
+            raise ValueError(f"window of {n} samples exceeds capacity {self.capacity}")
+        end = self.count % self.capacity + self.capacity
+        return self.data[end-n:end]
+
+    def get_range(self, start, end):
+        """ copy of the samples with absolute indices start..end-1 """
+        if start < self.first_index() or end > self.count or start > end:
+            raise IndexError(f"range {start}:{end} not held, available {self.first_index()}:{self.count}")
+        p = start % self.capacity
+        return self.data[p:p+end-start].copy()
+
+
+class SharedRingBuffer(RingBuffer):
+    """
+        RingBuffer whose samples and count live in a shared memory block,
+        so other processes can read it while one process writes. Create it
+        with name = None, and attach to it elsewhere with the creator's
+        `name`, capacity and dtype. The count is only advanced after the
+        samples are written.
+    """
+    def __init__(self, capacity, dtype = np.float64, name = None):
+        self.capacity = int(capacity)
+        self.dtype = np.dtype(dtype)
+        self.owner = name is None
+        size = 8 + 2*self.capacity*self.dtype.itemsize
+        self.shm = shared_memory.SharedMemory(name = name, create = self.owner, size = size)
+        self.name = self.shm.name
+        self._count = np.ndarray((1,), dtype = np.int64, buffer = self.shm.buf)
+        self.data = np.ndarray((2*self.capacity,), dtype = self.dtype, buffer = self.shm.buf, offset = 8)
+        if self.owner:
+            self.clear()
+
+    @property
+    def count(self):
+        return int(self._count[0])
+
+    @count.setter
+    def count(self, value):
+        self._count[0] = value
+
+    def close(self):
+        """ detaches, and frees the block if this process created it """
+        del self._count, self.data
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class IndexedSeries:
+    """
+        Low-rate values stamped with an absolute raw sample index, e.g.
+        eSense values or the headset's band powers: index[k] is the number
+        of raw samples received before row k. Every column is its own
+        RingBuffer next to one ring of indices, so any span of a column is
+        a contiguous slice and rows are found by binary search.
+    """
+    def __init__(self, capacity, columns = ('value',), dtype = np.float64):
+        self.columns = list(columns)
+        self.dtype = np.dtype(dtype)
+        self.index = RingBuffer(capacity, dtype = np.int64)
+        self.data = {name: RingBuffer(capacity, dtype = dtype) for name in self.columns}
+
+    def __len__(self):
+        return len(self.index)
+
+    def clear(self):
+        self.index.clear()
+        for ring in self.data.values():
+            ring.clear()
+
+    def extend(self, index, values):
+        """ values has one row per index, a 1-D array is accepted for a single column """
+        index = np.asarray(index, dtype = np.int64).ravel()
+        values = np.asarray(values).reshape(len(index), len(self.columns))
+        for i, ring in enumerate(self.data.values()):
+            ring.extend(values[:, i])
+        self.index.extend(index)
+
+    def range(self, start = None, end = None):
+        """
+            copies of the indices and values, one column per name (1-D for a
+            single column), of the rows with start <= index < end
+        """
+        n = len(self.index)
+        index = self.index.last(n)
+        lo = 0 if start is None else np.searchsorted(index, start, side = 'left')
+        hi = n if end is None else np.searchsorted(index, end, side = 'left')
+        values = np.stack([ring.last(n)[lo:hi] for ring in self.data.values()], axis = -1)
+        return index[lo:hi].copy(), values[:, 0] if len(self.columns) == 1 else values
+
+    def latest(self, sample = None):
+        """ (index, values) of the last row at or before an absolute sample index (the newest by default), None if there is none """
+        n = len(self.index)
+        index = self.index.last(n)
+        k = n if sample is None else np.searchsorted(index, sample, side = 'right')
+        if k == 0:
+            return None
+        row = np.array([ring.last(n)[k-1] for ring in self.data.values()])
+        return int(index[k-1]), row[0] if len(self.columns) == 1 else row
@@ -0,0 +1,242 @@
+import os
+import sys
+import sqlite3
+import argparse
+import datetime
+import threading
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from helpers.my_analysis import analyze_recording, feature_names, list_recordings
+from helpers.my_artifacts import ArtifactDetector, count_artifacts
+from helpers.my_recordings import load_recording
+
+
+CATALOG_NAME = 'catalog.sqlite'
+# bumped when the summary columns change, older catalogs are rebuilt
+CATALOG_VERSION = 3
+INFO_COLUMNS = ['filename', 'id', 'session', 'device', 'start_time', 'end_time', 'duration', 'samples', 'sf',
+                'artifact_ratio', 'mtime', 'size']
+COLUMNS = INFO_COLUMNS + feature_names()
+
+
+def summarize_recording(path, window_sec = 5):
+    """
+        One catalog row for a recording: header fields, the share of
+        artifact samples (from the header when it was recorded live) and
+        the mean band powers over consecutive window_sec windows.
+    """
+    header, channels = load_recording(path)
+    sf = header['sf']
+    raw = channels['raw']
+    stat = os.stat(path)
+
+    start = header.get('start_time')
+    if start is None:
+        # legacy recordings only have the file time
+        start = datetime.datetime.fromtimestamp(stat.st_mtime - len(raw)/sf).isoformat()
+    end = header.get('end_time')
+    if end is None:
+        end = (datetime.datetime.fromisoformat(start) + datetime.timedelta(seconds = len(raw)/sf)).isoformat()
+
+    artifacts = header.get('artifacts')
+    if artifacts is not None:
+        ratio = artifacts['any'] / 100
+    elif len(raw) > 0:
+        # only what the samples show, blink and poor signal reports were not kept
+        detector = ArtifactDetector(sf, history_sec = len(raw) // sf + 1)
+        ratio = count_artifacts(detector.process(raw))['any'] / len(raw)
+    else:
+        ratio = 0.0
+
+    row = {
+        'filename': os.path.basename(path),
+        'id': str(header['id']),
+        'session': header.get('session'),
+        'device': header.get('device'),
+        'start_time': start,
+        'end_time': end,
+        'duration': len(raw) / sf,
+        'samples': len(raw),
+        'sf': sf,
+        'artifact_ratio': ratio,
+        'mtime': stat.st_mtime,
+        'size': stat.st_size,
+    }
+    table = analyze_recording(path, window_sec = window_sec, step_sec = window_sec)
+    for name in feature_names():
+        # windows without a clean segment are NaN and left out
+        clean = table[name][~np.isnan(table[name])]
+        row[name] = float(np.mean(clean)) if len(clean) > 0 else None
+    return row
+
+def _summarize_safely(path):
+    try:
+        return path, summarize_recording(path), None
+    except (OSError, ValueError, KeyError) as e:
+        return path, None, str(e)
+
+
+class RecordingCatalog:
+    """
+        SQLite catalog of the recordings in a folder, kept in the folder as
+        CATALOG_NAME. Each recording is summarized once, when it is saved
+        (add) or found by sync; browsing with query() only reads the
+        catalog, never sample data. Indexed columns keep filtering and
+        sorting fast over thousands of sessions. Safe to use from several
+        threads.
+    """
+    SORTABLE = set(COLUMNS)
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, CATALOG_NAME)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread = False)
+        self.db.row_factory = sqlite3.Row
+        with self.lock, self.db:
+            if self.db.execute('PRAGMA user_version').fetchone()[0] != CATALOG_VERSION:
+                self.db.execute('DROP TABLE IF EXISTS recordings')
+            types = {'duration': 'REAL', 'samples': 'INTEGER', 'sf': 'INTEGER', 'artifact_ratio': 'REAL', 'mtime': 'REAL',
+                     'size': 'INTEGER'}
+            definitions = ', '.join(f'"{name}" {types.get(name, "REAL" if name in feature_names() else "TEXT")}'
+                                    for name in COLUMNS)
+            self.db.execute(f'CREATE TABLE IF NOT EXISTS recordings ({definitions}, PRIMARY KEY (filename))')
+            for name in ('start_time', 'device', 'duration', 'artifact_ratio'):
+                self.db.execute(f'CREATE INDEX IF NOT EXISTS recordings_{name} ON recordings ("{name}")')
+            self.db.execute(f'PRAGMA user_version = {CATALOG_VERSION}')
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM recordings').fetchone()[0]
+
+    def put(self, row):
+        """ inserts or replaces a row from summarize_recording """
+        names = ', '.join(f'"{name}"' for name in COLUMNS)
+        with self.lock, self.db:
+            self.db.execute(f'INSERT OR REPLACE INTO recordings ({names}) VALUES ({", ".join("?"*len(COLUMNS))})',
+                            [row.get(name) for name in COLUMNS])
+
+    def add(self, path):
+        """ summarizes a saved or imported recording into the catalog, returns its row """
+        row = summarize_recording(path)
+        self.put(row)
+        return row
+
+    def sync(self, workers = 1, progress = None):
+        """
+            Catalogs the folder's recordings that are new or changed since
+            they were summarized and forgets deleted ones. New files are
+            summarized on `workers` processes (None for all cores).
+            progress(text) is called as rows are added. Returns the
+            filenames that could not be read.
+        """
+        paths = list_recordings(self.folder)
+        with self.lock:
+            known = {r['filename']: (r['mtime'], r['size']) for r in self.db.execute('SELECT filename, mtime, size FROM recordings')}
+        present = {os.path.basename(p) for p in paths}
+        changed = []
+        for path in paths:
+            stat = os.stat(path)
+            if known.get(os.path.basename(path)) != (stat.st_mtime, stat.st_size):
+                changed.append(path)
+
+        with self.lock, self.db:
+            self.db.executemany('DELETE FROM recordings WHERE filename = ?', [(name,) for name in known if name not in present])
+
+        if workers == 1:
+            results = map(_summarize_safely, changed)
+        else:
+            executor = ProcessPoolExecutor(max_workers = workers)
+            results = executor.map(_summarize_safely, changed)
+        failed = []
+        try:
+            for i, (path, row, error) in enumerate(results):
+                if error is not None:
+                    failed.append(os.path.basename(path))
+                else:
+                    self.put(row)
+                if progress is not None:
+                    progress(f'Cataloged {i+1}/{len(changed)} recordings')
+        finally:
+            if workers != 1:
+                executor.shutdown()
+        return failed
+
+    def query(self, text = None, device = None, since = None, until = None, min_duration = None, max_artifact_ratio = None,
+              order = 'start_time', descending = True, limit = None, offset = 0):
+        """
+            Rows as dicts, filtered and sorted in SQLite. text matches part
+            of the id, session, device or filename; since and until bound
+            the start time (datetime or ISO text); durations are in
+            seconds. order is any column name.
+        """
+        if order not in self.SORTABLE:
+            raise ValueError(f'cannot sort by {order}')
+        where = []
+        args = []
+        if text:
+            where.append('(id LIKE ? OR session LIKE ? OR device LIKE ? OR filename LIKE ?)')
+            args += [f'%{text}%']*4
+        if device is not None:
+            where.append('device = ?')
+            args.append(device)
+        if since is not None:
+            where.append('start_time >= ?')
+            args.append(since.isoformat() if isinstance(since, datetime.datetime) else str(since))
+        if until is not None:
+            where.append('start_time < ?')
+            args.append(until.isoformat() if isinstance(until, datetime.datetime) else str(until))
+        if min_duration is not None:
+            where.append('duration >= ?')
+            args.append(min_duration)
+        if max_artifact_ratio is not None:
+            where.append('artifact_ratio <= ?')
+            args.append(max_artifact_ratio)
+
+        sql = 'SELECT * FROM recordings'
+        if len(where) > 0:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += f' ORDER BY "{order}" {"DESC" if descending else "ASC"}'
+        if limit is not None:
+            sql += ' LIMIT ? OFFSET ?'
+            args += [limit, offset]
+        with self.lock:
+            return [dict(row) for row in self.db.execute(sql, args)]
+
+
+if __name__ == '__main__':
+    # python -m helpers.my_catalog <folder> --sync --max-artifacts 0.1 --sort duration
+    argParser = argparse.ArgumentParser(description = 'Catalog of the recordings in a folder.')
+    argParser.add_argument('folder')
+    argParser.add_argument('--sync', action = 'store_true', help = 'catalog new and changed recordings first')
+    argParser.add_argument('--workers', type = int, default = 1, help = 'processes for --sync, 0 for all cores')
+    argParser.add_argument('--search', help = 'part of the id, session, device or filename')
+    argParser.add_argument('--device')
+    argParser.add_argument('--since', help = 'earliest start time, ISO format')
+    argParser.add_argument('--until', help = 'latest start time, ISO format')
+    argParser.add_argument('--min-minutes', type = float)
+    argParser.add_argument('--max-artifacts', type = float, help = 'highest artifact ratio, 0 to 1')
+    argParser.add_argument('--sort', default = 'start_time')
+    argParser.add_argument('--ascending', action = 'store_true')
+    argParser.add_argument('--limit', type = int, default = 50)
+    args = argParser.parse_args()
+
+    catalog = RecordingCatalog(args.folder)
+    if args.sync:
+        for name in catalog.sync(args.workers or None, progress = lambda text: print(text, end = '\r', file = sys.stderr)):
+            print(f'\nSkipped {name}', file = sys.stderr)
+        print(file = sys.stderr)
+    rows = catalog.query(args.search, args.device, args.since, args.until,
+                         args.min_minutes*60 if args.min_minutes is not None else None, args.max_artifacts,
+                         args.sort, not args.ascending, args.limit)
+    for row in rows:
+        bands = '  '.join(f"{name[:-9]} {row[name]:.2f}" for name in feature_names() if name.endswith('_relative') and row[name] is not None)
+        print(f"{row['start_time'][:19]}  {row['duration']/60:7.1f} min  {100*row['artifact_ratio']:5.1f}% art  "
+              f"{row['device'] or '-':17}  {row['filename']}  {bands}")
+    print(f'{len(rows)} of {len(catalog)} recordings', file = sys.stderr)
+    catalog.close()
@@ -0,0 +1,282 @@
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+from helpers.my_buffers import SharedRingBuffer
+from helpers.my_features import DEFAULT_BANDS
+
+
+# widest plot, in pixels, the shared envelopes have room for
+MAX_WIDTH = 4096
+MAX_POINTS = 2*(MAX_WIDTH + 3)
+ENVELOPES = ('long', 'short', 'filtered')
+
+
+class SharedArrays:
+    """
+        Named numpy arrays laid out in one shared memory block. fields maps
+        names to (dtype, shape); the creator passes name = None, other
+        processes attach with its `name` and the same fields.
+    """
+    def __init__(self, fields, name = None):
+        self.owner = name is None
+        offsets = {}
+        size = 0
+        for key, (dtype, shape) in fields.items():
+            dtype = np.dtype(dtype)
+            size = -(-size // 8) * 8 # 8 byte alignment
+            offsets[key] = (dtype, shape, size)
+            size += dtype.itemsize * int(np.prod(shape))
+        self.shm = shared_memory.SharedMemory(name = name, create = self.owner, size = max(size, 8))
+        self.name = self.shm.name
+        self.arrays = {key: np.ndarray(shape, dtype = dtype, buffer = self.shm.buf, offset = offset)
+                       for key, (dtype, shape, offset) in offsets.items()}
+        if self.owner:
+            for array in self.arrays.values():
+                array[...] = 0
+
+    def __getitem__(self, key):
+        return self.arrays[key]
+
+    def close(self):
+        self.arrays = {}
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def output_fields(nbins, nbands, ncols):
+    fields = {
+        # seq is odd while the worker writes a frame
+        'seq': (np.int64, (1,)),
+        'generation': (np.int64, (1,)),
+        'count': (np.int64, (1,)),
+        'lengths': (np.int64, (len(ENVELOPES),)),
+        'freqScale': (np.float64, (nbins,)),
+        'power': (np.float64, (nbins,)),
+        'bands': (np.float64, (nbands,)),
+        'spectrogram': (np.float32, (ncols, nbins)),
+        'spectrogramCount': (np.int64, (1,)),
+        'spectrogramLevels': (np.float64, (2,)),
+        'stages': (np.float64, (5,)),
+    }
+    for key in ENVELOPES:
+        fields[f'{key}X'] = (np.float64, (MAX_POINTS,))
+        fields[f'{key}Y'] = (np.float64, (MAX_POINTS,))
+    return fields
+
+CONTROL_FIELDS = {
+    'stop': (np.int64, (1,)),
+    'generation': (np.int64, (1,)),
+    'widths': (np.int64, (2,)),
+}
+STAGES = ('windows', 'filter', 'spectrum', 'spectrogram', 'bands')
+
+
+class SharedRawSource:
+    """ the raw-sample reads of DataRecorder that FramePipeline uses, over SharedRingBuffers of raw samples and artifact flags """
+    def __init__(self, ring, flags):
+        self.raw = ring
+        self.flags = flags
+
+    def get_raw_range(self, start, end):
+        start = max(start, self.raw.first_index())
+        return self.raw.get_range(start, min(end, self.raw.count))
+
+    def get_raw_since(self, start, limit = None):
+        end = self.raw.count
+        start = min(max(start, self.raw.first_index()), end)
+        if limit is not None:
+            start = max(start, end - limit)
+        return self.raw.get_range(start, end), end
+
+    def get_artifact_range(self, start, end):
+        start = max(start, self.flags.first_index())
+        return self.flags.get_range(start, end)
+
+
+def _worker_main(rawName, flagsName, outName, controlName, capacity, params, fields, ready):
+    # runs in the compute process, scipy is only imported here
+    from helpers.my_pipeline import FramePipeline
+
+    raw = SharedRingBuffer(capacity, np.int16, name = rawName)
+    flags = SharedRingBuffer(capacity, np.uint8, name = flagsName)
+    out = SharedArrays(fields, name = outName)
+    control = SharedArrays(CONTROL_FIELDS, name = controlName)
+    source = SharedRawSource(raw, flags)
+    pipeline = FramePipeline(**params)
+    metrics = pipeline.metrics
+
+    generation = -1
+    widths = None
+    while control['stop'][0] == 0:
+        ready.wait(0.05)
+        ready.clear()
+        changed = False
+        if control['generation'][0] != generation:
+            generation = int(control['generation'][0])
+            pipeline.reset()
+            changed = True
+        if tuple(control['widths']) != widths:
+            widths = tuple(int(w) for w in control['widths'])
+            pipeline.set_widths(source, *widths)
+            changed = True
+        if raw.count == pipeline.count and not changed:
+            continue
+
+        metrics.current = {}
+        try:
+            frame = pipeline.compute(source)
+        except IndexError:
+            continue # the ring was cleared meanwhile, the next generation follows
+
+        out['seq'][0] += 1
+        out['generation'][0] = generation
+        out['count'][0] = pipeline.count
+        for i, key in enumerate(ENVELOPES):
+            x, y = frame[key]
+            n = min(len(x), MAX_POINTS)
+            out['lengths'][i] = n
+            out[f'{key}X'][:n] = x[:n]
+            out[f'{key}Y'][:n] = y[:n]
+        out['freqScale'][:] = frame['freqScale']
+        out['power'][:] = frame['power']
+        out['bands'][:] = frame['bands']
+        if out['spectrogramCount'][0] != frame['spectrogramCount']:
+            out['spectrogram'][:] = frame['spectrogram']
+            out['spectrogramCount'][0] = frame['spectrogramCount']
+        out['spectrogramLevels'][:] = frame['spectrogramLevels'] or (0, 1)
+        out['stages'][:] = [metrics.current.get(stage, 0.0) for stage in STAGES]
+        out['seq'][0] += 1
+
+    raw.close()
+    flags.close()
+    out.close()
+    control.close()
+
+
+class ComputeProcess:
+    """
+        FramePipeline in a worker process. The GUI side writes new raw
+        samples into a shared ring (on_chunk is a DataRecorder listener)
+        and the worker filters, transforms and reduces them into shared
+        output arrays stamped with a sequence number, odd while being
+        written. compute() only copies the latest complete frame, so no
+        array is ever pickled and DSP cost no longer runs under the GUI's
+        GIL. Offers the parts of FramePipeline's interface DAGUI uses.
+    """
+    def __init__(self, sf = 512, numSecLong = 20, numSecShort = 5, minFrequency = 1, maxFrequency = 45, filterOrder = 4,
+                 metrics = None, numSecSpectrogram = 60, history_sec = 60):
+        self.sf = sf
+        self.metrics = metrics
+        self.numSecSpectrogram = numSecSpectrogram
+        self.widths = (0, 0)
+        self.count = 0
+
+        # same bins as WelchEstimator(sf, nperseg = sf)
+        freqs = np.fft.rfftfreq(sf, 1/sf)
+        self.freqScale = freqs[np.argmin(np.abs(freqs-minFrequency)):np.argmin(np.abs(freqs-maxFrequency))]
+        ncols = numSecSpectrogram*sf // (sf // 2)
+        self.fields = output_fields(len(self.freqScale), len(DEFAULT_BANDS), ncols)
+
+        self.raw = SharedRingBuffer(max(history_sec, numSecLong)*sf, np.int16)
+        self.flags = SharedRingBuffer(self.raw.capacity, np.uint8)
+        self.out = SharedArrays(self.fields)
+        self.control = SharedArrays(CONTROL_FIELDS)
+        self.generation = 0
+        self.lastSeq = -1
+        self.frame = self.blank_frame()
+
+        params = dict(sf = sf, numSecLong = numSecLong, numSecShort = numSecShort, minFrequency = minFrequency,
+                      maxFrequency = maxFrequency, filterOrder = filterOrder, numSecSpectrogram = numSecSpectrogram)
+        # spawn, a forked copy of the Qt process is not safe
+        context = mp.get_context('spawn')
+        self.ready = context.Event()
+        self.process = context.Process(target = _worker_main, daemon = True,
+                                       args = (self.raw.name, self.flags.name, self.out.name, self.control.name,
+                                               self.raw.capacity, params, self.fields, self.ready))
+        self.process.start()
+
+    def on_chunk(self, start, chunk):
+        """ DataRecorder listener, copies new raw samples and their artifact flags into the shared rings """
+        for bit, index in chunk.get('artifacts_late', {}).items():
+            if bit != 0:
+                self.flags.set_bits(index, bit)
+        if 'raw' in chunk:
+            # flags first, the worker only reads up to the raw count
+            self.flags.extend(chunk['artifacts'])
+            self.raw.extend(chunk['raw'])
+            self.ready.set()
+
+    def blank_frame(self):
+        empty = (np.zeros(0), np.zeros(0))
+        return {'long': empty, 'short': empty, 'filtered': empty,
+                'freqScale': self.freqScale, 'power': np.zeros(len(self.freqScale)),
+                'bands': np.zeros(self.fields['bands'][1][0]),
+                'spectrogram': np.zeros(self.fields['spectrogram'][1], dtype=np.float32),
+                'spectrogramCount': 0, 'spectrogramLevels': None}
+
+    def reset(self):
+        """ drops the streaming state after the recorder was cleared """
+        self.raw.clear()
+        self.flags.clear()
+        self.generation += 1
+        self.control['generation'][0] = self.generation
+        self.count = 0
+        self.frame = self.blank_frame()
+        self.ready.set()
+
+    def set_widths(self, recorder, longWidth, shortWidth):
+        widths = (min(longWidth, MAX_WIDTH), min(shortWidth, MAX_WIDTH))
+        if widths != self.widths:
+            self.widths = widths
+            self.control['widths'][:] = widths
+            self.ready.set()
+
+    def compute(self, recorder):
+        """ the latest frame from the worker, the previous one while it has nothing newer """
+        out = self.out
+        for attempt in range(100):
+            seq = int(out['seq'][0])
+            if seq == self.lastSeq or seq % 2 == 1:
+                if seq % 2 == 1:
+                    continue # being written, retry
+                return self.frame
+            if out['generation'][0] != self.generation:
+                return self.frame
+            frame = {}
+            lengths = out['lengths'].copy()
+            for i, key in enumerate(ENVELOPES):
+                frame[key] = (out[f'{key}X'][:lengths[i]].copy(), out[f'{key}Y'][:lengths[i]].copy())
+            frame['freqScale'] = out['freqScale'].copy()
+            frame['power'] = out['power'].copy()
+            frame['bands'] = out['bands'].copy()
+            frame['spectrogramCount'] = int(out['spectrogramCount'][0])
+            if frame['spectrogramCount'] != self.frame['spectrogramCount']:
+                frame['spectrogram'] = out['spectrogram'].copy()
+            else:
+                frame['spectrogram'] = self.frame['spectrogram']
+            frame['spectrogramLevels'] = tuple(out['spectrogramLevels'])
+            count = int(out['count'][0])
+            stages = out['stages'].copy()
+            if int(out['seq'][0]) == seq:
+                self.lastSeq = seq
+                self.frame = frame
+                self.count = count
+                if self.metrics is not None:
+                    # worker stage times show up like local ones
+                    for stage, seconds in zip(STAGES, stages):
+                        self.metrics.record(stage, seconds)
+                return frame
+        return self.frame
+
+    def close(self):
+        self.control['stop'][0] = 1
+        self.ready.set()
+        self.process.join(2)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.raw.close()
+        self.flags.close()
+        self.out.close()
+        self.control.close()
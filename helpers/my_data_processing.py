@@ -1,6 +1,9 @@
 import numpy as np
-import scipy.signal as ss
-from scipy.ndimage import gaussian_filter
+
+from helpers.my_buffers import RingBuffer
+from helpers.my_artifacts import interpolate_masked
+
+# scipy is imported where it is used, importing this module stays cheap
 
 
 def standardize(a):
@@ -17,18 +20,369 @@ def normalize(a):
         return (a - a.min())/diff
 
 def get_power(a, sf, minF = 1, maxF = 45):
+    """ a is one signal or a 2-D stack of equal length windows, one per row """
+    import scipy.signal as ss
+    from scipy.ndimage import gaussian_filter1d
     freqScale, power = ss.periodogram(a, sf, window='tukey', scaling='density')
     argMaxF = np.argmin(np.abs(freqScale-maxF))
     argMinF = np.argmin(np.abs(freqScale-minF))
     freqScale = freqScale[argMinF:argMaxF]
-    power = power[argMinF:argMaxF]
-    power = gaussian_filter(power, sigma=1)
+    power = power[..., argMinF:argMaxF]
+    power = gaussian_filter1d(power, sigma=1, axis=-1)
     return freqScale, power
 
 def filter_data(sig, sf = 512):
+    """ sig is one signal or a 2-D stack of windows, filtered along the last axis """
+    import scipy.signal as ss
     sig = np.array(sig)
     sig[np.abs(sig)>2500] = 0
     n = 10
     Wn = [1/(sf//2),45/(sf//2)]
     b = ss.firwin(n, Wn, pass_zero='bandpass')
     return ss.filtfilt(b, 1, sig)
+
+
+class StreamingFilter:
+    """
+        Causal band-pass filter that is designed once and keeps its state
+        between chunks, so each frame only filters the samples that arrived
+        since the previous one. The filtered signal is kept in a ring for
+        plotting. ftype is 'fir' or any scipy iirfilter type ('butter',
+        'cheby1', ...); order is the number of taps for 'fir'.
+
+        Samples beyond clip are zeroed. Given an artifact mask instead,
+        process() bridges masked samples with interpolate_masked, which
+        does not put steps into the filtered signal.
+    """
+    def __init__(self, sf = 512, minF = 1, maxF = 45, order = 4, ftype = 'butter', history_sec = 5, clip = 2500):
+        import scipy.signal as ss
+        self.sf = sf
+        self.minF = minF
+        self.maxF = maxF
+        self.order = order
+        self.ftype = ftype
+        self.clip = clip
+
+        if ftype == 'fir':
+            self.b = ss.firwin(order, [minF, maxF], pass_zero='bandpass', fs=sf)
+            self.sos = None
+        else:
+            self.b = None
+            self.sos = ss.iirfilter(order, [minF, maxF], btype='bandpass', ftype=ftype, fs=sf, output='sos')
+
+        self.history = RingBuffer(history_sec*sf)
+        self.reset()
+
+    def reset(self):
+        if self.sos is None:
+            self.zi = np.zeros(len(self.b) - 1)
+        else:
+            self.zi = np.zeros((self.sos.shape[0], 2))
+        self.history.clear()
+        # absolute index of the next raw sample to filter
+        self.count = 0
+        # last unmasked sample, where interpolation starts from
+        self.lastClean = 0.0
+
+    def _prepare(self, sig):
+        sig = np.array(sig, dtype=np.float64)
+        if self.clip is not None:
+            sig[np.abs(sig) > self.clip] = 0
+        return sig
+
+    def process(self, chunk, masked = None):
+        """ filters new samples, appends them to the history and returns them; masked flags artifacts """
+        if masked is None:
+            chunk = self._prepare(chunk)
+        else:
+            chunk, self.lastClean = interpolate_masked(chunk, masked, self.lastClean)
+        if len(chunk) > 0:
+            import scipy.signal as ss
+            if self.sos is None:
+                chunk, self.zi = ss.lfilter(self.b, 1, chunk, zi=self.zi)
+            else:
+                chunk, self.zi = ss.sosfilt(self.sos, chunk, zi=self.zi)
+            self.history.extend(chunk)
+        self.count += len(chunk)
+        return chunk
+
+    def update(self, recorder):
+        """ filters whatever the recorder received since the last call """
+        chunk, end = recorder.get_raw_since(self.count, limit = self.history.capacity)
+        chunk = self.process(chunk)
+        self.count = end
+        return chunk
+
+    def last(self, n):
+        """ view of the last n filtered samples """
+        return self.history.last(n)
+
+    def zero_phase(self, sig):
+        """ offline forward-backward filtering with the same design, for saved recordings """
+        import scipy.signal as ss
+        sig = self._prepare(sig)
+        if self.sos is None:
+            return ss.filtfilt(self.b, 1, sig)
+        return ss.sosfiltfilt(self.sos, sig)
+
+
+class WelchEstimator:
+    """
+        Sliding-window Welch spectrum. The power of every completed segment
+        is cached, so each frame only transforms the segments that new
+        samples complete. Segments are averaged over window_sec ('welch')
+        or exponentially smoothed with alpha ('ema'). Bin edges are
+        computed once, with the same convention as get_power.
+
+        process() optionally takes an artifact mask of the new samples;
+        segments with more than max_masked of their samples masked are
+        still returned but left out of power(). Short artifacts are already
+        bridged by the filter, so a few masked samples are tolerated. While
+        no segment in the window is clean, power() holds the last spectrum
+        it had instead of dropping to zero. Flags that arrive after their
+        samples (blinks) are applied with remask().
+    """
+    def __init__(self, sf = 512, nperseg = 512, overlap = 0.5, window_sec = 5, minF = 1, maxF = 45,
+                 mode = 'welch', alpha = 0.2, window = 'hann', max_masked = 0.1):
+        import scipy.signal as ss
+        self.sf = sf
+        self.nperseg = nperseg
+        self.hop = max(1, int(nperseg*(1 - overlap)))
+        self.mode = mode
+        self.alpha = alpha
+        self.max_masked = max_masked
+
+        self.window = ss.get_window(window, nperseg)
+        # one-sided density scaling, the kept bins never include DC or Nyquist
+        self.scale = 2.0 / (sf * np.sum(self.window**2))
+
+        freqs = np.fft.rfftfreq(nperseg, 1/sf)
+        self.argMinF = np.argmin(np.abs(freqs-minF))
+        self.argMaxF = np.argmin(np.abs(freqs-maxF))
+        self.freqScale = freqs[self.argMinF:self.argMaxF]
+
+        self.nsegments = max(1, (int(window_sec*sf) - nperseg)//self.hop + 1)
+        # samples covered by the stored segments plus the pending ones, what remask() needs at most
+        self.span = self.nsegments*self.hop + nperseg
+        self.segments = np.zeros((self.nsegments, len(self.freqScale)))
+        self.valid = np.zeros(self.nsegments, dtype=bool)
+        self.reset()
+
+    def reset(self):
+        self.segments[:] = 0
+        self.valid[:] = False
+        self.filled = 0
+        self.pos = 0
+        self.ema = np.zeros(len(self.freqScale))
+        self.emaStarted = False
+        self.lastPower = np.zeros(len(self.freqScale))
+        self.pending = np.zeros(0)
+        self.pendingMasked = np.zeros(0, dtype=bool)
+
+    def _segment_power(self, seg):
+        """ power of one nperseg long segment, or of every row of a stack of them """
+        seg = (seg - np.mean(seg, axis=-1, keepdims=True)) * self.window
+        spec = np.fft.rfft(seg, axis=-1)[..., self.argMinF:self.argMaxF]
+        return (spec.real**2 + spec.imag**2) * self.scale
+
+    def segment_powers(self, sig, masked = None, batch = 4096):
+        """
+            Offline counterpart of process() for a whole signal: start
+            indices and spectra of all its segments, on the same hop grid
+            from sample 0, and whether each one would count in power().
+        """
+        sig = np.asarray(sig, dtype=np.float64)
+        nseg = max(0, (len(sig) - self.nperseg)//self.hop + 1)
+        starts = np.arange(nseg)*self.hop
+        powers = np.zeros((nseg, len(self.freqScale)))
+        windows = np.lib.stride_tricks.sliding_window_view(sig, self.nperseg)[::self.hop] if nseg > 0 else None
+        for i in range(0, nseg, batch):
+            powers[i:i+batch] = self._segment_power(windows[i:i+batch])
+        if masked is None:
+            return starts, powers, np.ones(nseg, dtype=bool)
+        counts = np.concatenate([[0], np.cumsum(masked, dtype=np.int64)])
+        valid = counts[starts + self.nperseg] - counts[starts] <= self.max_masked*self.nperseg
+        return starts, powers, valid
+
+    def process(self, chunk, masked = None):
+        """ adds new samples, transforming only the segments they complete; returns their spectra as rows """
+        if len(chunk) == 0:
+            return np.zeros((0, len(self.freqScale)))
+        if masked is None:
+            masked = np.zeros(len(chunk), dtype=bool)
+        pending = np.concatenate([self.pending, chunk])
+        pendingMasked = np.concatenate([self.pendingMasked, masked])
+        start = 0
+        new = []
+        while start + self.nperseg <= len(pending):
+            p = self._segment_power(pending[start:start+self.nperseg])
+            ok = np.count_nonzero(pendingMasked[start:start+self.nperseg]) <= self.max_masked*self.nperseg
+            new.append(p)
+            if self.mode == 'ema' and ok:
+                self.ema = self.alpha*p + (1-self.alpha)*self.ema if self.emaStarted else p
+                self.emaStarted = True
+            self.segments[self.pos] = p
+            self.valid[self.pos] = ok
+            self.pos = (self.pos + 1) % self.nsegments
+            self.filled = min(self.filled + 1, self.nsegments)
+            start += self.hop
+        self.pending = pending[start:]
+        self.pendingMasked = pendingMasked[start:]
+        return np.array(new) if len(new) > 0 else np.zeros((0, len(self.freqScale)))
+
+    def remask(self, masked):
+        """
+            replaces the artifact mask of the last len(masked) samples given
+            to process() and re-judges the stored segments inside it. The
+            'ema' average cannot give a segment back and keeps it.
+        """
+        masked = np.asarray(masked, dtype=bool)
+        k = min(len(masked), len(self.pendingMasked))
+        if k > 0:
+            self.pendingMasked[-k:] = masked[len(masked)-k:]
+        counts = np.concatenate([[0], np.cumsum(masked, dtype=np.int64)])
+        # ends of the stored segments inside masked, newest first; pending starts one hop into the newest
+        ends = len(masked) - len(self.pending) + self.nperseg - self.hop - np.arange(self.filled)*self.hop
+        ends = ends[ends >= self.nperseg]
+        slots = (self.pos - 1 - np.arange(len(ends))) % self.nsegments
+        self.valid[slots] = counts[ends] - counts[ends - self.nperseg] <= self.max_masked*self.nperseg
+
+    def power(self):
+        if self.filled == 0:
+            return np.zeros(len(self.freqScale))
+        if self.mode == 'ema':
+            return self.ema
+        valid = self.valid[:self.filled]
+        if np.any(valid):
+            self.lastPower = np.mean(self.segments[:self.filled][valid], axis=0)
+        return self.lastPower
+
+
+class Spectrogram:
+    """
+        Scrolling spectrogram from the segment spectra of a WelchEstimator,
+        one column per hop. Columns are stored once, in dB, in a 2-D ring
+        written twice (like RingBuffer) so the last ncols columns are always
+        one contiguous (ncols, nbins) view, oldest first. Adding a column
+        costs the same whatever the span. Display levels follow the 5th and
+        99th percentile of new columns, smoothed with alpha.
+    """
+    def __init__(self, nbins, ncols, alpha = 0.05):
+        self.nbins = nbins
+        self.ncols = ncols
+        self.alpha = alpha
+        self.data = np.zeros((2*ncols, nbins), dtype=np.float32)
+        self.reset()
+
+    def reset(self):
+        self.data[:] = 0
+        self.count = 0
+        self.levels = None
+
+    def add(self, columns):
+        """ columns holds one power spectrum per row """
+        if len(columns) == 0:
+            return
+        db = 10*np.log10(np.asarray(columns) + 1e-12)
+        for column in db[-self.ncols:]:
+            i = self.count % self.ncols
+            self.data[i] = column
+            self.data[i + self.ncols] = column
+            self.count += 1
+        lo, hi = np.percentile(db, [5, 99])
+        if self.levels is None:
+            self.levels = (lo, hi)
+        else:
+            self.levels = tuple(a + self.alpha*(b - a) for a, b in zip(self.levels, (lo, hi)))
+
+    def image(self):
+        """ view of the last ncols columns, valid until the next add """
+        i = self.count % self.ncols
+        return self.data[i:i + self.ncols]
+
+
+class MinMaxDecimator:
+    """
+        Reduces the last n samples of a stream to a min/max envelope with
+        one bucket per pixel column, which keeps every peak visible while
+        drawing far fewer points. Buckets are aligned to absolute sample
+        indices, so completed buckets never change and each update only
+        reduces the new samples. Call set_width when the plot is resized.
+    """
+    def __init__(self, n, width = 1000, clip = None):
+        self.n = n
+        self.clip = clip
+        self.set_width(width)
+
+    def set_width(self, width):
+        """ changes the bucket size, the caller has to refill the window with rebuild """
+        self.width = max(1, int(width))
+        self.bucket = max(1, int(np.ceil(self.n / self.width)))
+        self.nbuckets = int(np.ceil(self.n / self.bucket)) + 2
+        self.mins = np.zeros(self.nbuckets)
+        self.maxs = np.zeros(self.nbuckets)
+        self.x = np.zeros(2*self.nbuckets)
+        self.y = np.zeros(2*self.nbuckets)
+        self.reset()
+
+    def reset(self, count = 0):
+        self.mins[:] = 0
+        self.maxs[:] = 0
+        # absolute index of the next sample, and of the first one held
+        self.count = count
+        self.origin = count
+
+    def rebuild(self, window, end):
+        """ refills the envelope from the last samples of a stream that ends at absolute index end """
+        window = window[-self.n:]
+        self.reset(end - len(window))
+        self.process(window)
+
+    def process(self, chunk, start = None):
+        if start is not None and start != self.count:
+            self.reset(start)
+        chunk = np.asarray(chunk, dtype=np.float64)
+        m = len(chunk)
+        if m == 0:
+            return
+        if self.clip is not None:
+            chunk = chunk.copy()
+            chunk[np.abs(chunk) > self.clip] = 0
+
+        # split the chunk where bucket boundaries fall
+        first = self.count % self.bucket
+        starts = np.arange((self.bucket - first) % self.bucket, m, self.bucket)
+        if len(starts) == 0 or starts[0] != 0:
+            starts = np.concatenate([[0], starts])
+        mins = np.minimum.reduceat(chunk, starts)
+        maxs = np.maximum.reduceat(chunk, starts)
+        ids = (self.count + starts) // self.bucket
+        slots = ids % self.nbuckets
+
+        if first != 0 and self.count > self.origin: # the first piece continues a partial bucket
+            mins[0] = min(mins[0], self.mins[slots[0]])
+            maxs[0] = max(maxs[0], self.maxs[slots[0]])
+        self.mins[slots] = mins
+        self.maxs[slots] = maxs
+        self.count += m
+
+    def envelope(self):
+        """
+            x, y for the curve: two points (min, max) per bucket, x in
+            samples from the start of the window. Views of reused buffers.
+        """
+        lastId = (self.count - 1) // self.bucket
+        firstId = (self.count - self.n) // self.bucket
+        ids = np.arange(firstId, lastId + 1)
+        k = len(ids)
+        slots = ids % self.nbuckets
+        offset = self.count - self.n
+        x = self.x[:2*k]
+        y = self.y[:2*k]
+        x[0::2] = np.maximum(ids*self.bucket - offset, 0)
+        x[1::2] = x[0::2]
+        # buckets before the first sample are zero padding, like get_last_n_raw_second
+        valid = (ids + 1)*self.bucket > self.origin
+        y[0::2] = np.where(valid, self.mins[slots], 0)
+        y[1::2] = np.where(valid, self.maxs[slots], 0)
+        return x, y
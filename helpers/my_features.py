@@ -0,0 +1,100 @@
+import numpy as np
+
+
+DEFAULT_BANDS = [('delta', 1, 4), ('theta', 4, 8), ('alpha', 8, 13), ('beta', 13, 30), ('gamma', 30, 45)]
+DEFAULT_RATIOS = [('theta', 'beta')]
+
+
+class BandPowers:
+    """
+        Band power features from a spectrum with a fixed frequency scale.
+
+        Bin edges are located once and folded into an aggregation matrix,
+        so the band densities and summed band powers of any number of
+        spectra come out of a single matrix product. Bands follow the edge convention
+        of get_power: bins from the one nearest lo up to, excluding, the
+        one nearest hi.
+    """
+    def __init__(self, freqScale, bands = DEFAULT_BANDS, ratios = DEFAULT_RATIOS):
+        self.freqScale = np.asarray(freqScale)
+        self.bands = list(bands)
+        self.names = [name for name, lo, hi in self.bands]
+        self.ratios = list(ratios)
+        self.ratioIndex = [(self.names.index(a), self.names.index(b)) for a, b in self.ratios]
+
+        nbands = len(self.bands)
+        # first half: mean power per Hz (what the bar chart shows), second half: band sums
+        self.matrix = np.zeros((len(self.freqScale), 2*nbands))
+        for i, (name, lo, hi) in enumerate(self.bands):
+            argMinF = np.argmin(np.abs(self.freqScale-lo))
+            argMaxF = np.argmin(np.abs(self.freqScale-hi))
+            self.matrix[argMinF:argMaxF, i] = 1 / (hi-lo)
+            self.matrix[argMinF:argMaxF, nbands+i] = 1
+
+    def compute(self, power):
+        """
+            power is one spectrum or a 2-D stack with one spectrum per row.
+            Returns density (the band's mean power spectral density, in
+            squared raw units per Hz, not its total power), relative (share
+            of the summed power of all bands) and ratios (of the bands'
+            summed powers, the conventional band power ratio) arrays, last
+            axis over bands or ratios.
+        """
+        power = np.asarray(power)
+        nbands = len(self.bands)
+        agg = power @ self.matrix
+        density = agg[..., :nbands]
+        sums = agg[..., nbands:]
+
+        total = np.sum(sums, axis=-1, keepdims=True)
+        relative = np.divide(sums, total, out=np.zeros_like(sums), where=total > 0)
+
+        # ratios of densities would scale with the band widths (theta/beta by 17/4)
+        num = sums[..., [a for a, b in self.ratioIndex]]
+        den = sums[..., [b for a, b in self.ratioIndex]]
+        ratios = np.divide(num, den, out=np.zeros_like(num), where=den > 0)
+        return {'density': density, 'relative': relative, 'ratios': ratios}
+
+    def ratio_names(self):
+        return [f'{a}/{b}' for a, b in self.ratios]
+
+
+# the eight bands the headset's chip reports in 0x83 packets, in Hz
+DEVICE_BANDS = [('delta', 0.5, 2.75), ('theta', 3.5, 6.75), ('low_alpha', 7.5, 9.25), ('high_alpha', 10, 11.75),
+                ('low_beta', 13, 16.75), ('high_beta', 18, 29.75), ('low_gamma', 31, 39.75), ('mid_gamma', 41, 49.75)]
+
+
+class DeviceBandPowers:
+    """
+        Folds the headset's own band powers (DEVICE_BANDS) into bands like
+        DEFAULT_BANDS, each device band going to the band it overlaps most.
+        Gives the bar chart its values without any host-side FFT. The chip
+        reports unitless powers, so only relative values are comparable to
+        BandPowers.
+    """
+    def __init__(self, bands = DEFAULT_BANDS, deviceBands = DEVICE_BANDS):
+        self.bands = list(bands)
+        self.names = [name for name, lo, hi in self.bands]
+        self.deviceNames = [name for name, lo, hi in deviceBands]
+
+        nbands = len(self.bands)
+        # first half: mean power per Hz, second half: band sums, like BandPowers
+        self.matrix = np.zeros((len(deviceBands), 2*nbands))
+        for j, (name, dlo, dhi) in enumerate(deviceBands):
+            overlaps = [min(dhi, hi) - max(dlo, lo) for name, lo, hi in self.bands]
+            i = int(np.argmax(overlaps))
+            if overlaps[i] > 0:
+                lo, hi = self.bands[i][1:]
+                self.matrix[j, i] = 1 / (hi-lo)
+                self.matrix[j, nbands+i] = 1
+
+    def compute(self, values):
+        """ values is one row of device band powers or a 2-D stack of rows, returns density and relative like BandPowers """
+        values = np.asarray(values, dtype=np.float64)
+        nbands = len(self.bands)
+        agg = values @ self.matrix
+        density = agg[..., :nbands]
+        sums = agg[..., nbands:]
+        total = np.sum(sums, axis=-1, keepdims=True)
+        relative = np.divide(sums, total, out=np.zeros_like(sums), where=total > 0)
+        return {'density': density, 'relative': relative}
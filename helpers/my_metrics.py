@@ -0,0 +1,188 @@
+import os
+import csv
+import json
+import time
+import numpy as np
+
+from helpers.my_buffers import RingBuffer
+
+
+class StageTimer:
+    """ context manager that adds its duration to a FrameMetrics stage """
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class FrameMetrics:
+    """
+        Frame-time instrumentation for the live view. Stage durations,
+        frame intervals and per-tick counters are kept in rings of the last
+        `window` frames; summary() reduces them to rolling percentiles.
+
+        A frame is late when it starts more than late_factor intervals after
+        the previous one, and every whole interval beyond the first counts
+        as a skipped frame. Latency is the time from receiving the newest
+        drawn sample to the end of the frame that drew it.
+    """
+    def __init__(self, interval_ms = 40, sf = 512, window = 500, late_factor = 1.5):
+        self.interval_ms = interval_ms
+        self.sf = sf
+        self.window = window
+        self.late_factor = late_factor
+
+        self.stages = {}
+        self.timers = {}
+        self.current = {}
+        self.frameTimes = RingBuffer(window)
+        self.intervals = RingBuffer(window)
+        self.bytes = RingBuffer(window)
+        self.backlog = RingBuffer(window)
+        self.stamps = RingBuffer(window)
+        self.samples = RingBuffer(window)
+        self.latency = RingBuffer(window)
+        # estimates from the recorder's timestamp track, see set_link
+        self.link = {'rate': 0.0, 'drift_ppm': 0.0, 'gaps': 0, 'lost_seconds': 0.0}
+
+        self.frames = 0
+        self.lateFrames = 0
+        self.skippedFrames = 0
+        self.lastStart = None
+        self.lastBytes = None
+
+    def stage(self, name):
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = StageTimer(self, name)
+            self.stages[name] = RingBuffer(self.window)
+        return timer
+
+    def record(self, name, seconds):
+        """ adds a duration measured elsewhere, e.g. in a worker process, to a stage of the current frame """
+        self.stage(name)
+        self.current[name] = self.current.get(name, 0.0) + seconds
+
+    def begin_frame(self, expected_ms = None):
+        """ expected_ms is the interval this frame was scheduled at, interval_ms by default """
+        expected_ms = expected_ms or self.interval_ms
+        now = time.perf_counter()
+        if self.lastStart is not None:
+            interval = (now - self.lastStart) * 1000
+            self.intervals.append(interval)
+            if interval > self.late_factor*expected_ms:
+                self.lateFrames += 1
+                self.skippedFrames += int(interval // expected_ms) - 1
+        self.lastStart = now
+        self.current = {}
+
+    def idle(self):
+        """ a tick without a frame, the next interval is not judged for lateness """
+        self.lastStart = None
+
+    def end_frame(self, bytes_total = 0, samples_total = 0, backlog = 0, received = None):
+        """
+            closes the frame; totals are running counters, deltas are derived
+            here. received is the monotonic receive time of the newest sample
+            drawn, None if the frame drew no new samples.
+        """
+        now = time.perf_counter()
+        self.frameTimes.append((now - self.lastStart) * 1000)
+        for name, ring in self.stages.items():
+            ring.append(self.current.get(name, 0.0) * 1000)
+
+        if self.lastBytes is not None and bytes_total >= self.lastBytes:
+            self.bytes.append(bytes_total - self.lastBytes)
+        self.lastBytes = bytes_total
+        self.backlog.append(backlog)
+        self.stamps.append(now)
+        self.samples.append(samples_total)
+        if received is not None:
+            self.latency.append((time.monotonic() - received) * 1000)
+        self.frames += 1
+
+    def set_link(self, rate, drift_ppm, gaps, lost_seconds):
+        """ real sampling rate, clock drift and detected sample loss of the shown device """
+        self.link = {'rate': float(rate), 'drift_ppm': float(drift_ppm), 'gaps': int(gaps), 'lost_seconds': float(lost_seconds)}
+
+    @staticmethod
+    def _percentiles(ring):
+        values = ring.last(len(ring))
+        if len(values) == 0:
+            return {'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'max': 0.0}
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        return {'p50': float(p50), 'p95': float(p95), 'p99': float(p99), 'max': float(np.max(values))}
+
+    def sample_rate(self):
+        """ samples received per second over the window, compare with sf """
+        n = len(self.stamps)
+        if n < 2:
+            return 0.0
+        stamps = self.stamps.last(n)
+        samples = self.samples.last(n)
+        elapsed = stamps[-1] - stamps[0]
+        if elapsed <= 0 or samples[-1] < samples[0]: # recorder was cleared
+            return 0.0
+        return float((samples[-1] - samples[0]) / elapsed)
+
+    def summary(self):
+        nbytes = self.bytes.last(len(self.bytes))
+        return {
+            'frames': self.frames,
+            'late_frames': self.lateFrames,
+            'skipped_frames': self.skippedFrames,
+            'frame_ms': self._percentiles(self.frameTimes),
+            'interval_ms': self._percentiles(self.intervals),
+            'latency_ms': self._percentiles(self.latency),
+            'stages_ms': {name: self._percentiles(ring) for name, ring in self.stages.items()},
+            'bytes_per_tick': float(np.mean(nbytes)) if len(nbytes) > 0 else 0.0,
+            'backlog_bytes': int(self.backlog.last(1)[0]),
+            'sample_rate': self.sample_rate(),
+            'expected_rate': self.sf,
+            'link': dict(self.link),
+        }
+
+    def overlay_text(self):
+        s = self.summary()
+        lines = [f'frame p50 {s["frame_ms"]["p50"]:.1f} ms  p99 {s["frame_ms"]["p99"]:.1f} ms  '
+                 f'late {s["late_frames"]}  skipped {s["skipped_frames"]}']
+        lines += [f'{name:10s} p50 {p["p50"]:.2f} ms  p99 {p["p99"]:.2f} ms' for name, p in s['stages_ms'].items()]
+        lines.append(f'{s["bytes_per_tick"]:.0f} B/tick  backlog {s["backlog_bytes"]} B  '
+                     f'{s["sample_rate"]:.0f}/{s["expected_rate"]} Hz')
+        lines.append(f'latency p50 {s["latency_ms"]["p50"]:.1f} ms  p99 {s["latency_ms"]["p99"]:.1f} ms  '
+                     f'rate {s["link"]["rate"]:.1f} Hz  drift {s["link"]["drift_ppm"]:+.0f} ppm  '
+                     f'lost {s["link"]["lost_seconds"]:.2f} s in {s["link"]["gaps"]} gaps')
+        return '\n'.join(lines)
+
+    def export(self, path):
+        """ appends the current summary to a .csv log (one row per call) or writes it as .json """
+        s = self.summary()
+        s['time'] = time.time()
+        if path.endswith('.json'):
+            with open(path, 'w') as f:
+                json.dump(s, f, indent = 2)
+            return
+
+        row = {k: v for k, v in s.items() if not isinstance(v, dict)}
+        for key in ('frame_ms', 'interval_ms', 'latency_ms'):
+            for p, v in s[key].items():
+                row[f'{key}_{p}'] = v
+        for k, v in s['link'].items():
+            row[f'link_{k}'] = v
+        for name, ps in s['stages_ms'].items():
+            for p, v in ps.items():
+                row[f'{name}_ms_{p}'] = v
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        with open(path, 'a', newline = '') as f:
+            writer = csv.DictWriter(f, fieldnames = list(row))
+            if not exists:
+                writer.writeheader()
+            writer.writerow(row)
@@ -0,0 +1,112 @@
+import numpy as np
+
+from helpers.my_data_processing import StreamingFilter, WelchEstimator, Spectrogram, MinMaxDecimator, normalize
+from helpers.my_features import BandPowers, DeviceBandPowers
+from helpers.my_metrics import FrameMetrics
+
+
+class FramePipeline:
+    """
+        The per-frame computation of the live view without any display
+        code: window extraction, filtering, spectrum and band powers. Used
+        by DAGUI.update and by the headless benchmarks. Each stage is timed
+        into self.metrics.
+
+        With deviceBands, the band powers come from the headset's own 0x83
+        reports and the spectrum and spectrogram stages are skipped, so no
+        FFT runs on the host; power stays zero.
+    """
+    def __init__(self, sf = 512, numSecLong = 20, numSecShort = 5, minFrequency = 1, maxFrequency = 45, filterOrder = 4,
+                 metrics = None, numSecSpectrogram = 60, deviceBands = False):
+        self.sf = sf
+        self.metrics = metrics if metrics is not None else FrameMetrics(sf = sf)
+        self.numSecLong = numSecLong
+        self.numSecShort = numSecShort
+
+        # artifacts are bridged and left out of the spectrum using the recorder's mask, not clipped
+        self.filter = StreamingFilter(sf, minFrequency, maxFrequency, order = filterOrder, history_sec = numSecShort, clip = None)
+        self.spectrum = WelchEstimator(sf, nperseg = sf, window_sec = numSecShort, minF = minFrequency, maxF = maxFrequency)
+        self.bandPowers = BandPowers(self.spectrum.freqScale)
+        self.deviceBands = DeviceBandPowers() if deviceBands else None
+        self.noPower = np.zeros(len(self.spectrum.freqScale))
+        # one column per Welch hop over the last numSecSpectrogram seconds
+        self.numSecSpectrogram = numSecSpectrogram
+        self.spectrogram = Spectrogram(len(self.spectrum.freqScale), numSecSpectrogram*sf // self.spectrum.hop)
+
+        # plots get per-pixel min/max envelopes instead of every sample
+        self.longDecimator = MinMaxDecimator(numSecLong*sf, clip = 4000)
+        self.shortDecimator = MinMaxDecimator(numSecShort*sf, clip = 4000)
+        self.filteredDecimator = MinMaxDecimator(numSecShort*sf)
+        # absolute index of the next raw sample to process, and of the first one after the last skip
+        self.count = 0
+        self.contiguousFrom = 0
+
+    def reset(self):
+        """ drops the streaming state after the recorder was cleared """
+        self.filter.reset()
+        self.spectrum.reset()
+        self.spectrogram.reset()
+        self.longDecimator.reset()
+        self.shortDecimator.reset()
+        self.filteredDecimator.reset()
+        self.count = 0
+        self.contiguousFrom = 0
+
+    def set_widths(self, recorder, longWidth, shortWidth):
+        """ adapts the envelopes to the plot widths in pixels """
+        if longWidth != self.longDecimator.width or shortWidth != self.shortDecimator.width:
+            self.longDecimator.set_width(longWidth)
+            self.shortDecimator.set_width(shortWidth)
+            self.filteredDecimator.set_width(shortWidth)
+            window = recorder.get_raw_range(max(self.count - self.longDecimator.n, 0), self.count)
+            self.longDecimator.rebuild(window, self.count)
+            self.shortDecimator.rebuild(window, self.count)
+            self.filteredDecimator.rebuild(self.filter.last(self.filteredDecimator.n), self.count)
+
+    def compute(self, recorder):
+        frame = {}
+        with self.metrics.stage('windows'):
+            chunk, end = recorder.get_raw_since(self.count, limit = self.longDecimator.n)
+            start = end - len(chunk)
+            masked = recorder.get_artifact_range(start, end) != 0
+            if start != self.count:
+                self.contiguousFrom = start
+            self.count = end
+            self.longDecimator.process(chunk, start)
+            self.shortDecimator.process(chunk, start)
+            frame['long'] = self.longDecimator.envelope()
+            frame['short'] = self.shortDecimator.envelope()
+
+        with self.metrics.stage('filter'):
+            newFiltered = self.filter.process(chunk, masked)
+            self.filteredDecimator.process(newFiltered, start)
+            frame['filtered'] = self.filteredDecimator.envelope()
+
+        frame['freqScale'] = self.spectrum.freqScale
+        if self.deviceBands is not None:
+            frame['power'] = self.noPower
+            frame['spectrogramCount'] = self.spectrogram.count
+            frame['spectrogram'] = self.spectrogram.image()
+            frame['spectrogramLevels'] = self.spectrogram.levels
+            with self.metrics.stage('bands'):
+                latest = recorder.latest_bands()
+                values = latest[1] if latest is not None else np.zeros(len(self.deviceBands.deviceNames))
+                frame['bands'] = normalize(self.deviceBands.compute(values)['density'])
+            return frame
+
+        with self.metrics.stage('spectrum'):
+            columns = self.spectrum.process(newFiltered, masked)
+            # blinks flag their samples after the fact, re-read the mask the window still depends on
+            self.spectrum.remask(recorder.get_artifact_range(max(end - self.spectrum.span, self.contiguousFrom), end) != 0)
+            frame['power'] = self.spectrum.power()
+
+        with self.metrics.stage('spectrogram'):
+            self.spectrogram.add(columns)
+            # the image only needs uploading when this count changes
+            frame['spectrogramCount'] = self.spectrogram.count
+            frame['spectrogram'] = self.spectrogram.image()
+            frame['spectrogramLevels'] = self.spectrogram.levels
+
+        with self.metrics.stage('bands'):
+            frame['bands'] = normalize(self.bandPowers.compute(frame['power'])['density'])
+        return frame
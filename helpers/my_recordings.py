@@ -0,0 +1,294 @@
+import os
+import sys
+import json
+import time
+import queue
+import struct
+import datetime
+import threading
+import numpy as np
+
+from helpers.my_artifacts import count_artifacts, count_late_artifacts, artifact_percentages
+
+# File layout:
+#   [0:8]     magic b'CURVEX01'
+#   [8:12]    little-endian uint32, length of the JSON header
+#   [12:...]  UTF-8 JSON header, zero padded up to HEADER_SIZE
+#   [HEADER_SIZE:]  little-endian int16 frames, one column per channel
+# The header region has a fixed size so it can be rewritten in place when a
+# recording is finalized, and the sample data can be memory-mapped directly.
+#
+# A .cvt file next to a recording holds its timestamp track: one record per
+# received chunk with the number of samples recorded after it and the
+# monotonic receive time in seconds since the recording started.
+MAGIC = b'CURVEX01'
+HEADER_SIZE = 4096
+DTYPE = np.dtype('<i2')
+RECORDING_EXT = '.cvx'
+TIMESTAMPS_EXT = '.cvt'
+TIMESTAMP_DTYPE = np.dtype([('index', '<i8'), ('time', '<f8')])
+MAX_GAPS = 100
+
+
+def _format_time(t):
+    if t is None:
+        return None
+    if isinstance(t, datetime.datetime):
+        return t.isoformat()
+    return str(t)
+
+def make_header(id, sf = 512, channels = ('raw',), start_time = None, end_time = None, samples = 0, **meta):
+    header = {
+        'id': id,
+        'sf': sf,
+        'channels': list(channels),
+        'dtype': DTYPE.str,
+        'start_time': _format_time(start_time),
+        'end_time': _format_time(end_time),
+        'samples': int(samples),
+    }
+    header.update(meta)
+    return header
+
+def pack_header(header):
+    text = json.dumps(header).encode('utf-8')
+    if 12 + len(text) > HEADER_SIZE:
+        raise ValueError(f'recording header is {len(text)} bytes, limit is {HEADER_SIZE-12}')
+    block = MAGIC + struct.pack('<I', len(text)) + text
+    return block + b'\0'*(HEADER_SIZE - len(block))
+
+def to_frames(data, nchannels):
+    """ validates samples and returns them as a (n, nchannels) little-endian int16 array """
+    data = np.asarray(data)
+    if data.ndim == 1:
+        data = data.reshape(-1, 1)
+    if data.shape[1] != nchannels:
+        raise ValueError(f'data has {data.shape[1]} channels, header lists {nchannels}')
+    if data.size > 0 and (data.min() < -32768 or data.max() > 32767):
+        raise ValueError('samples do not fit in int16')
+    return np.ascontiguousarray(data, dtype=DTYPE)
+
+def write_recording(path, id, data, sf = 512, channels = ('raw',), start_time = None, end_time = None, **meta):
+    frames = to_frames(data, len(channels))
+    header = make_header(id, sf, channels, start_time, end_time, samples = len(frames), **meta)
+    with open(path, 'wb') as f:
+        f.write(pack_header(header))
+        f.write(frames.tobytes())
+    return path
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        block = f.read(HEADER_SIZE)
+    if block[:8] != MAGIC:
+        raise ValueError(f'{path} is not a curvex recording')
+    length = struct.unpack('<I', block[8:12])[0]
+    return json.loads(block[12:12+length].decode('utf-8'))
+
+def load_recording(path):
+    """
+        Returns (header, channels) where channels maps each channel name to
+        an array. Binary recordings are memory-mapped, so samples are only
+        read from disk when they are accessed. Legacy JSON recordings are
+        parsed in full.
+    """
+    if path.endswith('.json'):
+        with open(path, 'r') as f:
+            d = json.load(f)
+        header = make_header(d['id'], d.get('sf', 512), samples = len(d['data']))
+        return header, {'raw': np.asarray(d['data'], dtype=DTYPE)}
+
+    header = read_header(path)
+    nchannels = len(header['channels'])
+    # a recording that was never finalized still holds all complete frames
+    available = (os.path.getsize(path) - HEADER_SIZE) // (DTYPE.itemsize*nchannels)
+    n = min(header['samples'], available) if header['samples'] > 0 else available
+    if n == 0:
+        return header, {c: np.zeros(0, dtype=DTYPE) for c in header['channels']}
+    frames = np.memmap(path, dtype=DTYPE, mode='r', offset=HEADER_SIZE, shape=(n, nchannels))
+    return header, {c: frames[:, i] for i, c in enumerate(header['channels'])}
+
+def timestamps_path(path):
+    return os.path.splitext(path)[0] + TIMESTAMPS_EXT
+
+def load_timestamps(path):
+    """ the timestamp track of a recording as a structured array, None if it has none """
+    tpath = timestamps_path(path)
+    if not os.path.exists(tpath):
+        return None
+    n = os.path.getsize(tpath) // TIMESTAMP_DTYPE.itemsize
+    return np.fromfile(tpath, dtype=TIMESTAMP_DTYPE, count=n)
+
+def convert_json_recording(json_path, out_path = None):
+    """ converts a recording saved by older versions of DAGUI to the binary format """
+    if out_path is None:
+        out_path = os.path.splitext(json_path)[0] + RECORDING_EXT
+    with open(json_path, 'r') as f:
+        d = json.load(f)
+    return write_recording(out_path, d['id'], d['data'], sf = d.get('sf', 512), converted_from = os.path.basename(json_path))
+
+def convert_folder(folder):
+    """ converts every JSON recording in a folder that has no binary counterpart yet """
+    converted = []
+    for name in sorted(os.listdir(folder)):
+        if not name.endswith('.json'):
+            continue
+        out_path = os.path.join(folder, os.path.splitext(name)[0] + RECORDING_EXT)
+        if not os.path.exists(out_path):
+            converted.append(convert_json_recording(os.path.join(folder, name), out_path))
+    return converted
+
+
+class RecordingWriter:
+    """
+        Streams a recording to disk while it is being made. write() only
+        queues the samples; a background thread appends them to the file and
+        flushes every flush_interval seconds. close() drains the queue and
+        rewrites the header with the final sample count, so memory use stays
+        constant and stopping does not stall. If the process dies, every
+        flushed frame can still be loaded.
+
+        The queue is bounded; if the disk falls behind by max_chunks chunks,
+        write() waits for it rather than growing without limit. write() and
+        close() may be called from different threads: a write that races
+        close() is either queued ahead of the stop sentinel and saved, or
+        sees the writer closed and is dropped, never left in the queue.
+
+        With timestamps, the receive time passed to write() is kept in the
+        .cvt timestamp track next to the recording. Artifact flags passed to
+        write() are counted, as are flags the detector adds to samples that
+        were already written (on_chunk), and close() stores the share of
+        flagged samples per reason in the header as 'artifacts', in percent.
+    """
+    def __init__(self, path, id, sf = 512, channels = ('raw',), start_time = None, flush_interval = 1.0, max_chunks = 1024,
+                 timestamps = True, **meta):
+        self.path = path
+        self.t0 = time.monotonic()
+        self.timesFile = open(timestamps_path(path), 'wb') if timestamps else None
+        if timestamps:
+            meta['timestamps'] = os.path.basename(timestamps_path(path))
+        self.header = make_header(id, sf, channels, start_time, **meta)
+        self.nchannels = len(channels)
+        self.flush_interval = flush_interval
+        self.samples = 0
+        self.queued = 0
+        self.artifactCounts = None
+        # absolute index of the first recorded sample, known from on_chunk
+        self.startIndex = None
+        self.error = None
+        # write() queues and close() queues the sentinel under this lock
+        self.lock = threading.Lock()
+        self.closed = False
+
+        self.file = open(path, 'wb')
+        self.file.write(pack_header(self.header))
+        self.queue = queue.Queue(maxsize = max_chunks)
+        self.thread = threading.Thread(target = self._run, daemon = True)
+        self.thread.start()
+
+    def write(self, data, received = None, artifacts = None):
+        """
+            received is the monotonic time the samples arrived, artifacts
+            their ArtifactDetector flags. Returns False, without writing,
+            once the writer is closed.
+        """
+        frames = to_frames(data, self.nchannels)
+        counts = count_artifacts(artifacts) if artifacts is not None else None
+        with self.lock:
+            if self.closed:
+                return False
+            if counts is not None:
+                self._add_artifacts(counts)
+            # an empty block is the stop sentinel
+            if len(frames) > 0:
+                self.queued += len(frames)
+                stamp = None
+                if received is not None and self.timesFile is not None:
+                    stamp = np.array([(self.queued, received - self.t0)], dtype=TIMESTAMP_DTYPE)
+                self.queue.put((frames, stamp))
+        return True
+
+    def _add_artifacts(self, counts):
+        if self.artifactCounts is None:
+            self.artifactCounts = counts
+        else:
+            self.artifactCounts = {name: n + counts[name] for name, n in self.artifactCounts.items()}
+
+    def mark_gap(self, seconds):
+        """
+            notes in the header that no data arrived for `seconds` before the
+            next sample, as [sample index, seconds]. The header has a fixed
+            size, so only the first MAX_GAPS are listed; the total is kept.
+        """
+        gaps = self.header.setdefault('gaps', [])
+        if len(gaps) < MAX_GAPS:
+            gaps.append([self.queued, round(seconds, 3)])
+        self.header['gap_seconds'] = round(self.header.get('gap_seconds', 0) + seconds, 3)
+
+    def _run(self):
+        lastFlush = time.monotonic()
+        while True:
+            try:
+                frames, stamp = self.queue.get(timeout = self.flush_interval)
+            except queue.Empty:
+                frames, stamp = None, None
+            if frames is not None and len(frames) == 0:
+                break # sentinel from close()
+            try:
+                if frames is not None:
+                    self.file.write(frames.tobytes())
+                    self.samples += len(frames)
+                if stamp is not None:
+                    self.timesFile.write(stamp.tobytes())
+                if time.monotonic() - lastFlush >= self.flush_interval:
+                    self.file.flush()
+                    if self.timesFile is not None:
+                        self.timesFile.flush()
+                    lastFlush = time.monotonic()
+            except OSError as e:
+                # keep draining so writers never block on a dead disk
+                self.error = e
+
+    def close(self, end_time = None, **meta):
+        """ finishes writing and finalizes the header, returns the header; later calls only return it """
+        with self.lock:
+            if self.closed:
+                return self.header
+            self.closed = True
+            self.queue.put((np.zeros((0, self.nchannels), dtype=DTYPE), None))
+        # everything queued before the sentinel is written, nothing can follow it
+        self.thread.join()
+        if self.timesFile is not None:
+            self.timesFile.close()
+        self.header['samples'] = self.samples
+        self.header['end_time'] = _format_time(end_time)
+        if self.artifactCounts is not None:
+            self.header['artifacts'] = artifact_percentages(self.artifactCounts, self.queued)
+        self.header.update(meta)
+        self.file.seek(0)
+        self.file.write(pack_header(self.header))
+        self.file.close()
+        if self.error is not None:
+            raise self.error
+        return self.header
+
+    def on_chunk(self, start, chunk):
+        """ DataRecorder listener, records the raw channel, its receive time and artifact counts """
+        if 'raw' in chunk:
+            if self.startIndex is None:
+                self.startIndex = start
+            self.write(chunk['raw'], chunk.get('received'), chunk.get('artifacts'))
+        if 'artifacts_late' in chunk and self.startIndex is not None:
+            counts = count_late_artifacts(chunk['artifacts_late'], self.startIndex, self.startIndex + self.queued)
+            with self.lock:
+                if not self.closed:
+                    self._add_artifacts(counts)
+
+
+if __name__ == '__main__':
+    # python -m helpers.my_recordings <folder or file.json> ...
+    for target in sys.argv[1:]:
+        if os.path.isdir(target):
+            for path in convert_folder(target):
+                print(path)
+        else:
+            print(convert_json_recording(target))
@@ -0,0 +1,53 @@
+class RenderScheduler:
+    """
+        Decides when the live view redraws. A frame is only computed when
+        the recorder holds new samples (or a redraw was requested), so
+        chunks that arrive between ticks are drawn together.
+
+        While data flows the tick interval follows the measured frame cost
+        so rendering takes at most target_load of the time, capped at
+        max_fps and at max_interval_ms. Without new data the interval
+        doubles on every idle tick up to idle_interval_ms.
+    """
+    def __init__(self, max_fps = 25, target_load = 0.5, max_interval_ms = 200, idle_interval_ms = 500, smoothing = 0.1):
+        self.min_interval_ms = 1000 / max_fps
+        self.target_load = target_load
+        self.max_interval_ms = max_interval_ms
+        self.idle_interval_ms = idle_interval_ms
+        self.smoothing = smoothing
+
+        self.cost_ms = 0.0
+        self.lastCount = None
+        self.dirty = True
+        self.interval_ms = self.min_interval_ms
+        self.idle = False
+
+    def request(self):
+        """ forces a redraw on the next tick, e.g. after the recorder was cleared """
+        self.dirty = True
+
+    def should_render(self, count):
+        """ count is the recorder's absolute sample counter """
+        return self.dirty or count != self.lastCount
+
+    def active_interval(self):
+        return min(max(self.cost_ms / self.target_load, self.min_interval_ms), self.max_interval_ms)
+
+    def rendered(self, count, cost_ms):
+        """
+            records a finished frame and returns the interval until the next
+            tick. count is the sample counter the frame shows; while it is
+            behind the recorder's, the next tick renders again.
+        """
+        self.lastCount = count
+        self.dirty = False
+        self.idle = False
+        self.cost_ms += self.smoothing * (cost_ms - self.cost_ms)
+        self.interval_ms = self.active_interval()
+        return self.interval_ms
+
+    def skipped(self):
+        """ records a tick without new data and returns the backed-off interval """
+        self.idle = True
+        self.interval_ms = min(self.interval_ms*2, self.idle_interval_ms)
+        return self.interval_ms
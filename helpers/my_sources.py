@@ -0,0 +1,103 @@
+import time
+import socket
+import threading
+import numpy as np
+
+from helpers.my_recordings import load_recording
+
+
+# A data source is anything MultiplexedReader can wait on and read from:
+# an object with fileno(), recv(n) and close(), like the RFCOMM socket from
+# start_headset. ReplaySource provides the same interface for saved data.
+
+RAW_PACKET_SIZE = 8
+
+def encode_packet(payload):
+    """ wraps a payload into a ThinkGear packet """
+    payload = bytes(payload)
+    return bytes([0xaa, 0xaa, len(payload)]) + payload + bytes([~sum(payload) & 0xff])
+
+def encode_raw_packets(samples):
+    """ encodes raw samples as 0x80 packets, RAW_PACKET_SIZE bytes each """
+    samples = np.asarray(samples).astype('>i2')
+    hilo = samples.view(np.uint8).reshape(-1, 2)
+    packets = np.empty((len(samples), RAW_PACKET_SIZE), dtype=np.uint8)
+    packets[:, 0:2] = 0xaa
+    packets[:, 2] = 4
+    packets[:, 3] = 0x80
+    packets[:, 4] = 2
+    packets[:, 5:7] = hilo
+    packets[:, 7] = ~(0x82 + hilo[:, 0].astype(np.int64) + hilo[:, 1]) & 0xff
+    return packets.tobytes()
+
+
+class ReplaySource:
+    """
+        Plays a byte stream back through a local socket pair, paced to
+        bytes_per_sec*speed. speed = None sends as fast as the reader
+        consumes. The stream ends like a closed headset connection, with an
+        empty recv(), unless loop is set.
+    """
+    def __init__(self, data, bytes_per_sec = 512*RAW_PACKET_SIZE, speed = 1.0, chunk_ms = 10, loop = False):
+        self.data = bytes(data)
+        self.bytes_per_sec = bytes_per_sec
+        self.speed = speed
+        self.loop = loop
+        if speed:
+            self.chunk_size = max(1, int(bytes_per_sec*speed*chunk_ms/1000))
+        else:
+            self.chunk_size = 65536
+
+        self.reader, self.writer = socket.socketpair()
+        self._stop_event = threading.Event()
+        self.thread = threading.Thread(target = self._run, daemon = True)
+        self.thread.start()
+
+    @classmethod
+    def from_recording(cls, path, speed = 1.0, **kwargs):
+        """ re-encodes the raw channel of a saved recording into ThinkGear packets """
+        header, channels = load_recording(path)
+        return cls(encode_raw_packets(channels['raw']), header['sf']*RAW_PACKET_SIZE, speed, **kwargs)
+
+    @classmethod
+    def from_capture(cls, path, speed = 1.0, sf = 512, **kwargs):
+        """ replays bytes captured from a headset as they were received """
+        with open(path, 'rb') as f:
+            return cls(f.read(), sf*RAW_PACKET_SIZE, speed, **kwargs)
+
+    def _run(self):
+        start = time.monotonic()
+        sent = 0
+        try:
+            while not self._stop_event.is_set() and len(self.data) > 0:
+                pos = sent % len(self.data) if self.loop else sent
+                if pos >= len(self.data):
+                    break
+                chunk = self.data[pos:pos+self.chunk_size]
+                if self.speed:
+                    wait = start + sent/(self.bytes_per_sec*self.speed) - time.monotonic()
+                    if wait > 0:
+                        time.sleep(wait)
+                self.writer.sendall(chunk)
+                sent += len(chunk)
+        except OSError:
+            pass # reader was closed
+        self.writer.close()
+
+    def fileno(self):
+        return self.reader.fileno()
+
+    def recv(self, n):
+        return self.reader.recv(n)
+
+    def close(self):
+        self._stop_event.set()
+        self.reader.close()
+        self.thread.join()
+
+
+def open_replay(path, speed = 1.0, **kwargs):
+    """ recordings (.cvx, .json) are re-encoded, anything else is replayed as captured bytes """
+    if path.endswith('.json') or path.endswith('.cvx'):
+        return ReplaySource.from_recording(path, speed, **kwargs)
+    return ReplaySource.from_capture(path, speed, **kwargs)
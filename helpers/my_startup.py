@@ -0,0 +1,74 @@
+import sys
+import time
+import builtins
+
+
+class StartupProfile:
+    """
+        Launch-time profile for --profile-startup. While enabled, every
+        first import of a module is timed (inclusive and self time, nested
+        imports excluded from the latter) and mark(name) records how long
+        after the start each initialization step finished. Disabled
+        profiles cost nothing. Only stdlib imports here, so it can be set up
+        before anything heavy is loaded.
+    """
+    def __init__(self, enabled = False):
+        self.enabled = enabled
+        self.start = time.perf_counter()
+        self.imports = {}
+        self.marks = []
+        self._stack = []
+        self._import = None
+        self.reported = False
+        if enabled:
+            self.install()
+
+    def install(self):
+        self._import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def uninstall(self):
+        if self._import is not None:
+            builtins.__import__ = self._import
+            self._import = None
+
+    def _timed_import(self, name, globals = None, locals = None, fromlist = (), level = 0):
+        if level != 0 or name in sys.modules:
+            return self._import(name, globals, locals, fromlist, level)
+
+        self._stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            self.imports[name] = (elapsed, elapsed - nested)
+
+    def mark(self, name):
+        """ records that an initialization step finished now """
+        if self.enabled:
+            self.marks.append((name, time.perf_counter() - self.start))
+
+    def report(self, top = 20, file = None):
+        """ prints the slowest imports and the marks, once """
+        if self.reported:
+            return
+        self.reported = True
+        if not self.enabled:
+            return
+        self.uninstall()
+        file = file or sys.stderr
+
+        print('startup profile (ms)', file = file)
+        print(f'{"module":40s} {"total":>9s} {"self":>9s}', file = file)
+        slowest = sorted(self.imports.items(), key = lambda item: item[1][0], reverse = True)
+        for name, (total, own) in slowest[:top]:
+            print(f'{name:40s} {total*1000:9.1f} {own*1000:9.1f}', file = file)
+        print(f'{"step":40s} {"at":>9s} {"took":>9s}', file = file)
+        previous = 0.0
+        for name, t in self.marks:
+            print(f'{name:40s} {t*1000:9.1f} {(t - previous)*1000:9.1f}', file = file)
+            previous = t
@@ -0,0 +1,353 @@
+import sys
+import time
+import socket
+import struct
+import argparse
+import selectors
+import threading
+import numpy as np
+
+from helpers.my_features import DEVICE_BANDS
+
+
+# Frame layout, little-endian:
+#   [0:4]    magic b'CVXS'
+#   [4]      uint8 version
+#   [5]      uint8 channel id, see CHANNELS
+#   [6:8]    uint16 source, the device number on this server
+#   [8:12]   uint32 number of values, rows for channels with several columns
+#   [12:20]  int64 channel sample counter of the first value
+#   [20:28]  float64 monotonic receive time of the chunk, in seconds
+#   [28:]    values, dtype given by the channel, row by row
+STREAM_MAGIC = b'CVXS'
+# 2 added the 'bands' channel, one row of DEVICE_BANDS powers per 0x83 report
+STREAM_VERSION = 2
+FRAME_HEADER = struct.Struct('<4sBBHIqd')
+CHANNELS = {
+    'raw': (0, np.dtype('<i2')),
+    'attention': (1, np.dtype('u1')),
+    'meditation': (2, np.dtype('u1')),
+    'blink': (3, np.dtype('u1')),
+    'poor_signal': (4, np.dtype('u1')),
+    'bands': (5, np.dtype('<u4')),
+}
+CHANNEL_IDS = {cid: (name, dtype) for name, (cid, dtype) in CHANNELS.items()}
+# values per row, 1 unless listed
+CHANNEL_COLUMNS = {'bands': len(DEVICE_BANDS)}
+# keeps every frame well inside one UDP datagram
+MAX_FRAME_VALUES = 8192
+DEFAULT_PORT = 5600
+
+
+def encode_frame(channel, counter, timestamp, values, source = 0):
+    """ values is 1-D, or one row per value for channels in CHANNEL_COLUMNS """
+    cid, dtype = CHANNELS[channel]
+    values = np.ascontiguousarray(values, dtype=dtype)
+    header = FRAME_HEADER.pack(STREAM_MAGIC, STREAM_VERSION, cid, source, len(values), counter, timestamp)
+    return header + values.tobytes()
+
+def decode_frames(buffer):
+    """
+        Parses the complete frames at the start of buffer. Returns a list of
+        (source, channel, counter, timestamp, values) and the number of
+        bytes consumed. values of channels in CHANNEL_COLUMNS have one row
+        per value.
+    """
+    frames = []
+    offset = 0
+    view = memoryview(buffer)
+    while len(buffer) - offset >= FRAME_HEADER.size:
+        magic, version, cid, source, n, counter, timestamp = FRAME_HEADER.unpack_from(buffer, offset)
+        if magic != STREAM_MAGIC or version != STREAM_VERSION or cid not in CHANNEL_IDS:
+            raise ValueError('not a curvex stream')
+        name, dtype = CHANNEL_IDS[cid]
+        columns = CHANNEL_COLUMNS.get(name, 1)
+        end = offset + FRAME_HEADER.size + n*columns*dtype.itemsize
+        if end > len(buffer):
+            break
+        values = np.frombuffer(view[offset + FRAME_HEADER.size:end], dtype=dtype).copy()
+        if name in CHANNEL_COLUMNS:
+            values = values.reshape(n, columns)
+        frames.append((source, name, counter, timestamp, values))
+        offset = end
+    return frames, offset
+
+
+class _Subscriber:
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.buffer = bytearray()
+        self.skipped = 0
+        self.lastSeen = time.monotonic()
+
+
+class StreamServer(threading.Thread):
+    """
+        Publishes finished recorder chunks to any number of local
+        subscribers. on_chunk() is a DataRecorder listener; it encodes the
+        chunk once and only appends it to each subscriber's buffer, the
+        sockets are written by this thread, so acquisition never waits on
+        a consumer. Every channel of CHANNELS is published, the device band
+        powers as one row of DEVICE_BANDS values per report.
+
+        Over TCP, a subscriber whose unsent data would exceed max_buffer
+        bytes is disconnected (policy 'drop') or misses frames until it
+        catches up (policy 'skip'); the sample counter shows the hole. Over
+        UDP, clients subscribe by sending b'SUB' and must repeat it within
+        udp_timeout seconds; datagrams that cannot be sent are dropped.
+    """
+    def __init__(self, host = '127.0.0.1', port = DEFAULT_PORT, transport = 'tcp', max_buffer = 1 << 20, policy = 'drop',
+                 udp_timeout = 30):
+        super().__init__(daemon = True)
+        self.transport = transport
+        self.max_buffer = max_buffer
+        self.policy = policy
+        self.udp_timeout = udp_timeout
+
+        kind = socket.SOCK_STREAM if transport == 'tcp' else socket.SOCK_DGRAM
+        self.sock = socket.socket(socket.AF_INET, kind)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        if transport == 'tcp':
+            self.sock.listen()
+        self.sock.setblocking(False)
+        self.address = self.sock.getsockname()
+
+        self.subscribers = {}
+        self.counters = {}
+        self.dropped = 0
+        self.frames = 0
+        self.bytes = 0
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ, None)
+        self._lock = threading.Lock()
+        self._wakeup, self._wakeupSend = socket.socketpair()
+        self._wakeup.setblocking(False)
+        self._wakeupSend.setblocking(False)
+        self.selector.register(self._wakeup, selectors.EVENT_READ, 'wakeup')
+        self._stop_event = threading.Event()
+
+    def listener(self, source = 0):
+        """ a DataRecorder listener that publishes under the given source number """
+        return lambda start, chunk: self.on_chunk(start, chunk, source)
+
+    def on_chunk(self, start, chunk, source = 0):
+        received = chunk.get('received', time.monotonic())
+        data = []
+        for name in CHANNELS:
+            values = chunk.get(name)
+            if values is None or len(values) == 0:
+                continue
+            # raw follows the recorder's counter, the slow channels are counted here
+            counter = start if name == 'raw' else self.counters.get((source, name), 0)
+            self.counters[(source, name)] = counter + len(values)
+            rows = MAX_FRAME_VALUES // CHANNEL_COLUMNS.get(name, 1)
+            for k in range(0, len(values), rows):
+                data.append(encode_frame(name, counter + k, received, values[k:k+rows], source))
+        if len(data) > 0:
+            self.publish(b''.join(data) if self.transport == 'tcp' else data)
+
+    def publish(self, data):
+        """ data is encoded frames, one bytes object over TCP and a list of datagrams over UDP """
+        if self.transport == 'udp':
+            self._send_datagrams(data)
+            return
+
+        with self._lock:
+            self.frames += 1
+            for sub in self.subscribers.values():
+                if len(sub.buffer) + len(data) > self.max_buffer:
+                    sub.skipped += 1
+                    self.dropped += 1
+                    continue
+                sub.buffer += data
+        try:
+            self._wakeupSend.send(b'\0')
+        except BlockingIOError:
+            pass # a wake-up is already pending
+
+    def _send_datagrams(self, datagrams):
+        with self._lock:
+            addrs = list(self.subscribers)
+        self.frames += 1
+        for addr in addrs:
+            for datagram in datagrams:
+                try:
+                    self.sock.sendto(datagram, addr)
+                    self.bytes += len(datagram)
+                except (BlockingIOError, OSError):
+                    self.dropped += 1
+
+    def stop(self):
+        self._stop_event.set()
+        try:
+            self._wakeupSend.send(b'\0')
+        except BlockingIOError:
+            pass
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+    def _accept(self):
+        try:
+            sock, addr = self.sock.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        with self._lock:
+            self.subscribers[sock] = _Subscriber(sock, addr)
+        self.selector.register(sock, selectors.EVENT_READ, 'subscriber')
+
+    def _receive_datagram(self):
+        try:
+            message, addr = self.sock.recvfrom(64)
+        except (BlockingIOError, OSError):
+            return
+        with self._lock:
+            if message.startswith(b'SUB'):
+                self.subscribers[addr] = self.subscribers.get(addr) or _Subscriber(None, addr)
+                self.subscribers[addr].lastSeen = time.monotonic()
+            elif message.startswith(b'UNSUB'):
+                self.subscribers.pop(addr, None)
+
+    def _close(self, sock):
+        with self._lock:
+            self.subscribers.pop(sock, None)
+        try:
+            self.selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+        sock.close()
+
+    def _flush(self):
+        """ writes what each TCP subscriber can take without blocking """
+        with self._lock:
+            subs = [sub for sub in self.subscribers.values() if len(sub.buffer) > 0 or sub.skipped > 0]
+        for sub in subs:
+            if self.policy == 'drop' and sub.skipped > 0:
+                self._close(sub.sock)
+                continue
+            with self._lock:
+                data = bytes(sub.buffer[:1 << 16])
+            try:
+                sent = sub.sock.send(data)
+            except BlockingIOError:
+                sent = 0
+            except OSError:
+                self._close(sub.sock)
+                continue
+            with self._lock:
+                if sent == len(data):
+                    # under 'skip' the client took what was offered, no need to come back until new frames arrive
+                    sub.skipped = 0
+                del sub.buffer[:sent]
+                self.bytes += sent
+                pending = len(sub.buffer) > 0
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if pending else 0)
+            self.selector.modify(sub.sock, events, 'subscriber')
+
+    def run(self):
+        while not self._stop_event.is_set():
+            for key, mask in self.selector.select(0.5):
+                if key.data is None:
+                    if self.transport == 'tcp':
+                        self._accept()
+                    else:
+                        self._receive_datagram()
+                elif key.data == 'wakeup':
+                    try:
+                        self._wakeup.recv(4096)
+                    except BlockingIOError:
+                        pass
+                elif mask & selectors.EVENT_READ:
+                    # subscribers only ever send to hang up
+                    try:
+                        if len(key.fileobj.recv(4096)) == 0:
+                            self._close(key.fileobj)
+                    except BlockingIOError:
+                        pass
+                    except OSError:
+                        self._close(key.fileobj)
+
+            if self.transport == 'tcp':
+                self._flush()
+            else:
+                now = time.monotonic()
+                with self._lock:
+                    for addr in [a for a, sub in self.subscribers.items() if now - sub.lastSeen > self.udp_timeout]:
+                        del self.subscribers[addr]
+
+        for sock in [s for s in self.subscribers if self.transport == 'tcp']:
+            self._close(sock)
+        self.selector.close()
+        self.sock.close()
+
+
+class StreamClient:
+    """
+        Reference subscriber. frames() yields (source, channel, counter,
+        timestamp, values) tuples as they arrive.
+    """
+    def __init__(self, host = '127.0.0.1', port = DEFAULT_PORT, transport = 'tcp', timeout = 5, resubscribe = 5):
+        self.addr = (host, port)
+        self.transport = transport
+        self.resubscribe = resubscribe
+        if transport == 'tcp':
+            self.sock = socket.create_connection(self.addr, timeout = timeout)
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.settimeout(timeout)
+            self.sock.sendto(b'SUB', self.addr)
+        self.lastSubscribe = time.monotonic()
+
+    def frames(self):
+        buffer = bytearray()
+        while True:
+            if self.transport == 'tcp':
+                data = self.sock.recv(1 << 16)
+                if len(data) == 0:
+                    return
+                buffer += data
+                frames, consumed = decode_frames(buffer)
+                del buffer[:consumed]
+            else:
+                if time.monotonic() - self.lastSubscribe > self.resubscribe:
+                    self.sock.sendto(b'SUB', self.addr)
+                    self.lastSubscribe = time.monotonic()
+                frames, consumed = decode_frames(self.sock.recv(1 << 16))
+            yield from frames
+
+    def close(self):
+        if self.transport == 'udp':
+            self.sock.sendto(b'UNSUB', self.addr)
+        self.sock.close()
+
+
+if __name__ == '__main__':
+    # python -m helpers.my_streaming --port 5600, prints what a running DAGUI or headless.py publishes
+    argParser = argparse.ArgumentParser(description = 'Reference client for the curvex sample stream.')
+    argParser.add_argument('--host', default = '127.0.0.1')
+    argParser.add_argument('--port', type = int, default = DEFAULT_PORT)
+    argParser.add_argument('--udp', action = 'store_true')
+    args = argParser.parse_args()
+
+    client = StreamClient(args.host, args.port, 'udp' if args.udp else 'tcp', timeout = None)
+    expected = {}
+    received = {}
+    lastReport = time.monotonic()
+    try:
+        for source, channel, counter, timestamp, values in client.frames():
+            key = (source, channel)
+            if key in expected and counter != expected[key]:
+                print(f'source {source} {channel}: {counter - expected[key]} samples missing', file = sys.stderr)
+            expected[key] = counter + len(values)
+            received[key] = received.get(key, 0) + len(values)
+            if time.monotonic() - lastReport >= 1:
+                print('  '.join(f'{s}/{c}: {n}' for (s, c), n in sorted(received.items())))
+                received = {}
+                lastReport = time.monotonic()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
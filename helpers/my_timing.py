@@ -0,0 +1,105 @@
+import numpy as np
+
+from helpers.my_buffers import RingBuffer
+
+
+def detect_gaps(index, times, sf = 512, min_gap = 0.25, settle = 1.0):
+    """
+        Finds samples that were lost in transit from a timestamp track:
+        index[k] samples had arrived by receive time times[k]. Delivery
+        jitter only delays samples, lost ones shift every later arrival, so
+        a gap is a step in the lower envelope of times - index/sf. Steps in
+        the last `settle` seconds are not confirmed yet. Returns arrays of
+        the sample index where each gap starts and its length in seconds.
+    """
+    index = np.asarray(index, dtype=np.float64)
+    times = np.asarray(times, dtype=np.float64)
+    if len(index) < 2:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    lag = times - index/sf
+    floor = np.minimum.accumulate(lag[::-1])[::-1]
+    steps = np.diff(floor)
+    found = np.flatnonzero((steps > min_gap) & (times[1:] < times[-1] - settle))
+    return index[found].astype(np.int64), steps[found]
+
+def estimate_rate(index, times, sf = 512, min_gap = 0.25):
+    """
+        Received samples per second. A least squares slope of samples over
+        time, fitted with one offset per stretch between detected gaps so
+        lost samples do not bias it.
+    """
+    index = np.asarray(index, dtype=np.float64)
+    times = np.asarray(times, dtype=np.float64)
+    if len(index) < 2 or times[-1] <= times[0]:
+        return 0.0
+    starts, seconds = detect_gaps(index, times, sf, min_gap, settle = 0)
+    segment = np.searchsorted(starts, index, side='left')
+    counts = np.bincount(segment)
+    dt = times - (np.bincount(segment, times) / counts)[segment]
+    di = index - (np.bincount(segment, index) / counts)[segment]
+    denominator = np.dot(dt, dt)
+    return float(np.dot(dt, di) / denominator) if denominator > 0 else 0.0
+
+
+class TimestampTrack:
+    """
+        Monotonic receive time of every chunk with the sample counter after
+        it, kept in two rings of `capacity` entries. Enough to estimate the
+        headset's real sampling rate and clock drift, find lost samples and
+        tell when any recent sample was received.
+
+        Chunks closer than `spacing` samples to the entry before are merged
+        into one, keeping the later time, so capacity*spacing samples are
+        covered however often the parser is fed.
+    """
+    def __init__(self, capacity = 3600*64, sf = 512, min_gap = 0.25, spacing = 8):
+        self.sf = sf
+        self.min_gap = min_gap
+        self.spacing = spacing
+        self.index = RingBuffer(capacity, dtype = np.int64)
+        self.times = RingBuffer(capacity, dtype = np.float64)
+
+    def __len__(self):
+        return len(self.index)
+
+    def clear(self):
+        self.index.clear()
+        self.times.clear()
+
+    def append(self, count, t):
+        """ count samples had been received at monotonic time t """
+        n = len(self.index)
+        if n >= 2 and self.index.last(2)[1] - self.index.last(2)[0] < self.spacing:
+            self.index.replace_last(count)
+            self.times.replace_last(t)
+            return
+        self.index.append(count)
+        self.times.append(t)
+
+    def last(self, seconds = None):
+        """ (index, times) views, of the last `seconds` only if given """
+        n = len(self.index)
+        index, times = self.index.last(n), self.times.last(n)
+        if seconds is not None and n > 0:
+            k = np.searchsorted(times, times[-1] - seconds)
+            index, times = index[k:], times[k:]
+        return index, times
+
+    def time_of(self, sample):
+        """ receive time of the chunk that held an absolute sample index, None if not tracked """
+        index, times = self.last()
+        k = np.searchsorted(index, sample, side = 'right')
+        if k >= len(index):
+            return None
+        return float(times[k])
+
+    def rate(self, seconds = 60):
+        return estimate_rate(*self.last(seconds), self.sf, self.min_gap)
+
+    def drift_ppm(self, seconds = 60):
+        """ how much faster than sf the headset clock runs, in parts per million """
+        rate = self.rate(seconds)
+        return (rate / self.sf - 1) * 1e6 if rate > 0 else 0.0
+
+    def gaps(self, seconds = None):
+        return detect_gaps(*self.last(seconds), self.sf, self.min_gap)
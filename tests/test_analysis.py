@@ -0,0 +1,35 @@
+import os
+import sys
+import subprocess
+import numpy as np
+
+from helpers.my_analysis import analyze_recording, feature_names
+from helpers.my_recordings import write_recording
+
+SF = 512
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def noise_recording(folder, name, seconds = 20, seed = 0):
+    data = np.random.default_rng(seed).normal(0, 100, seconds*SF).astype(int)
+    return write_recording(os.path.join(folder, name + '.cvx'), name, data, sf = SF)
+
+
+def test_float_window_matches_int_window(tmp_path):
+    path = noise_recording(tmp_path, 'a')
+    a = analyze_recording(path, window_sec = 5.0, step_sec = 1.0)
+    b = analyze_recording(path, window_sec = 5, step_sec = 1)
+    np.testing.assert_array_equal(a['start_index'], b['start_index'])
+    for name in feature_names():
+        np.testing.assert_array_equal(a[name], b[name], err_msg = name)
+
+def test_cli_with_float_window_and_all_cores(tmp_path):
+    for k in range(2):
+        noise_recording(tmp_path, f'rec{k}', seed = k)
+    output = tmp_path / 'features.npz'
+    subprocess.run([sys.executable, '-m', 'helpers.my_analysis', str(tmp_path), '-o', str(output),
+                    '--window', '5', '--step', '2.5', '--workers', '0'], cwd = ROOT, check = True, capture_output = True)
+    table = np.load(output)
+    # 20 s files hold 7 windows of 5 s stepped by 2.5 s
+    assert len(table['start_index']) == 2*7
+    assert np.isfinite(table['alpha_density']).all()
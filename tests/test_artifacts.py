@@ -0,0 +1,60 @@
+import numpy as np
+
+from helpers.my_artifacts import BLINK
+from helpers.my_bluetooth import DataRecorder, DataParser
+from helpers.my_pipeline import FramePipeline
+from helpers.my_sources import encode_packet, encode_raw_packets
+
+SF = 512
+
+
+def blink_stream(seconds = 20, seed = 0, blinks = None):
+    """
+        raw packets with a strong blink packet at a random sample of every
+        second listed in blinks (all by default), and the sample counts
+        the blinks follow
+    """
+    rng = np.random.default_rng(seed)
+    parts = []
+    at = []
+    for s in range(seconds):
+        raw = encode_raw_packets(rng.integers(-200, 200, SF))
+        k = int(rng.integers(SF // 2, SF))
+        if blinks is None or s in blinks:
+            parts += [raw[:k*8], encode_packet([0x16, 200]), raw[k*8:]]
+            at.append(s*SF + k)
+        else:
+            parts.append(raw)
+    return b''.join(parts), at
+
+
+def test_blinks_flag_the_samples_before_them_whatever_the_read_size():
+    stream, at = blink_stream()
+    expected = np.zeros(len(at)*SF, dtype=bool)
+    for end in at:
+        expected[end - SF // 2:end] = True
+    for size in (len(stream), 160, 7):
+        recorder = DataRecorder(history_sec = 60, sf = SF)
+        parser = DataParser(recorder)
+        for pos in range(0, len(stream), size):
+            parser.feed(stream[pos:pos+size])
+        flags = recorder.artifacts.get_range(0, recorder.raw_count())
+        np.testing.assert_array_equal((flags & BLINK) != 0, expected, err_msg = f'reads of {size} bytes')
+
+def test_live_spectrum_excludes_segments_flagged_after_the_fact():
+    stream, at = blink_stream(seconds = 12, blinks = (8, 10))
+    recorder = DataRecorder(history_sec = 60, sf = SF)
+    parser = DataParser(recorder)
+    pipeline = FramePipeline(sf = SF)
+    # about 20 samples per read, the blink arrives long after the samples it flags
+    for pos in range(0, len(stream), 160):
+        parser.feed(stream[pos:pos+160])
+        pipeline.compute(recorder)
+
+    spectrum = pipeline.spectrum
+    masked = recorder.get_artifact_range(0, recorder.raw_count()) != 0
+    starts, powers, valid = spectrum.segment_powers(np.zeros(len(masked)), masked)
+    # the ring holds the last nsegments segments, oldest at pos
+    live = np.roll(spectrum.valid, -spectrum.pos)
+    np.testing.assert_array_equal(live, valid[-spectrum.nsegments:])
+    assert 0 < np.count_nonzero(~live) < spectrum.nsegments
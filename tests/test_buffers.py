@@ -0,0 +1,37 @@
+import numpy as np
+
+from helpers.my_buffers import RingBuffer
+
+
+def test_wrap_around_keeps_the_last_capacity_samples_contiguous():
+    rng = np.random.default_rng(0)
+    ring = RingBuffer(100, dtype = np.int64)
+    written = np.zeros(0, dtype=np.int64)
+    # chunks smaller, equal to and larger than the capacity, across many wraps
+    for size in list(rng.integers(0, 40, 200)) + [100, 250, 1, 99]:
+        chunk = np.arange(len(written), len(written) + size)
+        ring.extend(chunk)
+        written = np.concatenate([written, chunk])
+
+        assert ring.count == len(written)
+        assert len(ring) == min(len(written), 100)
+        assert ring.first_index() == max(0, len(written) - 100)
+        for n in (1, 37, 100):
+            view = ring.last(n)
+            # zero padded while fewer than n samples were written
+            expected = np.concatenate([np.zeros(max(0, n - len(written)), dtype=np.int64), written[-n:]])
+            np.testing.assert_array_equal(view, expected)
+            assert view.base is ring.data or view.base is ring.data.base
+        start = ring.first_index() + (len(ring) // 3)
+        np.testing.assert_array_equal(ring.get_range(start, ring.count), written[start:])
+
+def test_get_range_refuses_samples_no_longer_held():
+    ring = RingBuffer(10)
+    ring.extend(np.arange(25))
+    np.testing.assert_array_equal(ring.get_range(15, 25), np.arange(15, 25))
+    for start, end in ((14, 20), (20, 26), (22, 21)):
+        try:
+            ring.get_range(start, end)
+        except IndexError:
+            continue
+        raise AssertionError(f'range {start}:{end} should not be held')
@@ -0,0 +1,48 @@
+import numpy as np
+import scipy.signal as ss
+
+from helpers.my_data_processing import WelchEstimator
+
+SF = 512
+
+
+def scipy_power(estimator, sig):
+    freqs, power = ss.welch(sig, SF, window = 'hann', nperseg = estimator.nperseg,
+                            noverlap = estimator.nperseg - estimator.hop, detrend = 'constant', scaling = 'density')
+    return freqs[estimator.argMinF:estimator.argMaxF], power[estimator.argMinF:estimator.argMaxF]
+
+
+def test_welch_matches_scipy_over_the_window():
+    rng = np.random.default_rng(0)
+    t = np.arange(30*SF) / SF
+    sig = 40*np.sin(2*np.pi*10*t) + 15*np.sin(2*np.pi*22.5*t) + rng.normal(0, 20, len(t))
+    estimator = WelchEstimator(SF, nperseg = SF, window_sec = 5)
+    window = (estimator.nsegments - 1)*estimator.hop + estimator.nperseg
+
+    pos = 0
+    # uneven chunks, as frames deliver them
+    for size in rng.integers(1, 700, 400):
+        estimator.process(sig[pos:pos+size])
+        pos += size
+        if pos >= len(sig):
+            break
+        done = (pos - estimator.nperseg) // estimator.hop + 1
+        if done >= estimator.nsegments:
+            # the estimator averages the last nsegments completed segments
+            end = (done - 1)*estimator.hop + estimator.nperseg
+            freqs, expected = scipy_power(estimator, sig[end - window:end])
+            np.testing.assert_array_equal(estimator.freqScale, freqs)
+            np.testing.assert_allclose(estimator.power(), expected, rtol = 1e-9)
+
+def test_segment_powers_match_process():
+    rng = np.random.default_rng(1)
+    sig = rng.normal(0, 50, 12*SF)
+    masked = np.zeros(len(sig), dtype=bool)
+    masked[3000:3300] = True
+
+    live = WelchEstimator(SF, nperseg = SF, window_sec = 5)
+    columns = np.concatenate([live.process(sig[i:i+100], masked[i:i+100]) for i in range(0, len(sig), 100)])
+    starts, powers, valid = WelchEstimator(SF, nperseg = SF, window_sec = 5).segment_powers(sig, masked)
+    np.testing.assert_allclose(columns, powers, rtol = 1e-9)
+    np.testing.assert_array_equal(np.roll(live.valid, -live.pos), valid[-live.nsegments:])
+    assert not valid.all()
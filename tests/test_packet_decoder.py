@@ -0,0 +1,104 @@
+import numpy as np
+
+from helpers.my_bluetooth import DataRecorder, DataParser, PacketDecoder
+from helpers.my_sources import encode_packet, encode_raw_packets
+
+SF = 512
+CHANNELS = ("attention", "meditation", "blink", "poor_signal", "bands")
+
+
+def mixed_stream(seconds = 20, seed = 0):
+    """
+        Raw packets with everything a headset interleaves: the once per
+        second multi-row eSense packet (poor signal, 0x83 bands, attention,
+        meditation), blink packets, packets mixing a raw row with other rows
+        and junk bytes between packets. The byte-at-a-time reference does
+        not verify checksums nor know 0x55 extended codes, so the stream
+        has neither corrupted packets nor those.
+    """
+    rng = np.random.default_rng(seed)
+    parts = []
+    for s in range(seconds):
+        raw = encode_raw_packets(rng.integers(-2048, 2048, SF))
+        parts.append(raw[:200*8])
+        payload = [0x02, int(rng.integers(0, 200)), 0x83, 24]
+        for b in rng.integers(0, 1 << 24, 8):
+            payload += [int(b) >> 16 & 0xff, int(b) >> 8 & 0xff, int(b) & 0xff]
+        payload += [0x04, int(rng.integers(0, 256)), 0x05, int(rng.integers(0, 256))]
+        parts.append(encode_packet(payload))
+        parts.append(raw[200*8:300*8])
+        parts.append(encode_packet([0x16, int(rng.integers(0, 256))]))
+        value = int(rng.integers(0, 1 << 16))
+        parts.append(encode_packet([0x02, int(rng.integers(0, 200)), 0x80, 2, value >> 8, value & 0xff, 0x16, 60]))
+        parts.append(bytes(rng.integers(0, 0xaa, int(rng.integers(1, 6)))))
+        parts.append(raw[300*8:])
+    return b''.join(parts)
+
+def record(stream, sizes = None, reference = False):
+    """ feeds stream into a fresh recorder, in slices of the given sizes (whole if None), returns its channels """
+    recorder = DataRecorder(history_sec = 600, sf = SF)
+    parser = DataParser(recorder, reference = reference)
+    pos = 0
+    for size in sizes if sizes is not None else [len(stream)]:
+        parser.feed(stream[pos:pos+size])
+        pos += size
+    assert pos >= len(stream)
+    channels = {"raw": recorder.get_raw_range(0, recorder.raw_count())}
+    for key in CHANNELS:
+        channels[key] = recorder.get_series(key)
+    return channels
+
+def random_sizes(total, rng, high):
+    sizes = rng.integers(1, high, total // (high // 2) + 10)
+    while sizes.sum() < total:
+        sizes = np.append(sizes, rng.integers(1, high, 100))
+    return [int(size) for size in sizes]
+
+def assert_same(a, b):
+    np.testing.assert_array_equal(a["raw"], b["raw"])
+    for key in CHANNELS:
+        np.testing.assert_array_equal(a[key][0], b[key][0], err_msg = f"{key} index")
+        np.testing.assert_array_equal(a[key][1], b[key][1], err_msg = f"{key} values")
+
+
+def test_reference_decodes_every_row():
+    stream = mixed_stream(seconds = 4)
+    reference = record(stream, reference = True)
+    assert len(reference["raw"]) == 4*(SF + 1)
+    assert len(reference["bands"][1]) == 4
+    assert len(reference["blink"][1]) == 4*2
+    assert len(reference["poor_signal"][1]) == 4*2
+
+def test_bulk_matches_reference_whole():
+    stream = mixed_stream()
+    assert_same(record(stream), record(stream, reference = True))
+
+def test_bulk_matches_reference_in_slices():
+    stream = mixed_stream()
+    reference = record(stream, reference = True)
+    rng = np.random.default_rng(1)
+    # short reads take the packet by packet path, long ones the vectorized one
+    for high in (12, 200, 2000, 20000):
+        assert_same(record(stream, random_sizes(len(stream), rng, high)), reference)
+
+def test_short_and_vectorized_paths_agree_on_corrupted_streams():
+    rng = np.random.default_rng(2)
+    stream = bytearray(mixed_stream(seconds = 4))
+    # flipped bytes break checksums and fake sync patterns
+    for pos in rng.integers(0, len(stream), 200):
+        stream[pos] = 0xaa if rng.random() < 0.5 else int(rng.integers(0, 256))
+    stream = bytes(stream)
+
+    vectorized = PacketDecoder()
+    short = PacketDecoder()
+    vectorized.SHORT_BUFFER = 0
+    short.SHORT_BUFFER = len(stream) + 1
+    pos = 0
+    for size in random_sizes(len(stream), rng, 3000):
+        data = stream[pos:pos+size]
+        pos += size
+        a, b = vectorized.decode(data), short.decode(data)
+        assert a.keys() == b.keys()
+        for key in a:
+            np.testing.assert_array_equal(a[key], b[key], err_msg = key)
+        assert vectorized.carry == short.carry
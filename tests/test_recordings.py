@@ -0,0 +1,34 @@
+import time
+import threading
+import numpy as np
+
+from helpers.my_recordings import RecordingWriter, load_recording
+
+
+def test_close_racing_writes_keeps_every_accepted_chunk(tmp_path):
+    for trial in range(50):
+        writer = RecordingWriter(str(tmp_path / f'{trial}.cvx'), 'race', flush_interval = 0.01)
+        accepted = []
+
+        def feed():
+            block = 0
+            while True:
+                chunk = np.arange(block*32, (block + 1)*32) % 30000
+                if not writer.write(chunk, received = time.monotonic()):
+                    return
+                accepted.append(chunk)
+                block += 1
+
+        feeder = threading.Thread(target = feed)
+        feeder.start()
+        time.sleep(0.001*(trial % 5))
+        header = writer.close()
+        feeder.join()
+
+        raw = load_recording(writer.path)[1]['raw']
+        expected = np.concatenate(accepted) if len(accepted) > 0 else np.zeros(0)
+        np.testing.assert_array_equal(raw, expected, err_msg = f'trial {trial}')
+        assert header['samples'] == len(expected)
+        assert writer.queue.qsize() == 0
+        assert not writer.write(np.zeros(4))
+        assert writer.close() is header